@@ -0,0 +1,228 @@
+"""
+Cohort Analytics Module for Stillbirth Risk Assessment
+Aggregates over the stored assessments and their charts: score
+distribution, band mix over time, and risk by gestational age and BMI
+
+Aggregates are whole-column NumPy/pandas operations (bincount, group-bys),
+so they take about a second at 1M assessments. Charts are drawn with
+matplotlib's object API (no pyplot state, safe across Streamlit sessions);
+the app renders them once per history version and reuses the PNGs.
+
+    python analytics.py --rows 1000000      # timings on a synthetic history
+"""
+
+import argparse
+import io
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from matplotlib.figure import Figure
+
+from report import _arabic_text
+
+BANDS = ("Low", "Moderate", "High")
+BAND_LABELS_AR = ("منخفض", "متوسط", "مرتفع")
+BAND_COLORS = ("#16a34a", "#d97706", "#dc2626")
+
+# Upper bounds (inclusive) of the Low and Moderate risk percentages
+BAND_LIMITS = (33, 66)
+
+SCORE_BIN_WIDTH = 5
+
+# Gestational age bins (weeks): extremely/very/moderate-to-late preterm, term
+GESTATION_EDGES = (0, 28, 32, 37, np.inf)
+GESTATION_LABELS = ("<28", "28–31", "32–36", "37+")
+
+# WHO BMI classes
+BMI_EDGES = (0, 18.5, 25, 30, 35, 40, np.inf)
+BMI_LABELS = ("<18.5", "18.5–24.9", "25–29.9", "30–34.9", "35–39.9", "40+")
+
+# Finest time unit that keeps the band mix within this many periods
+MAX_PERIODS = 48
+
+
+def risk_bands(score_pct):
+    """0 (Low), 1 (Moderate) or 2 (High) per risk percentage"""
+    return np.searchsorted(BAND_LIMITS, score_pct, side="left")
+
+
+def _numbers(column):
+    return pd.to_numeric(column, errors="coerce").to_numpy(dtype=np.float64)
+
+
+def _period_unit(times):
+    """Hours, days or months, whichever keeps the band mix within MAX_PERIODS"""
+    for unit in ("h", "D"):
+        floored = times.astype(f"datetime64[{unit}]")
+        if (floored.max() - floored.min()).astype(np.int64) < MAX_PERIODS:
+            return unit
+    return "M"
+
+
+def _by_bins(values, edges, labels, score, high):
+    """Assessments, mean risk and share of High per bin of values"""
+    codes = np.searchsorted(edges, values, side="right") - 1
+    known = ~np.isnan(values)
+    codes, score, high = codes[known], score[known], high[known]
+    count = np.bincount(codes, minlength=len(labels))
+    total = np.bincount(codes, weights=score, minlength=len(labels))
+    high_count = np.bincount(codes, weights=high, minlength=len(labels))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return pd.DataFrame({
+            "assessments": count,
+            "mean_risk": np.round(total / count, 1),
+            "high_share": np.round(high_count / count, 4),
+        }, index=pd.Index(labels, name="bin"))
+
+
+def cohort_aggregates(df):
+    """
+    Cohort aggregates of a history table
+
+    Rows without a risk percentage are left out; bands come from the
+    percentage, so English and Arabic rows count together.
+
+    Args:
+        df (pd.DataFrame): History table (HISTORY_COLUMNS)
+
+    Returns:
+        dict: assessments, score_counts (per SCORE_BIN_WIDTH bin), band_mix
+        (period x band counts), period_unit, by_gestation and by_bmi
+        (assessments, mean_risk, high_share per bin)
+    """
+    score = _numbers(df["score_pct"])
+    scored = ~np.isnan(score)
+    score = score[scored]
+    bands = risk_bands(score)
+    high = (bands == 2).astype(np.float64)
+
+    n_bins = 100 // SCORE_BIN_WIDTH
+    score_counts = np.bincount(np.minimum(score // SCORE_BIN_WIDTH, n_bins - 1).astype(np.int64),
+                               minlength=n_bins)
+
+    times = pd.to_datetime(df["timestamp"][scored], format="%Y-%m-%d %H:%M:%S", errors="coerce").to_numpy()
+    dated = ~np.isnat(times)
+    unit = _period_unit(times[dated]) if dated.any() else "D"
+    periods = times[dated].astype(f"datetime64[{unit}]")
+    uniques, period_codes = np.unique(periods, return_inverse=True)
+    mix = np.bincount(period_codes * 3 + bands[dated], minlength=len(uniques) * 3).reshape(-1, 3)
+    band_mix = pd.DataFrame(mix, index=pd.Index(uniques, name="period"), columns=list(BANDS))
+
+    return {
+        "assessments": int(scored.sum()),
+        "score_counts": score_counts,
+        "band_mix": band_mix,
+        "period_unit": unit,
+        "by_gestation": _by_bins(_numbers(df["gestational_weeks"])[scored], GESTATION_EDGES, GESTATION_LABELS,
+                                 score, high),
+        "by_bmi": _by_bins(_numbers(df["bmi"])[scored], BMI_EDGES, BMI_LABELS, score, high),
+    }
+
+
+def _png(fig):
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png", dpi=110, bbox_inches="tight")
+    return buf.getvalue()
+
+
+def _figure():
+    fig = Figure(figsize=(6.0, 3.4))
+    ax = fig.add_subplot()
+    ax.spines[["top", "right"]].set_visible(False)
+    ax.grid(axis="y", alpha=0.3)
+    ax.set_axisbelow(True)
+    return fig, ax
+
+
+def _period_labels(periods, unit):
+    fmt = {"h": "%m-%d %H:00", "D": "%Y-%m-%d", "M": "%Y-%m"}[unit]
+    return pd.DatetimeIndex(periods.astype("datetime64[s]")).strftime(fmt)
+
+
+def render_charts(aggregates, arabic=False):
+    """
+    PNG charts of cohort_aggregates()
+
+    Titles are left to the page (the browser shapes Arabic better than
+    matplotlib); axis labels and legends are localized.
+
+    Returns:
+        dict: score_distribution, band_mix, by_gestation, by_bmi -> PNG bytes
+    """
+    def L(en, ar):
+        return _arabic_text(ar) if arabic else en
+
+    band_names = [L(en, ar) for en, ar in zip(BANDS, BAND_LABELS_AR)]
+    charts = {}
+
+    fig, ax = _figure()
+    counts = aggregates["score_counts"]
+    lefts = np.arange(len(counts)) * SCORE_BIN_WIDTH
+    colors = [BAND_COLORS[b] for b in risk_bands(lefts + SCORE_BIN_WIDTH - 1)]
+    ax.bar(lefts, counts, width=SCORE_BIN_WIDTH, align="edge", color=colors, edgecolor="white")
+    ax.set_xlim(0, 100)
+    ax.set_xlabel(L("Risk index", "مؤشر الخطورة"))
+    ax.set_ylabel(L("Assessments", "التقييمات"))
+    charts["score_distribution"] = _png(fig)
+
+    fig, ax = _figure()
+    mix = aggregates["band_mix"]
+    x = np.arange(len(mix))
+    bottom = np.zeros(len(mix))
+    for band, name, color in zip(BANDS, band_names, BAND_COLORS):
+        ax.bar(x, mix[band].to_numpy(), bottom=bottom, color=color, label=name, width=0.8)
+        bottom += mix[band].to_numpy()
+    labels = _period_labels(mix.index.to_numpy(), aggregates["period_unit"])
+    step = max(1, len(labels) // 8)
+    ax.set_xticks(x[::step], labels[::step], rotation=30, ha="right", fontsize=8)
+    ax.set_ylabel(L("Assessments", "التقييمات"))
+    ax.legend(frameon=False, fontsize=8, ncol=3, loc="lower center", bbox_to_anchor=(0.5, 1.0))
+    charts["band_mix"] = _png(fig)
+
+    for name, xlabel in (("by_gestation", L("Gestational age (weeks)", "عمر الحمل (بالأسابيع)")),
+                         ("by_bmi", "BMI")):
+        fig, ax = _figure()
+        table = aggregates[name]
+        x = np.arange(len(table))
+        mean_risk = table["mean_risk"].fillna(0).to_numpy()
+        ax.bar(x, mean_risk, color=[BAND_COLORS[b] for b in risk_bands(np.rint(mean_risk))], width=0.7)
+        for xi, value, n in zip(x, mean_risk, table["assessments"]):
+            ax.annotate(f"n={n:,}", (xi, value), ha="center", va="bottom", fontsize=7,
+                        xytext=(0, 2), textcoords="offset points")
+        ax.set_xticks(x, table.index)
+        ax.set_ylim(0, 105)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(L("Mean risk index", "متوسط مؤشر الخطورة"))
+        charts[name] = _png(fig)
+
+    return charts
+
+
+def main():
+    from benchmarks import synthetic_history
+
+    parser = argparse.ArgumentParser(description="Time cohort aggregates and chart rendering")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    df = synthetic_history(args.rows)
+    start = time.perf_counter()
+    aggregates = cohort_aggregates(df)
+    aggregate_s = time.perf_counter() - start
+    start = time.perf_counter()
+    charts = render_charts(aggregates)
+    render_s = time.perf_counter() - start
+    print(json.dumps({
+        "rows": args.rows,
+        "aggregate_s": round(aggregate_s, 3),
+        "render_s": round(render_s, 3),
+        "png_kb": {name: round(len(png) / 1024, 1) for name, png in charts.items()},
+    }, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
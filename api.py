@@ -0,0 +1,278 @@
+"""
+Scoring API for Stillbirth Risk Assessment
+Headless HTTP/JSON service on top of preprocessing.py, runnable separately from
+the Streamlit app:
+
+    python api.py --host 0.0.0.0 --port 8000
+
+Endpoints:
+    GET  /health        -> {"status": "ok", "features": 20, "model_version": ...}
+    GET  /model         -> serving model version and reload status
+    GET  /shadow        -> candidate-vs-serving disagreement summary (SHADOW_MODEL_PATH)
+    POST /score         user_input dict -> predict_risk result
+    POST /score/batch   {"inputs": [user_input, ...]} -> {"results": [...]}
+                        (rows outside the form's ranges get {"errors": [...]})
+    POST /explain       {"inputs": user_input, "language": "en"|"ar"}
+                        -> prediction plus rule-based explanation bullets
+    POST /report        {"patient_id", "patient_name", "inputs", "language"}
+                        -> application/pdf risk report
+
+    GET  /metrics/batching -> micro-batch size and queueing delay stats
+    GET  /store         -> result store entries and hit rates (RESULT_STORE_PATH)
+    GET  /singleflight  -> coalesced duplicate requests per flight
+    GET  /metrics       -> request latency histograms (Prometheus text format)
+
+Inputs are checked against the form's ranges and choices (validation.py);
+a request with invalid values gets a 400 listing every problem.
+
+The model is loaded once at startup and kept in memory; a ModelManager
+(model_manager.py) swaps in new versions of the model files without a
+restart, and every result carries the 'model_version' that produced it.
+Connections use HTTP/1.1 keep-alive, so a client can send many requests
+over one socket. With --batch-window-ms, concurrent /score requests are
+coalesced by a shared MicroBatcher (batching.py) into one model call per
+batch. With RESULT_STORE_PATH set, scores and PDFs already in the result
+store (result_store.py) are returned from it instead of being computed
+again. Identical requests in flight at the same time are scored and
+rendered once and share the result (singleflight.py).
+
+Throughput target: single-row /score should sustain 2,000 requests per
+second per server core over keep-alive connections. Measured: 1,400-2,200
+requests per second of server CPU (4 keep-alive client threads, 4,000
+requests, default options, client and server sharing one core; 1,050-1,650
+requests per second wall clock). Batch callers should prefer /score/batch.
+"""
+
+import argparse
+import json
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from batching import MicroBatcher
+from metrics import API_REQUEST_SECONDS, render_prometheus, span
+from model_manager import MODEL_POLL_SECONDS, ModelManager
+from report import build_pdf, explanation_for_band, localized_band
+from result_store import content_key, open_store, score_with_store, snapshot_keys, stored
+from singleflight import SingleFlight
+from validation import clean_records, validate_input, validate_inputs
+
+# Request bodies larger than this are rejected (batch payloads included)
+MAX_BODY_BYTES = 16 * 1024 * 1024
+
+# Serving model, set by make_server
+MODELS = None
+
+# Content-addressed result store (RESULT_STORE_PATH), set by make_server
+STORE = None
+
+# Identical concurrent requests run once (keyed like the result store)
+SCORE_FLIGHT = SingleFlight("score")
+REPORT_FLIGHT = SingleFlight("report")
+
+# Shared micro-batch scheduler for /score, set by make_server when enabled
+BATCHER = None
+
+
+class BadRequest(Exception):
+    """Raised for malformed request bodies; reported as HTTP 400"""
+
+
+def _report_inputs(user_input):
+    """Inputs table for build_pdf, using the same defaults as preprocessing"""
+    return {
+        "gestational_weeks": user_input.get("gestational_weeks", 39),
+        "bmi": user_input.get("bmi", 27.0),
+        "systolic_bp": user_input.get("systolic_bp", 120),
+        "diastolic_bp": user_input.get("diastolic_bp", 75),
+        "prenatal_visits": user_input.get("prenatal_visits", 4),
+        "diabetes": "yes" if user_input.get("diabetes") in ["yes", "نعم"] else "no",
+        "hypertension": "yes" if user_input.get("hypertension") in ["yes", "نعم"] else "no",
+    }
+
+
+def _validated(user_input):
+    """The input with nulls dropped and choices normalised; BadRequest if out of the form's ranges"""
+    errors, clean = validate_input(user_input)
+    if errors:
+        raise BadRequest("invalid inputs: " + "; ".join(errors))
+    return clean
+
+
+def _inputs_of(body):
+    user_input = body.get("inputs", {})
+    if not isinstance(user_input, dict):
+        raise BadRequest("'inputs' must be an object")
+    return _validated(user_input)
+
+
+def score_batch(user_inputs):
+    return score_with_store(STORE, MODELS.current(), user_inputs, MODELS.score_batch,
+                            on_reused=MODELS.shadow_served)
+
+
+def predict_risk(user_input):
+    score = BATCHER.score if BATCHER is not None else lambda u: score_batch([u])[0]
+    key = snapshot_keys(MODELS.current(), [user_input])[0]
+    return dict(SCORE_FLIGHT.do(key, lambda: score(user_input)))
+
+
+def handle_score(body):
+    return predict_risk(_validated(body))
+
+
+def handle_score_batch(body):
+    inputs = body.get("inputs")
+    if not isinstance(inputs, list) or not all(isinstance(u, dict) for u in inputs):
+        raise BadRequest("'inputs' must be a list of objects")
+    # Invalid rows get their errors in place of a result; the rest are scored
+    report = validate_inputs(inputs)
+    scored = iter(score_batch(clean_records(report)) if report.valid.any() else [])
+    return {"results": [next(scored) if ok else {"errors": report.errors[i]}
+                        for i, ok in enumerate(report.valid)]}
+
+
+def handle_explain(body):
+    user_input = _inputs_of(body)
+    arabic = body.get("language") == "ar"
+    prediction = predict_risk(user_input)
+    band_text = localized_band(prediction["risk_level"], arabic)
+    bullets = explanation_for_band(_report_inputs(user_input), band_text, user_input, arabic)
+    return dict(prediction, explanation=bullets)
+
+
+def handle_report(body):
+    user_input = _inputs_of(body)
+    arabic = body.get("language") == "ar"
+    prediction = predict_risk(user_input)
+    band_text = localized_band(prediction["risk_level"], arabic)
+    d = _report_inputs(user_input)
+    pdf_args = dict(
+        patient_id=str(body.get("patient_id", "")),
+        patient_name=str(body.get("patient_name", "")),
+        timestamp=body.get("timestamp") or datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        pct=prediction["risk_percentage"],
+        band_text=band_text,
+        band_code=prediction["risk_band"],
+        bullets=explanation_for_band(d, band_text, user_input, arabic),
+        d=d,
+        AR=arabic
+    )
+    key = content_key("pdf", pdf_args)
+    return REPORT_FLIGHT.do(key, lambda: stored(STORE, "pdf", key, lambda: build_pdf(**pdf_args)))
+
+
+ROUTES = {
+    "/score": handle_score,
+    "/score/batch": handle_score_batch,
+    "/explain": handle_explain,
+    "/report": handle_report,
+}
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps the connection open between requests; without
+    # TCP_NODELAY the separate header and body writes stall on delayed ACKs
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        # Per-request access logging costs more than scoring a row
+        pass
+
+    def _send(self, status, payload, content_type="application/json"):
+        if content_type == "application/json":
+            payload = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path == "/health":
+            snapshot = MODELS.current()
+            self._send(200, {"status": "ok", "features": len(snapshot.feature_names),
+                             "model_version": snapshot.version})
+        elif self.path == "/model":
+            self._send(200, MODELS.status())
+        elif self.path == "/shadow":
+            self._send(200, MODELS.shadow.summary() if MODELS.shadow is not None else {"enabled": False})
+        elif self.path == "/metrics":
+            self._send(200, render_prometheus().encode("utf-8"), content_type="text/plain; version=0.0.4")
+        elif self.path == "/metrics/batching":
+            self._send(200, BATCHER.stats() if BATCHER is not None else {"enabled": False})
+        elif self.path == "/store":
+            self._send(200, STORE.stats() if STORE is not None else {"enabled": False})
+        elif self.path == "/singleflight":
+            self._send(200, {f.name: f.stats() for f in (SCORE_FLIGHT, REPORT_FLIGHT)})
+        else:
+            self._send(404, {"error": f"unknown path {self.path}"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            self._send(413, {"error": "request body too large"})
+            return
+        raw = self.rfile.read(length)
+
+        handler = ROUTES.get(self.path)
+        if handler is None:
+            self._send(404, {"error": f"unknown path {self.path}"})
+            return
+
+        try:
+            body = json.loads(raw or b"{}")
+            if not isinstance(body, dict):
+                raise BadRequest("request body must be a JSON object")
+            with span(self.path, API_REQUEST_SECONDS):
+                result = handler(body)
+        except (BadRequest, ValueError, TypeError) as e:
+            self._send(400, {"error": str(e)})
+            return
+        except Exception as e:
+            self._send(500, {"error": str(e)})
+            return
+
+        if isinstance(result, bytes):
+            self._send(200, result, content_type="application/pdf")
+        else:
+            self._send(200, result)
+
+
+def make_server(host="127.0.0.1", port=8000, batch_window_ms=0.0, max_batch=64,
+                model_poll_seconds=MODEL_POLL_SECONDS):
+    """Create the scoring server with the model already loaded"""
+    global BATCHER, MODELS, STORE
+    MODELS = ModelManager(poll_seconds=model_poll_seconds)
+    STORE = open_store()
+    if batch_window_ms > 0:
+        BATCHER = MicroBatcher(score_batch, window_ms=batch_window_ms, max_batch=max_batch)
+    server = ThreadingHTTPServer((host, port), ScoringHandler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stillbirth risk scoring API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--batch-window-ms", type=float, default=0.0,
+                        help="Coalesce concurrent /score calls for up to this long (0 disables)")
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--model-poll-seconds", type=float, default=MODEL_POLL_SECONDS,
+                        help="How often to check the model files for a new version (0 disables)")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.batch_window_ms, args.max_batch, args.model_poll_seconds)
+    print(f"Scoring API listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
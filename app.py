@@ -2,9 +2,9 @@
 # Pro styled bilingual dashboard — 3-level gauge (Low / Moderate / High)
 # Real XGBoost ML model for stillbirth risk prediction
 # PDF export: branded header, risk badge, 3-segment gauge with labels, inputs table.
-import math
-import io
+import gc
 import os
+import time
 import base64
 from datetime import datetime
 import pandas as pd
@@ -12,11 +12,37 @@ import numpy as np
 import streamlit as st
 from openai import OpenAI
 from dotenv import load_dotenv
-import joblib
+from preprocessing import predict_stillbirth_risk_batch
+from model_manager import ModelManager
+from result_store import content_key, open_store, score_with_store, snapshot_keys, stored
+from singleflight import SingleFlight
+from batching import MicroBatcher
+from profiling import MODES as PROFILE_MODES, RerunProfiler, summarize as summarize_profiles
+from metrics import RERUN_SECONDS, serve_metrics, span, write_metrics_file
+from form_schema import NUMBER_INPUTS
+from llm_explain import EXTRA_HEADERS, SYSTEM_PROMPT, parse_bullets, user_prompt
+from analytics import cohort_aggregates, render_charts
+from history import (SORT_COLUMNS, HistoryIndex, calculate_statistics, empty_history, history_arrow, history_csv,
+                     history_page, history_parquet, read_history, search_mask)
+from history_spill import SpillRegistry
+
+# Rerun latency is measured from here to the end of the script
+_rerun_start = time.perf_counter()
 
 # Load environment variables from .env file
 load_dotenv()
 
+# On-demand profiling: PROFILE_RERUNS=sample|cprofile profiles every rerun;
+# with PROFILE_ALLOW_QUERY=1 (operators only), ?profile=sample|cprofile profiles one session.
+# Stopped at the end of the script; a rerun cut short by st.stop(), st.rerun()
+# or an exception is stopped by the profiler itself (see RerunProfiler)
+_profile_mode = os.getenv("PROFILE_RERUNS") or (
+    st.query_params.get("profile") if os.getenv("PROFILE_ALLOW_QUERY") == "1" else None
+)
+if _profile_mode == "1":
+    _profile_mode = "sample"
+_profiler = RerunProfiler(_profile_mode, root_file=__file__).start() if _profile_mode in PROFILE_MODES else None
+
 # =============================
 # OpenRouter LLM Configuration (for AI Explanations)
 # =============================
@@ -27,6 +53,14 @@ OPENROUTER_MODEL_NAME = "openai/gpt-oss-20b:free"  # Fast and smart model
 # Debug mode: Set to True to see raw AI responses
 DEBUG_AI = False  # Set to False in production
 
+# Micro-batching of concurrent evaluations across sessions
+SCORING_BATCH_WINDOW_MS = float(os.getenv("SCORING_BATCH_WINDOW_MS", "2"))
+SCORING_MAX_BATCH = int(os.getenv("SCORING_MAX_BATCH", "32"))
+
+# Latency metrics: serve Prometheus text on METRICS_PORT and/or write it to METRICS_FILE
+METRICS_PORT = os.getenv("METRICS_PORT")
+METRICS_FILE = os.getenv("METRICS_FILE")
+
 # OPTION 2: Or keep using .env file (more secure)
 # If .env file exists, it will override the above
 if os.getenv("OPENROUTER_API_KEY"):
@@ -34,12 +68,13 @@ if os.getenv("OPENROUTER_API_KEY"):
 if os.getenv("OPENROUTER_MODEL"):
     OPENROUTER_MODEL_NAME = os.getenv("OPENROUTER_MODEL")
 
-# Initialize OpenAI client
+# OpenAI-compatible endpoint; point at openrouter_standin.py for offline runs
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
 
 # Initialize OpenAI client
 try:
     client = OpenAI(
-        base_url="https://openrouter.ai/api/v1",
+        base_url=OPENROUTER_BASE_URL,
         api_key=OPENROUTER_API_KEY,
     )
     MODEL = OPENROUTER_MODEL_NAME
@@ -49,150 +84,79 @@ except Exception as e:
     print(f"LLM client initialization failed: {e}")
 
 
+@st.cache_resource
+def start_metrics_server(port):
+    """Serve /metrics once per process (shared by all sessions)"""
+    return serve_metrics(port, os.getenv("METRICS_HOST", "127.0.0.1"))
+
+if METRICS_PORT:
+    start_metrics_server(int(METRICS_PORT))
+
+
 # =============================
 # XGBoost Model Loading & Prediction Functions
 # =============================
 
 @st.cache_resource
 def load_xgboost_model():
-    """Load the XGBoost model and feature names (cached for performance)"""
+    """Model manager for the XGBoost model (one per process; hot-reloads new versions)"""
     try:
-        # Load model
-        model_path = os.path.join(os.path.dirname(__file__), 'xgb_model.joblib')
-        model = joblib.load(model_path)
-        
-        # Load feature names
-        features_path = os.path.join(os.path.dirname(__file__), 'features_used.txt')
-        with open(features_path, 'r') as f:
-            feature_names = [line.strip() for line in f if line.strip() and line.strip() != 'feature']
-        
-        return model, feature_names
+        # Model artifact (feature list from its manifest), or the joblib fallback;
+        # MODEL_POLL_SECONDS sets how often the files are checked for a new version
+        manager = ModelManager()
     except Exception as e:
         st.error(f"Error loading model: {str(e)}")
-        return None, None
+        return None
+    # Exempt the libraries and model from garbage collection, as worker_pool
+    # does: Streamlit runs a full gc.collect() after every rerun, fragment
+    # reruns included, and walking the ~177k startup objects took 130 ms
+    gc.collect()
+    gc.freeze()
+    return manager
 
-def preprocess_input_for_model(user_input):
-    """Convert user input to model features"""
-    features = {}
-    
-    # Feature 1: pregnancyduration
-    features['pregnancyduration'] = user_input.get('gestational_weeks', 39)
-    
-    # Feature 2: babyweight
-    features['babyweight'] = user_input.get('babyweight', 3.2)
-    
-    # Feature 3: visit_pregnancy_clinic
-    features['visit_pregnancy_clinic'] = user_input.get('prenatal_visits', 4)
-    
-    # Feature 4: total_emergency_visits
-    features['total_emergency_visits'] = user_input.get('total_emergency_visits', 0)
-    
-    # Feature 5: height
-    features['height'] = user_input.get('height', 165)
-    
-    # Feature 6: bmi
-    bmi = user_input.get('bmi', 27.0)
-    features['bmi'] = bmi
-    
-    # Feature 7: weight (calculated from BMI and height)
-    height_m = features['height'] / 100.0
-    features['weight'] = bmi * (height_m ** 2)
-    
-    # Feature 8: systolic
-    features['systolic'] = user_input.get('systolic_bp', 120)
-    
-    # Feature 9: diastolic
-    features['diastolic'] = user_input.get('diastolic_bp', 75)
-    
-    # Feature 10: has_diabetes
-    diabetes = user_input.get('diabetes', 'no')
-    features['has_diabetes'] = 1 if diabetes in ['yes', 'نعم'] else 0
-    
-    # Feature 11: has_hypertension
-    hypertension = user_input.get('hypertension', 'no')
-    features['has_hypertension'] = 1 if hypertension in ['yes', 'نعم'] else 0
-    
-    # Feature 12: Creatinine
-    features['Creatinine (Mass/volume) in Serum or Plasma_mean'] = user_input.get('creatinine_mean', 0.0)
-    
-    # Feature 13: HbA1c
-    features['Hemoglobin A1c/Hemoglobin. Total in Blood_mean'] = user_input.get('hba1c_mean', 0.0)
-    
-    # Feature 14: Potassium
-    features['Potassium (Moles/volume) in Serum or Plasma_mean'] = user_input.get('potassium_mean', 0.0)
-    
-    # Feature 15: ferric carboxymaltose_times
-    features['ferric carboxymaltose_times'] = user_input.get('ferric_carboxymaltose_times', 0)
-    
-    # Feature 16: metoprolol_times
-    features['metoprolol_times'] = user_input.get('metoprolol_times', 0)
-    
-    # Feature 17: total_inpatient_visits
-    features['total_inpatient_visits'] = user_input.get('total_inpatient_visits', 0)
-    
-    # Feature 18: twins
-    features['twins'] = user_input.get('twins', 0)
-    
-    # Feature 19: deliverytype
-    features['deliverytype'] = user_input.get('deliverytype', 1)
-    
-    # Feature 20: year (mother's age)
-    features['year'] = user_input.get('year', 28)
-    
-    return pd.DataFrame([features])
+@st.cache_resource
+def get_scoring_scheduler(_manager):
+    """Micro-batch scheduler shared by all sessions (concurrent evaluations score together)"""
+    return MicroBatcher(
+        lambda user_inputs: _manager.score_batch(user_inputs, predict_stillbirth_risk_batch),
+        window_ms=SCORING_BATCH_WINDOW_MS,
+        max_batch=SCORING_MAX_BATCH
+    )
+
+@st.cache_resource
+def get_result_store():
+    """Content-addressed result store shared by all sessions (RESULT_STORE_PATH), or None"""
+    return open_store()
+
+@st.cache_resource
+def get_flights():
+    """Single-flight groups shared by all sessions (identical concurrent work runs once)"""
+    return {name: SingleFlight(name) for name in ("score", "explanation", "pdf")}
 
 def predict_stillbirth_risk(user_input):
-    """Make prediction using XGBoost model"""
-    model, feature_names = load_xgboost_model()
+    """Make prediction using XGBoost model (result includes 'model_version')"""
+    manager = load_xgboost_model()
     
-    if model is None or feature_names is None:
+    if manager is None:
         raise Exception("Model not loaded properly")
     
-    # Preprocess input
-    features_df = preprocess_input_for_model(user_input)
-    
-    # Ensure features are in correct order
-    features_df = features_df[feature_names]
-    
-    # Make prediction (model predicts probability of being alive)
-    alive_probability = model.predict_proba(features_df)[0, 1]
-    death_probability = 1 - alive_probability
-    
-    # Convert to percentage
-    risk_percentage = int(round(death_probability * 100))
-    
-    # Classify risk level
-    if risk_percentage <= 33:
-        risk_level = 'Low'
-        risk_band = 'low'
-    elif risk_percentage <= 66:
-        risk_level = 'Moderate'
-        risk_band = 'mod'
-    else:
-        risk_level = 'High'
-        risk_band = 'high'
-    
-    return {
-        'risk_percentage': risk_percentage,
-        'risk_level': risk_level,
-        'risk_band': risk_band
-    }
+    def score(user_inputs):
+        return [get_scoring_scheduler(manager).score(user_inputs[0])]
 
-# ---- PDF deps ----
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.lib import colors
-from reportlab.lib.units import mm
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+    # Inputs assessed before (double submits, language toggles) come from the store;
+    # the same inputs evaluated by several sessions at once are scored once
+    snapshot = manager.current()
+    key = snapshot_keys(snapshot, [user_input])[0]
+    return dict(get_flights()["score"].do(
+        key, lambda: score_with_store(get_result_store(), snapshot, [user_input], score,
+                                      on_reused=manager.shadow_served)[0]
+    ))
+
+# ---- PDF report + rule-based explanation (shared with api.py) ----
+from report import ARABIC_SUPPORT, explanation_for_band, build_pdf
 
 # ---- Arabic text support ----
-try:
-    from arabic_reshaper import reshape
-    from bidi.algorithm import get_display
-    ARABIC_SUPPORT = True
-except ImportError:
-    ARABIC_SUPPORT = False
+if not ARABIC_SUPPORT:
     st.warning("⚠️ For proper Arabic text in PDFs, install: pip install arabic-reshaper python-bidi")
 
 st.set_page_config(page_title="Stillbirth Risk Assessment", page_icon="🏥", layout="wide")
@@ -795,6 +759,9 @@ div[data-testid="stTextInput"] label:contains("*") {
 </style>
 """, unsafe_allow_html=True)
 
+# Load the model (and freeze the startup objects) before the page is built
+_models = load_xgboost_model()
+
 # =============================
 # Language
 # =============================
@@ -804,6 +771,11 @@ AR = (lang == "العربية")
 def L(en, ar):
     return ar if AR else en
 
+def number_field(col, label, field, **kwargs):
+    # Bounds, default and step come from form_schema, which API and batch validation share
+    low, high, default, step = NUMBER_INPUTS[field]
+    return col.number_input(label, low, high, default, step=step, **kwargs)
+
 # ===== RTL layout when Arabic is active (keep sidebar mechanics working) =====
 if AR:
     st.markdown("""
@@ -853,46 +825,28 @@ else:
 # App State (History)
 # =============================
 if "history" not in st.session_state:
-    st.session_state.history = pd.DataFrame(columns=[
-        "timestamp", "patient_id", "patient_name",
-        "risk_level", "score_pct", "explanation",
-        "gestational_weeks", "babyweight", "bmi", "height",
-        "systolic_bp", "diastolic_bp", "prenatal_visits",
-        "emergency_visits", "inpatient_visits",
-        "diabetes", "hypertension", "twins", "deliverytype"
-    ])
+    st.session_state.history = empty_history()
+    # Bumped on every append; derived tables are cached per version
+    st.session_state.history_version = 0
 
-# =============================
-# Statistics Calculation
-# =============================
-def calculate_statistics():
-    """Calculate statistics from the history"""
-    df = st.session_state.history
-    if len(df) == 0:
-        return {
-            "total_cases": 0,
-            "low_risk": 0,
-            "moderate_risk": 0,
-            "high_risk": 0,
-            "avg_score": 0
-        }
-    
-    total_cases = len(df)
-    
-    # Count risk levels - handle both English and Arabic
-    low_risk = len(df[df["risk_level"].str.contains("Low|منخفض", case=False, na=False)])
-    moderate_risk = len(df[df["risk_level"].str.contains("Moderate|متوسط", case=False, na=False)])
-    high_risk = len(df[df["risk_level"].str.contains("High|مرتفع", case=False, na=False)])
-    
-    avg_score = df["score_pct"].mean() if total_cases > 0 else 0
-    
-    return {
-        "total_cases": total_cases,
-        "low_risk": low_risk,
-        "moderate_risk": moderate_risk,
-        "high_risk": high_risk,
-        "avg_score": round(avg_score, 1)
-    }
+@st.cache_resource
+def get_spill_registry():
+    """Memory accounting of every session's history (HISTORY_MEMORY_MB, HISTORY_MEMORY_TOTAL_MB)"""
+    return SpillRegistry()
+
+# Older rows of a long history keep their bulky columns on disk; the spill
+# follows the table if it is replaced
+if st.session_state.get("history_spill") is None or st.session_state.history_spill.df is not st.session_state.history:
+    st.session_state.history_spill = get_spill_registry().attach(st.session_state.history)
+st.session_state.history_spill.touch()
+
+def history_cached(name, compute, *key):
+    """compute() once per history version, language and key in this session (latest key kept)"""
+    key = (st.session_state.history_version, AR, *key)
+    cached = st.session_state.setdefault("history_cache", {}).get(name)
+    if cached is None or cached[0] != key:
+        cached = st.session_state.history_cache[name] = (key, compute())
+    return cached[1]
 
 # =============================
 # XGBoost Model Integration
@@ -910,83 +864,22 @@ def openrouter_explain_risk(band_text, pct, inputs, arabic=False):
     Use GPT-OSS-20B from OpenRouter to explain the risk level.
     Returns up to 4 short bullet points.
     """
-    language = "Arabic" if arabic else "English"
-    system_prompt = (
-        "You are a clinical assistant specializing in maternal and neonatal health. "
-        "You MUST provide exactly 4 bullet points explaining stillbirth risk factors. "
-        "Each bullet point must:\n"
-        "1. Start with a dash (-) or bullet (•)\n"
-        "2. Be 1-2 sentences maximum\n"
-        "3. Focus on one specific risk factor from the patient data\n"
-        "4. Be factual and clinical (no diagnosis or treatment advice)\n\n"
-        "Format example:\n"
-        "- High BMI increases cardiovascular stress during pregnancy\n"
-        "- Limited prenatal visits reduce early detection of complications\n"
-        "- Elevated blood pressure may indicate preeclampsia risk\n"
-        "- Advanced gestational age requires closer monitoring"
-    )
-
-    # Create a more detailed user prompt with specific factors
-    risk_factors = []
-    if inputs.get("bmi", 0) >= 30:
-        risk_factors.append(f"BMI: {inputs['bmi']}")
-    if inputs.get("systolic_bp", 0) >= 140:
-        risk_factors.append(f"Systolic BP: {inputs['systolic_bp']}")
-    if inputs.get("prenatal_visits", 0) < 4:
-        risk_factors.append(f"Prenatal visits: {inputs['prenatal_visits']}")
-    if inputs.get("gestational_weeks", 0) < 37:
-        risk_factors.append(f"Gestational weeks: {inputs['gestational_weeks']}")
-    if inputs.get("diabetes") in ['yes', 'نعم']:
-        risk_factors.append("Diabetes: present")
-    if inputs.get("hypertension") in ['yes', 'نعم']:
-        risk_factors.append("Hypertension: present")
-    
-    factors_text = ", ".join(risk_factors) if risk_factors else "Standard pregnancy parameters"
-
-    user_prompt = f"""
-Language: {language}
-Risk Level: {band_text} ({pct}%)
-Key Risk Factors: {factors_text}
-
-Provide exactly 4 bullet points explaining the risk level based on these factors.
-"""
-
     try:
         completion = client.chat.completions.create(
             model=MODEL,
             messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": user_prompt(band_text, pct, inputs, arabic)},
             ],
             temperature=0.5,  # Increased for more varied responses
             max_tokens=400,   # Increased to ensure complete responses
-            extra_headers={
-                "HTTP-Referer": "https://yourappname.streamlit.app",
-                "X-Title": "Stillbirth Risk Assessment"
-            }
+            extra_headers=EXTRA_HEADERS
         )
 
         text = completion.choices[0].message.content.strip()
         
-        # Parse bullet points more reliably
-        bullets = []
-        for line in text.split("\n"):
-            line = line.strip()
-            # Remove common bullet point markers
-            if line.startswith(("- ", "• ", "* ", "1.", "2.", "3.", "4.")):
-                line = line.lstrip("-•* 1234.")
-                line = line.strip()
-                if line:  # Only add non-empty lines
-                    bullets.append(line)
-        
-        # Ensure we have exactly 4 bullets
-        if len(bullets) < 4:
-            # If less than 4, pad with generic ones
-            while len(bullets) < 4:
-                bullets.append("Continue regular monitoring and follow medical advice.")
-        elif len(bullets) > 4:
-            # If more than 4, take first 4
-            bullets = bullets[:4]
+        # Exactly 4 bullets: padded with a generic one, or cut
+        bullets = parse_bullets(text)
         
         # Debug output
         if DEBUG_AI:
@@ -1001,311 +894,13 @@ Provide exactly 4 bullet points explaining the risk level based on these factors
         if DEBUG_AI:
             st.error(f"LLM Error: {str(e)}")
         raise  # Re-raise so the calling code can handle it
-def explanation_for_band(d, band_text, user_input=None):
-    """Fallback explanation when LLM is unavailable"""
-    base_map = {
-        "High": "High risk — increase monitoring.",
-        "Moderate": "Moderate risk — tighten follow-up.",
-        "Low": "Low risk — continue standard care.",
-        "مرتفع": "خطر مرتفع — عزّز المراقبة.",
-        "متوسط": "خطر متوسط — شدد المتابعة.",
-        "منخفض": "خطر منخفض — استمر بالرعاية المعتادة.",
-    }
-    notes = []
-    
-    # Use user_input if available, otherwise use d
-    input_data = user_input if user_input else d
-    
-    if input_data.get("gestational_weeks", 39) < 34:
-        notes.append(L("Preterm pregnancy detected.", "حمل مبكر."))
-    if input_data.get("babyweight", 3.2) < 2.5:
-        notes.append(L("Low birth weight detected.", "وزن منخفض عند الولادة."))
-    if input_data.get("systolic_bp", 120) >= 140 or input_data.get("diastolic_bp", 75) >= 90:
-        notes.append(L("Elevated blood pressure.", "ضغط دم مرتفع."))
-    if str(input_data.get("diabetes", "no")).lower() in ["yes", "نعم"]:
-        notes.append(L("Diabetes present.", "وجود سكري."))
-    if str(input_data.get("hypertension", "no")).lower() in ["yes", "نعم"]:
-        notes.append(L("Hypertension present.", "ارتفاع ضغط الدم."))
-    if input_data.get("prenatal_visits", 4) < 3:
-        notes.append(L("Limited prenatal care.", "قلّة المتابعة قبل الولادة."))
-    if input_data.get("bmi", 27.0) >= 30:
-        notes.append(L("Elevated BMI.", "ارتفاع مؤشر كتلة الجسم."))
-    if input_data.get("total_emergency_visits", 0) > 2:
-        notes.append(L("Multiple emergency visits.", "زيارات طوارئ متعددة."))
-    if input_data.get("hba1c_mean", 0) > 6.5:
-        notes.append(L("Elevated HbA1c levels.", "ارتفاع مستوى السكر التراكمي."))
-    
-    return [base_map[band_text]] + notes[:4]
 
-# =============================
-# PDF helpers (nicer layout)
-# =============================
-BRAND_NAME_EN = "Stillbirth Risk Assessment"
-BRAND_NAME_AR = "تقييم خطر الجنين"
-
-def _arabic_text(text):
-    """Reshape Arabic text for proper display in PDF"""
-    if not text or not ARABIC_SUPPORT:
-        return text
-    try:
-        # Check if text contains Arabic characters
-        if any('\u0600' <= c <= '\u06FF' for c in str(text)):
-            reshaped = reshape(str(text))
-            bidi_text = get_display(reshaped)
-            return bidi_text
-    except:
-        pass
-    return text
-
-def _setup_pdf_font(use_arabic):
-    if use_arabic:
-        # Try multiple font paths for Arabic support
-        font_paths = [
-            "NotoNaskhArabic-Regular.ttf",
-            "C:/Windows/Fonts/arial.ttf",
-            "C:/Windows/Fonts/tahoma.ttf",
-            "C:/Windows/Fonts/simpo.ttf",
-            "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
-            "arial.ttf"
-        ]
-        
-        for ttf in font_paths:
-            if os.path.exists(ttf):
-                try:
-                    pdfmetrics.registerFont(TTFont("ArabicFont", ttf))
-                    return "ArabicFont"
-                except:
-                    continue
-        
-        # Fallback: Try to use Helvetica but warn
-        if not ARABIC_SUPPORT:
-            st.warning("⚠️ Arabic font not found. PDF may not display Arabic text correctly.")
-    
-    return "Helvetica"
-
-def _wrap_lines(c, text, max_width, font, size):
-    c.setFont(font, size)
-    words = str(text).split()
-    lines, cur = [], ""
-    for w in words:
-        probe = (cur + " " + w).strip()
-        if pdfmetrics.stringWidth(probe, font, size) <= max_width:
-            cur = probe
-        else:
-            if cur:
-                lines.append(cur)
-            cur = w
-    if cur:
-        lines.append(cur)
-    return lines or [""]
-
-def _draw_header(c, W, H, AR, font):
-    # Light green matching website background
-    c.setFillColor(colors.HexColor("#ecfdf5"))  # Soft green matching site background
-    c.rect(0, H - 40 * mm, W, 40 * mm, stroke=0, fill=1)
-    
-    # Try to add logo
-    try:
-        logo_paths = ["Streamlit/AI4Life.png", "AI4Life.png"]
-        for logo_path in logo_paths:
-            if os.path.exists(logo_path):
-                c.drawImage(logo_path, 20 * mm, H - 38 * mm, width=25 * mm, height=25 * mm, preserveAspectRatio=True, mask='auto')
-                break
-    except:
-        pass
-    
-    # Dark text for light background
-    c.setFillColor(colors.HexColor("#0f172a"))  # Dark slate for better contrast
-    c.setFont(font, 18)
-    title = _arabic_text(BRAND_NAME_AR) if AR else BRAND_NAME_EN
-    # For Arabic (RTL), draw from right side
-    if AR:
-        title_width = pdfmetrics.stringWidth(title, font, 18)
-        c.drawString(W - 20 * mm - title_width, H - 26 * mm, title)
-    else:
-        c.drawString(50 * mm, H - 26 * mm, title)
-    
-    c.setFont(font, 10)
-    c.setFillColor(colors.HexColor("#475569"))  # Muted gray for subtitle
-    subtitle = "Risk assessment report" if not AR else _arabic_text("تقرير تقييم الخطورة")
-    if AR:
-        subtitle_width = pdfmetrics.stringWidth(subtitle, font, 10)
-        c.drawString(W - 20 * mm - subtitle_width, H - 32 * mm, subtitle)
-    else:
-        c.drawString(50 * mm, H - 32 * mm, subtitle)
-
-def _draw_badge(c, x, y, band_code, band_text, font):
-    colors_map = {"low": "#16a34a", "mod": "#d97706", "high": "#dc2626"}
-    c.setFillColor(colors.HexColor(colors_map[band_code]))
-    c.roundRect(x, y, 42 * mm, 10 * mm, 5 * mm, stroke=0, fill=1)
-    # Add subtle border
-    c.setStrokeColor(colors.HexColor(colors_map[band_code]))
-    c.setLineWidth(0.5)
-    c.roundRect(x, y, 42 * mm, 10 * mm, 5 * mm, stroke=1, fill=0)
-    c.setFillColor(colors.white)
-    c.setFont(font, 11)
-    c.drawCentredString(x + 21 * mm, y + 3.2 * mm, _arabic_text(str(band_text)))
-
-def _draw_gauge(c, x, y, w, h, pct, font, AR):
-    if AR:
-        # Arabic (RTL): High (red) on left, Low (green) on right
-        c.setFillColor(colors.HexColor("#fecaca"))  # High/Red
-        c.rect(x, y, w * 0.33, h, stroke=0, fill=1)
-        c.setFillColor(colors.HexColor("#fde68a"))  # Moderate/Yellow
-        c.rect(x + w * 0.33, y, w * 0.34, h, stroke=0, fill=1)
-        c.setFillColor(colors.HexColor("#86efac"))  # Low/Green
-        c.rect(x + w * 0.67, y, w * 0.33, h, stroke=0, fill=1)
-    else:
-        # English (LTR): Low (green) on left, High (red) on right
-        c.setFillColor(colors.HexColor("#86efac"))  # Low/Green
-        c.rect(x, y, w * 0.33, h, stroke=0, fill=1)
-        c.setFillColor(colors.HexColor("#fde68a"))  # Moderate/Yellow
-        c.rect(x + w * 0.33, y, w * 0.34, h, stroke=0, fill=1)
-        c.setFillColor(colors.HexColor("#fecaca"))  # High/Red
-        c.rect(x + w * 0.67, y, w * 0.33, h, stroke=0, fill=1)
-    
-    # Green border matching website theme
-    c.setStrokeColor(colors.HexColor("#10b981"))
-    c.setLineWidth(1.5)
-    c.rect(x, y, w, h, stroke=1, fill=0)
-    c.setFont(font, 9)
-    c.setFillColor(colors.HexColor("#334155"))
-    
-    if AR:
-        # Arabic labels (RTL): High - Moderate - Low
-        labels = [_arabic_text("مرتفع"), _arabic_text("متوسط"), _arabic_text("منخفض")]
-        c.drawString(x, y - 5 * mm, labels[0])  # High on left
-        c.drawCentredString(x + w * 0.50, y - 5 * mm, labels[1])  # Moderate center
-        c.drawRightString(x + w, y - 5 * mm, labels[2])  # Low on right
-    else:
-        # English labels (LTR): Low - Moderate - High
-        c.drawString(x, y - 5 * mm, "Low")
-        c.drawCentredString(x + w * 0.50, y - 5 * mm, "Moderate")
-        c.drawRightString(x + w, y - 5 * mm, "High")
-    
-    # Draw marker - reverse position for Arabic
-    if AR:
-        marker_pos = x + ((100 - max(2, min(98, pct))) / 100.0) * w
-    else:
-        marker_pos = x + (max(2, min(98, pct)) / 100.0) * w
-    
-    # Green marker line matching website theme
-    c.setStrokeColor(colors.HexColor("#10b981"))
-    c.setLineWidth(3)
-    c.line(marker_pos, y - 2 * mm, marker_pos, y + h + 2 * mm)
-    c.setFont(font, 9)
-    c.setFillColor(colors.HexColor("#10b981"))
-    c.drawCentredString(marker_pos, y + h + 3.5 * mm, str(pct))
-
-def _draw_kv(c, x, y, font, label, value, AR=False):
-    c.setFont(font, 10)
-    c.setFillColor(colors.HexColor("#334155"))
-    
-    if AR:
-        # Right-to-left layout
-        label_ar = _arabic_text(label)
-        value_ar = _arabic_text(str(value))
-        text = f"{label_ar}: {value_ar}"
-        c.drawRightString(x + 170 * mm, y, text)
-    else:
-        c.drawString(x, y, f"{label}: ")
-        c.setFont(font, 10)
-        c.setFillColor(colors.black)
-        c.drawString(x + 42 * mm, y, str(value))
-
-def _draw_inputs_table(c, x, y, font, rows, AR):
-    col_w = [60 * mm, 50 * mm]
-    row_h = 7 * mm
-    c.setFont(font, 10)
-    for i, (k, v) in enumerate(rows):
-        yy = y - i * row_h
-        if i % 2 == 0:
-            # Light green tint for alternating rows
-            c.setFillColor(colors.HexColor("#f0fdf4"))
-            c.rect(x, yy - row_h + 1.5 * mm, sum(col_w), row_h, stroke=0, fill=1)
-        c.setFillColor(colors.black)
-        
-        key_text = _arabic_text(str(k)) if AR else str(k)
-        val_text = _arabic_text(str(v)) if AR else str(v)
-        
-        if AR:
-            # Right-to-left: draw key from right, value from left
-            c.drawRightString(x + col_w[0] + col_w[1] - 3 * mm, yy - 4.7 * mm, key_text)
-            c.drawString(x + 3 * mm, yy - 4.7 * mm, val_text)
-        else:
-            c.drawString(x + 3 * mm, yy - 4.7 * mm, key_text)
-            c.drawRightString(x + col_w[0] + col_w[1] - 3 * mm, yy - 4.7 * mm, val_text)
-
-def build_pdf(patient_id, patient_name, timestamp, pct, band_text, band_code, bullets, d, AR=False):
-    buf = io.BytesIO()
-    c = canvas.Canvas(buf, pagesize=A4)
-    W, H = A4
-    font_main = _setup_pdf_font(AR)
-    c.setTitle("Stillbirth Risk Assessment Report")
-    _draw_header(c, W, H, AR, font_main)
-    y = H - 48 * mm
-    c.setFont(font_main, 11)
-    _draw_kv(c, 20 * mm, y, font_main, ("Timestamp" if not AR else "التاريخ"), timestamp, AR)
-    y -= 7 * mm
-    _draw_kv(c, 20 * mm, y, font_main, ("Patient ID" if not AR else "رقم المريضة"), patient_id, AR)
-    y -= 7 * mm
-    _draw_kv(c, 20 * mm, y, font_main, ("Patient Name" if not AR else "اسم المريضة"), patient_name, AR)
-    y -= 12 * mm
-    _draw_badge(c, 20 * mm, y, band_code, band_text, font_main)
-    c.setFont(font_main, 11)
-    risk_text = f"Risk Index (0–100): {pct}" if not AR else _arabic_text(f"مؤشر الخطورة (٠–١٠٠): {pct}")
-    if AR:
-        c.drawRightString(W - 20 * mm, y - 8 * mm, risk_text)
-    else:
-        c.drawString(20 * mm, y - 8 * mm, risk_text)
-    _draw_gauge(c, 20 * mm, y - 22 * mm, 170 * mm, 8 * mm, pct, font_main, AR)
-    y = y - 40 * mm
-    c.setFont(font_main, 12)
-    if AR:
-        c.drawRightString(W - 20 * mm, y, _arabic_text("ملاحظات"))
-    else:
-        c.drawString(20 * mm, y, "Notes")
-    y -= 7 * mm
-    c.setFont(font_main, 10)
-    max_w = W - 40 * mm
-    for b in bullets:
-        if AR:
-            line = _arabic_text(f"{b} •")
-        else:
-            line = f"• {b}"
-        for ln in _wrap_lines(c, line, max_w, font_main, 10):
-            if AR:
-                c.drawRightString(W - 20 * mm, y, ln)
-            else:
-                c.drawString(20 * mm, y, ln)
-            y -= 6 * mm
-    y -= 6 * mm
-    c.setFont(font_main, 12)
-    if AR:
-        c.drawRightString(W - 20 * mm, y, _arabic_text("المدخلات"))
-    else:
-        c.drawString(20 * mm, y, "Inputs")
-    y -= 4 * mm
-    rows = [
-        ("Gestational age (weeks)" if not AR else "عمر الحمل (أسابيع)", d["gestational_weeks"]),
-        ("BMI", d["bmi"]),
-        ("Systolic BP" if not AR else "الضغط الانقباضي", d["systolic_bp"]),
-        ("Diastolic BP" if not AR else "الضغط الانبساطي", d["diastolic_bp"]),
-        ("Prenatal visits" if not AR else "زيارات ما قبل الولادة", d["prenatal_visits"]),
-        ("Diabetes" if not AR else "سكري", "yes" if d["diabetes"] == "yes" else "no"),
-        ("Hypertension" if not AR else "ارتفاع ضغط", "yes" if d["hypertension"] == "yes" else "no"),
-    ]
-    if AR:
-        rows = [(k, ("نعم" if v == "yes" else "لا") if isinstance(v, str) else v) for k, v in rows]
-    _draw_inputs_table(c, 20 * mm, y, font_main, rows, AR)
-    c.showPage()
-    c.save()
-    return buf.getvalue()
 
 # =============================
 # Header
 # =============================
 # Hero card with logo inside
+@st.cache_data(show_spinner=False)
 def get_base64_image_local(image_path):
     try:
         with open(image_path, "rb") as img_file:
@@ -1313,7 +908,7 @@ def get_base64_image_local(image_path):
     except:
         return ""
 
-# Try to load the logo
+# Try to load the logo (encoded once per process)
 logo_b64 = get_base64_image_local("AI4Life.png")
 if not logo_b64:
     logo_b64 = get_base64_image_local("Streamlit/AI4Life.png")
@@ -1353,8 +948,8 @@ with st.form("patient_info_form"):
     # Basic Demographics & Pregnancy Info
     st.markdown(f"**{L('Pregnancy Information', 'معلومات الحمل')}**")
     c1, c2, c3, c4 = st.columns(4)
-    gestational_weeks = c1.number_input(L("Gestational age (weeks)", "عمر الحمل (بالأسابيع)"), 20, 42, 39)
-    babyweight = c2.number_input(L("Baby weight (kg)", "وزن الطفل (كجم)"), 0.5, 6.0, 3.2, step=0.1)
+    gestational_weeks = number_field(c1, L("Gestational age (weeks)", "عمر الحمل (بالأسابيع)"), "gestational_weeks")
+    babyweight = number_field(c2, L("Baby weight (kg)", "وزن الطفل (كجم)"), "babyweight")
     twins = c3.selectbox(L("Twins", "توأم"), [L("No", "لا"), L("Yes", "نعم")])
     twins_val = 1 if twins in [L("Yes", "نعم"), "Yes", "نعم"] else 0
     
@@ -1374,22 +969,22 @@ with st.form("patient_info_form"):
     # Maternal Physical Measurements
     st.markdown(f"**{L('Maternal Measurements', 'قياسات الأم')}**")
     c1, c2, c3 = st.columns(3)
-    height = c1.number_input(L("Height (cm)", "الطول (سم)"), 130, 200, 165)
-    bmi = c2.number_input("BMI", 16.0, 45.0, 27.0, step=0.1)
-    maternal_age = c3.number_input(L("Mother's age (years)", "عمر الأم (بالسنوات)"), 15, 55, 28)
+    height = number_field(c1, L("Height (cm)", "الطول (سم)"), "height")
+    bmi = number_field(c2, "BMI", "bmi")
+    maternal_age = number_field(c3, L("Mother's age (years)", "عمر الأم (بالسنوات)"), "year")
 
     # Vital Signs
     st.markdown(f"**{L('Vital Signs', 'العلامات الحيوية')}**")
     c1, c2 = st.columns(2)
-    systolic_bp = c1.number_input(L("Systolic BP (mmHg)", "الضغط الانقباضي (ملم زئبق)"), 80, 220, 120)
-    diastolic_bp = c2.number_input(L("Diastolic BP (mmHg)", "الضغط الانبساطي (ملم زئبق)"), 50, 140, 75)
+    systolic_bp = number_field(c1, L("Systolic BP (mmHg)", "الضغط الانقباضي (ملم زئبق)"), "systolic_bp")
+    diastolic_bp = number_field(c2, L("Diastolic BP (mmHg)", "الضغط الانبساطي (ملم زئبق)"), "diastolic_bp")
 
     # Healthcare Visits
     st.markdown(f"**{L('Healthcare Visits', 'الزيارات الطبية')}**")
     c1, c2, c3 = st.columns(3)
-    prenatal_visits = c1.number_input(L("Prenatal visits", "زيارات ما قبل الولادة"), 0, 30, 4)
-    emergency_visits = c2.number_input(L("Emergency visits", "زيارات الطوارئ"), 0, 20, 0)
-    inpatient_visits = c3.number_input(L("Inpatient visits", "الزيارات الداخلية"), 0, 10, 0)
+    prenatal_visits = number_field(c1, L("Prenatal visits", "زيارات ما قبل الولادة"), "prenatal_visits")
+    emergency_visits = number_field(c2, L("Emergency visits", "زيارات الطوارئ"), "total_emergency_visits")
+    inpatient_visits = number_field(c3, L("Inpatient visits", "الزيارات الداخلية"), "total_inpatient_visits")
 
     # Medical Conditions
     st.markdown(f"**{L('Medical Conditions', 'الحالات الطبية')}**")
@@ -1400,36 +995,69 @@ with st.form("patient_info_form"):
     # Laboratory Tests (Optional)
     with st.expander(L("📊 Laboratory Test Results", "📊 نتائج الفحوصات المخبرية "), expanded=False):
         c1, c2, c3 = st.columns(3)
-        creatinine_mean = c1.number_input(L("Creatinine (mg/dL)", "الكرياتينين"), 0.0, 5.0, 0.0, step=0.1, help=L("Leave 0 if not available", "اترك 0 إذا لم يكن متاحًا"))
-        hba1c_mean = c2.number_input(L("HbA1c (%)", "الهيموغلوبين السكري"), 0.0, 15.0, 0.0, step=0.1, help=L("Leave 0 if not available", "اترك 0 إذا لم يكن متاحًا"))
-        potassium_mean = c3.number_input(L("Potassium (mmol/L)", "البوتاسيوم"), 0.0, 10.0, 0.0, step=0.1, help=L("Leave 0 if not available", "اترك 0 إذا لم يكن متاحًا"))
+        creatinine_mean = number_field(c1, L("Creatinine (mg/dL)", "الكرياتينين"), "creatinine_mean", help=L("Leave 0 if not available", "اترك 0 إذا لم يكن متاحًا"))
+        hba1c_mean = number_field(c2, L("HbA1c (%)", "الهيموغلوبين السكري"), "hba1c_mean", help=L("Leave 0 if not available", "اترك 0 إذا لم يكن متاحًا"))
+        potassium_mean = number_field(c3, L("Potassium (mmol/L)", "البوتاسيوم"), "potassium_mean", help=L("Leave 0 if not available", "اترك 0 إذا لم يكن متاحًا"))
 
     # Medications (Optional)
     with st.expander(L("💊 Medications ", "💊 الأدوية "), expanded=False):
         c1, c2 = st.columns(2)
-        ferric_times = c1.number_input(L("Ferric carboxymaltose (times)", "حقن الحديد (عدد المرات)"), 0, 20, 0, help=L("Number of times prescribed", "عدد مرات الوصف"))
-        metoprolol_times = c2.number_input(L("Metoprolol (times)", "ميتوبرولول (عدد المرات)"), 0, 50, 0, help=L("Number of times prescribed", "عدد مرات الوصف"))
+        ferric_times = number_field(c1, L("Ferric carboxymaltose (times)", "حقن الحديد (عدد المرات)"), "ferric_carboxymaltose_times", help=L("Number of times prescribed", "عدد مرات الوصف"))
+        metoprolol_times = number_field(c2, L("Metoprolol (times)", "ميتوبرولول (عدد المرات)"), "metoprolol_times", help=L("Number of times prescribed", "عدد مرات الوصف"))
 
     submitted = st.form_submit_button(L("Evaluate", "تقييم"), use_container_width=True)
 
 # =============================
 # Result (3-level gauge + PDF)
 # =============================
+@st.fragment
+def report_download(pdf_args):
+    """
+    PDF report of the assessment, built on the first click (a click reruns
+    only this fragment, so the result above stays on screen)
+
+    The bytes of the latest assessment are kept in the session for repeat
+    downloads; the result store and the pdf flight share them across sessions.
+
+    Args:
+        pdf_args (dict): build_pdf arguments
+    """
+    pdf_key = content_key("pdf", pdf_args)
+    slot = st.empty()
+    cached = st.session_state.get("report_pdf")
+    if cached is None or cached[0] != pdf_key:
+        if not slot.button(L("📄 Prepare PDF report", "📄 تجهيز تقرير PDF"), use_container_width=True):
+            return
+        with span("pdf_build"):
+            pdf_bytes = get_flights()["pdf"].do(
+                pdf_key, lambda: stored(get_result_store(), "pdf", pdf_key, lambda: build_pdf(**pdf_args))
+            )
+        cached = st.session_state.report_pdf = (pdf_key, pdf_bytes)
+
+    slot.download_button(
+        label=L("⬇️ Download Result (PDF)", "⬇️ تنزيل النتيجة (PDF)"),
+        data=cached[1],
+        file_name=f"{pdf_args['patient_id']}_risk_report.pdf",
+        mime="application/pdf",
+        use_container_width=True
+    )
+
 if submitted:
-    # Validate Patient ID and Name
-    if not patient_id or not patient_id.strip():
-        st.error(L(
-            "❌ **Patient ID is required!** Please enter a Patient ID before evaluating.",
-            "❌ **رقم المريضة مطلوب!** الرجاء إدخال رقم المريضة قبل التقييم."
-        ))
-        st.stop()
+    with span("validation"):
+        # Validate Patient ID and Name
+        if not patient_id or not patient_id.strip():
+            st.error(L(
+                "❌ **Patient ID is required!** Please enter a Patient ID before evaluating.",
+                "❌ **رقم المريضة مطلوب!** الرجاء إدخال رقم المريضة قبل التقييم."
+            ))
+            st.stop()
     
-    if not patient_name or not patient_name.strip():
-        st.error(L(
-            "❌ **Patient Name is required!** Please enter a Patient Name before evaluating.",
-            "❌ **اسم المريضة مطلوب!** الرجاء إدخال اسم المريضة قبل التقييم."
-        ))
-        st.stop()
+        if not patient_name or not patient_name.strip():
+            st.error(L(
+                "❌ **Patient Name is required!** Please enter a Patient Name before evaluating.",
+                "❌ **اسم المريضة مطلوب!** الرجاء إدخال اسم المريضة قبل التقييم."
+            ))
+            st.stop()
     
     def yn2en(x):
         return "yes" if (AR and x == "نعم") else ("no" if (AR and x == "لا") else x)
@@ -1457,17 +1085,18 @@ if submitted:
         "year": maternal_age  # Using mother's age for the year feature
     }
     
-    # Get prediction from XGBoost model
-    try:
-        prediction = predict_stillbirth_risk(user_input)
-        pct = prediction['risk_percentage']
-        band_text = L(prediction['risk_level'], 
-                     "منخفض" if prediction['risk_level'] == "Low" else 
-                     ("متوسط" if prediction['risk_level'] == "Moderate" else "مرتفع"))
-        badge_code = prediction['risk_band']
-    except Exception as e:
-        st.error(L(f"Error loading model: {str(e)}", f"خطأ في تحميل النموذج: {str(e)}"))
-        st.stop()
+    with span("inference"):
+        # Get prediction from XGBoost model
+        try:
+            prediction = predict_stillbirth_risk(user_input)
+            pct = prediction['risk_percentage']
+            band_text = L(prediction['risk_level'], 
+                         "منخفض" if prediction['risk_level'] == "Low" else 
+                         ("متوسط" if prediction['risk_level'] == "Moderate" else "مرتفع"))
+            badge_code = prediction['risk_band']
+        except Exception as e:
+            st.error(L(f"Error loading model: {str(e)}", f"خطأ في تحميل النموذج: {str(e)}"))
+            st.stop()
     
     # For backward compatibility with PDF generation
     d = {
@@ -1483,96 +1112,115 @@ if submitted:
         "smoker": "no"  # Not used in new model
     }
     
-    # Try to use LLM for intelligent explanation, fallback to rule-based
-    ai_used = False
-    if client and OPENROUTER_API_KEY != "sk-or-v1-your-key-here":
-        try:
-            with st.spinner(L("🤖 AI analyzing risk factors...", "🤖 الذكاء الاصطناعي يحلل عوامل الخطر...")):
-                bullets = openrouter_explain_risk(band_text, pct, user_input, AR)
+    with span("explanation"):
+        # Try to use LLM for intelligent explanation, fallback to rule-based
+        ai_used = False
+        if client and OPENROUTER_API_KEY != "sk-or-v1-your-key-here":
+            try:
+                # The same inputs in the same language reuse the stored AI explanation,
+                # or wait for the identical request already in flight
+                store = get_result_store()
+                explanation_key = content_key(
+                    "explanation", snapshot_keys(load_xgboost_model().current(), [user_input])[0],
+                    "ar" if AR else "en", MODEL
+                )
+                bullets = store.get(explanation_key, "explanation") if store else None
+                if bullets is None:
+                    with st.spinner(L("🤖 AI analyzing risk factors...", "🤖 الذكاء الاصطناعي يحلل عوامل الخطر...")):
+                        bullets = list(get_flights()["explanation"].do(explanation_key, lambda: stored(
+                            store, "explanation", explanation_key,
+                            lambda: openrouter_explain_risk(band_text, pct, user_input, AR)
+                        )))
                 ai_used = True
-            st.success(L("✅ AI-powered explanation generated", "✅ تم إنشاء توضيح بالذكاء الاصطناعي"), icon="🤖")
-        except Exception as e:
-            # Use fallback explanation if LLM fails
-            bullets = explanation_for_band(d, band_text, user_input)
-            st.info(L(f"ℹ️ Using rule-based explanation (AI unavailable: {str(e)[:50]}...)", 
-                     f"ℹ️ استخدام توضيح قائم على القواعد (الذكاء الاصطناعي غير متاح)"))
-    else:
-        # No API key configured - use rule-based explanation
-        bullets = explanation_for_band(d, band_text, user_input)
-        st.info(L("ℹ️ Using rule-based explanation (AI key not configured)", 
-                 "ℹ️ استخدام توضيح قائم على القواعد (مفتاح الذكاء الاصطناعي غير مُعد)"))
-
-    st.markdown(f"### {L('Risk Assessment', 'تقييم الخطورة')}", unsafe_allow_html=True)
-    range_txt = L("Bands: Low 0–40 • Moderate 41–69 • High 70–100", "المستويات: منخفض ٠–٤٠ • متوسط ٤١–٦٩ • مرتفع ٧٠–١٠٠")
-    st.markdown(
-        f'<div class="lab-wrap"><div class="lab-head"><div class="lab-name">{L("Risk Index", "مؤشر الخطورة")}</div>'
-        f'<div class="lab-ref"><div style="text-align:right"><div style="font-size:1.25rem;font-weight:800">{pct}</div>'
-        f'<div>{range_txt}</div></div></div></div>',
-        unsafe_allow_html=True
-    )
-    # For Arabic (RTL), reverse the gauge colors and labels
-    if AR:
-        # Arabic: High (red) on left, Moderate (yellow) in center, Low (green) on right
-        lbls = ["مرتفع", "متوسط", "منخفض"]
+                st.success(L("✅ AI-powered explanation generated", "✅ تم إنشاء توضيح بالذكاء الاصطناعي"), icon="🤖")
+            except Exception as e:
+                # Use fallback explanation if LLM fails
+                bullets = explanation_for_band(d, band_text, user_input, AR)
+                st.info(L(f"ℹ️ Using rule-based explanation (AI unavailable: {str(e)[:50]}...)", 
+                         f"ℹ️ استخدام توضيح قائم على القواعد (الذكاء الاصطناعي غير متاح)"))
+        else:
+            # No API key configured - use rule-based explanation
+            bullets = explanation_for_band(d, band_text, user_input, AR)
+            st.info(L("ℹ️ Using rule-based explanation (AI key not configured)", 
+                     "ℹ️ استخدام توضيح قائم على القواعد (مفتاح الذكاء الاصطناعي غير مُعد)"))
+
+    with span("render"):
+        st.markdown(f"### {L('Risk Assessment', 'تقييم الخطورة')}", unsafe_allow_html=True)
+        range_txt = L("Bands: Low 0–40 • Moderate 41–69 • High 70–100", "المستويات: منخفض ٠–٤٠ • متوسط ٤١–٦٩ • مرتفع ٧٠–١٠٠")
         st.markdown(
-            f'<div class="lab-band"><div class="seg green" style="width:33%"></div>'
-            f'<div class="seg amber" style="width:34%"></div>'
-            f'<div class="seg red" style="width:33%"></div></div>'
-            f'<div class="lab-labels"><span>{lbls[2]}</span><span>{lbls[1]}</span><span>{lbls[0]}</span></div>',
+            f'<div class="lab-wrap"><div class="lab-head"><div class="lab-name">{L("Risk Index", "مؤشر الخطورة")}</div>'
+            f'<div class="lab-ref"><div style="text-align:right"><div style="font-size:1.25rem;font-weight:800">{pct}</div>'
+            f'<div>{range_txt}</div></div></div></div>',
             unsafe_allow_html=True
         )
-        # Reverse marker position for RTL
-        marker_position = max(2, min(98, 100 - pct))
-    else:
-        # English: Low (green) on left, Moderate (yellow) in center, High (red) on right
-        lbls = ["Low", "Moderate", "High"]
+        # For Arabic (RTL), reverse the gauge colors and labels
+        if AR:
+            # Arabic: High (red) on left, Moderate (yellow) in center, Low (green) on right
+            lbls = ["مرتفع", "متوسط", "منخفض"]
+            st.markdown(
+                f'<div class="lab-band"><div class="seg green" style="width:33%"></div>'
+                f'<div class="seg amber" style="width:34%"></div>'
+                f'<div class="seg red" style="width:33%"></div></div>'
+                f'<div class="lab-labels"><span>{lbls[2]}</span><span>{lbls[1]}</span><span>{lbls[0]}</span></div>',
+                unsafe_allow_html=True
+            )
+            # Reverse marker position for RTL
+            marker_position = max(2, min(98, 100 - pct))
+        else:
+            # English: Low (green) on left, Moderate (yellow) in center, High (red) on right
+            lbls = ["Low", "Moderate", "High"]
+            st.markdown(
+                f'<div class="lab-band"><div class="seg green" style="width:33%"></div>'
+                f'<div class="seg amber" style="width:34%"></div>'
+                f'<div class="seg red" style="width:33%"></div></div>'
+                f'<div class="lab-labels"><span>{lbls[0]}</span><span>{lbls[1]}</span><span>{lbls[2]}</span></div>',
+                unsafe_allow_html=True
+            )
+            marker_position = max(2, min(98, pct))
+    
         st.markdown(
-            f'<div class="lab-band"><div class="seg green" style="width:33%"></div>'
-            f'<div class="seg amber" style="width:34%"></div>'
-            f'<div class="seg red" style="width:33%"></div></div>'
-            f'<div class="lab-labels"><span>{lbls[0]}</span><span>{lbls[1]}</span><span>{lbls[2]}</span></div>',
+            f'<div class="marker" style="height:38px;"><div class="pin" style="left:{marker_position}%"></div>'
+            f'<div class="pill" style="left:{marker_position}%">{pct}</div></div>',
             unsafe_allow_html=True
         )
-        marker_position = max(2, min(98, pct))
-    
-    st.markdown(
-        f'<div class="marker" style="height:38px;"><div class="pin" style="left:{marker_position}%"></div>'
-        f'<div class="pill" style="left:{marker_position}%">{pct}</div></div>',
-        unsafe_allow_html=True
-    )
-    st.markdown("<hr class='soft'/>", unsafe_allow_html=True)
+        st.markdown("<hr class='soft'/>", unsafe_allow_html=True)
     
-    # Display explanation header with AI indicator
-    if ai_used:
-        st.markdown(f"### {L('🤖 AI Clinical Analysis', '🤖 التحليل السريري بالذكاء الاصطناعي')}")
-        st.markdown(f"*{L('AI-generated personalized explanation based on patient data:', 'شرح مخصص بالذكاء الاصطناعي بناءً على بيانات المريضة:')}*")
-    else:
-        st.markdown(f"### {L('📋 Clinical Analysis', '📋 التحليل السريري')}")
-        st.markdown(f"*{L('Rule-based clinical explanation:', 'شرح سريري قائم على القواعد:')}*")
+        # Display explanation header with AI indicator
+        if ai_used:
+            st.markdown(f"### {L('🤖 AI Clinical Analysis', '🤖 التحليل السريري بالذكاء الاصطناعي')}")
+            st.markdown(f"*{L('AI-generated personalized explanation based on patient data:', 'شرح مخصص بالذكاء الاصطناعي بناءً على بيانات المريضة:')}*")
+        else:
+            st.markdown(f"### {L('📋 Clinical Analysis', '📋 التحليل السريري')}")
+            st.markdown(f"*{L('Rule-based clinical explanation:', 'شرح سريري قائم على القواعد:')}*")
     
-    # Display explanation bullets
-    for i, line in enumerate(bullets, 1):
-        st.markdown(f"**{i}.** {line}")
+        # Display explanation bullets
+        for i, line in enumerate(bullets, 1):
+            st.markdown(f"**{i}.** {line}")
     
-    st.markdown("<br/>", unsafe_allow_html=True)
+        st.markdown("<br/>", unsafe_allow_html=True)
 
-    # Save to history
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with span("history_append"):
+        # Save to history
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     
-    st.session_state.history.loc[len(st.session_state.history)] = [
-        timestamp, patient_id, patient_name, band_text, pct,
-        " | ".join(bullets),
-        gestational_weeks, babyweight, bmi, height,
-        systolic_bp, diastolic_bp, prenatal_visits,
-        emergency_visits, inpatient_visits,
-        L("yes", "نعم") if diabetes in [L("yes", "نعم"), "yes", "نعم"] else L("no", "لا"),
-        L("yes", "نعم") if hypertension in [L("yes", "نعم"), "yes", "نعم"] else L("no", "لا"),
-        twins_val,
-        deliverytype_val,
-    ]
-
-    # Build and download PDF
-    pdf_bytes = build_pdf(
+        st.session_state.history_spill.append([
+            timestamp, patient_id, patient_name, band_text, pct,
+            " | ".join(bullets),
+            gestational_weeks, babyweight, bmi, height,
+            systolic_bp, diastolic_bp, prenatal_visits,
+            emergency_visits, inpatient_visits,
+            L("yes", "نعم") if diabetes in [L("yes", "نعم"), "yes", "نعم"] else L("no", "لا"),
+            L("yes", "نعم") if hypertension in [L("yes", "نعم"), "yes", "نعم"] else L("no", "لا"),
+            twins_val,
+            deliverytype_val,
+            prediction['model_version'],
+        ])
+        st.session_state.history_version += 1
+        # Over the process budget: spill the sessions idle the longest
+        get_spill_registry().enforce()
+
+    # The report is only rendered if asked for
+    report_download(dict(
         patient_id=patient_id,
         patient_name=patient_name,
         timestamp=timestamp,
@@ -1582,20 +1230,12 @@ if submitted:
         bullets=bullets,
         d=d,
         AR=AR
-    )
-
-    st.download_button(
-        label=L("⬇️ Download Result (PDF)", "⬇️ تنزيل النتيجة (PDF)"),
-        data=pdf_bytes,
-        file_name=f"{patient_id}_risk_report.pdf",
-        mime="application/pdf",
-        use_container_width=True
-    )
+    ))
 
 # =============================
 # Statistics Cards
 # =============================
-stats = calculate_statistics()
+stats = history_cached("stats", lambda: calculate_statistics(st.session_state.history))
 st.markdown(f"<h2 class='section-header'>{L('Case Statistics', 'إحصائيات الحالات')}</h2>", unsafe_allow_html=True)
 
 stats_cols = st.columns(4)
@@ -1640,6 +1280,38 @@ with stats_cols[3]:
         unsafe_allow_html=True
     )
 
+# =============================
+# Cohort Analytics (charts cached per history version)
+# =============================
+@st.fragment
+def cohort_analytics():
+    """Cohort charts over the session history (drawn once per history version)"""
+    if not st.toggle(L("Show cohort analytics", "عرض تحليلات المجموعة"), key="show_analytics"):
+        return
+    history = st.session_state.history
+    if len(history) == 0:
+        st.info(L("No assessments yet.", "لا توجد تقييمات بعد."))
+        return
+
+    def draw():
+        with span("cohort_analytics"):
+            return render_charts(cohort_aggregates(history), AR)
+
+    charts = history_cached("cohort_charts", draw)
+    row1, row2 = st.columns(2), st.columns(2)
+    panels = [
+        (row1[0], "score_distribution", L("Risk index distribution", "توزيع مؤشر الخطورة")),
+        (row1[1], "band_mix", L("Risk levels over time", "مستويات الخطورة عبر الزمن")),
+        (row2[0], "by_gestation", L("Risk by gestational age", "الخطورة حسب عمر الحمل")),
+        (row2[1], "by_bmi", L("Risk by BMI", "الخطورة حسب مؤشر كتلة الجسم")),
+    ]
+    for col, name, title in panels:
+        col.markdown(f"**{title}**")
+        col.image(charts[name], use_column_width=True)
+
+st.markdown(f"<h2 class='section-header'>{L('Cohort Analytics', 'تحليلات المجموعة')}</h2>", unsafe_allow_html=True)
+cohort_analytics()
+
 # =============================
 # Dashboard Containers with Interactivity
 # =============================
@@ -1653,223 +1325,291 @@ if "show_meds" not in st.session_state:
 if "show_records" not in st.session_state:
     st.session_state.show_records = False
 
-dashboard_cols = st.columns(3)
+@st.fragment
+def clinical_dashboard():
+    """Dashboard buttons and panels (a toggle reruns only this fragment)"""
+    dashboard_cols = st.columns(3)
+
+    with dashboard_cols[0]:
+        if st.button(
+            L('🔬\n\nLaboratory Tests\n\nView and manage patient lab results', 
+              '🔬\n\nالتحاليل المخبرية\n\nعرض وإدارة نتائج مختبر المريضة'),
+            key="lab_btn",
+            use_container_width=True
+        ):
+            st.session_state.show_labs = not st.session_state.show_labs
+            st.session_state.show_meds = False
+            st.session_state.show_records = False
+
+    with dashboard_cols[1]:
+        if st.button(
+            L('💊\n\nMedications\n\nManage prescribed medications and dosage', 
+              '💊\n\nالأدوية\n\nإدارة الأدوية الموصوفة والجرعات'),
+            key="med_btn",
+            use_container_width=True
+        ):
+            st.session_state.show_meds = not st.session_state.show_meds
+            st.session_state.show_labs = False
+            st.session_state.show_records = False
+
+    with dashboard_cols[2]:
+        if st.button(
+            L('📋\n\nMedical Records\n\nAccess complete patient medical history', 
+              '📋\n\nالسجل الطبي\n\nالوصول إلى السجل الطبي الكامل للمريضة'),
+            key="rec_btn",
+            use_container_width=True
+        ):
+            st.session_state.show_records = not st.session_state.show_records
+            st.session_state.show_labs = False
+            st.session_state.show_meds = False
+
+    # Display content based on selection
+    if st.session_state.show_labs:
+        with st.expander(L("🔬 Laboratory Tests Details", "🔬 تفاصيل التحاليل المخبرية"), expanded=True):
+            st.markdown(f"### {L('Common Prenatal Laboratory Tests', 'التحاليل المخبرية الشائعة قبل الولادة')}")
+
+            # Sample lab data
+            lab_data = {
+                L("Test Name", "اسم التحليل"): [
+                    L("Hemoglobin (Hb)", "الهيموجلوبين"),
+                    L("Blood Glucose", "سكر الدم"),
+                    L("Blood Pressure", "ضغط الدم"),
+                    L("Urine Protein", "بروتين البول"),
+                    L("Platelets", "الصفائح الدموية")
+                ],
+                L("Normal Range", "المعدل الطبيعي"): [
+                    "12-16 g/dL",
+                    "70-100 mg/dL",
+                    "90-120/60-80 mmHg",
+                    L("Negative", "سلبي"),
+                    "150-400 × 10³/µL"
+                ],
+                L("Status", "الحالة"): [
+                    L("Normal", "طبيعي"),
+                    L("Normal", "طبيعي"),
+                    L("Normal", "طبيعي"),
+                    L("Normal", "طبيعي"),
+                    L("Normal", "طبيعي")
+                ]
+            }
 
-with dashboard_cols[0]:
-    if st.button(
-        L('🔬\n\nLaboratory Tests\n\nView and manage patient lab results', 
-          '🔬\n\nالتحاليل المخبرية\n\nعرض وإدارة نتائج مختبر المريضة'),
-        key="lab_btn",
-        use_container_width=True
-    ):
-        st.session_state.show_labs = not st.session_state.show_labs
-        st.session_state.show_meds = False
-        st.session_state.show_records = False
-
-with dashboard_cols[1]:
-    if st.button(
-        L('💊\n\nMedications\n\nManage prescribed medications and dosage', 
-          '💊\n\nالأدوية\n\nإدارة الأدوية الموصوفة والجرعات'),
-        key="med_btn",
-        use_container_width=True
-    ):
-        st.session_state.show_meds = not st.session_state.show_meds
-        st.session_state.show_labs = False
-        st.session_state.show_records = False
-
-with dashboard_cols[2]:
-    if st.button(
-        L('📋\n\nMedical Records\n\nAccess complete patient medical history', 
-          '📋\n\nالسجل الطبي\n\nالوصول إلى السجل الطبي الكامل للمريضة'),
-        key="rec_btn",
-        use_container_width=True
-    ):
-        st.session_state.show_records = not st.session_state.show_records
-        st.session_state.show_labs = False
-        st.session_state.show_meds = False
-
-# Display content based on selection
-if st.session_state.show_labs:
-    with st.expander(L("🔬 Laboratory Tests Details", "🔬 تفاصيل التحاليل المخبرية"), expanded=True):
-        st.markdown(f"### {L('Common Prenatal Laboratory Tests', 'التحاليل المخبرية الشائعة قبل الولادة')}")
-        
-        # Sample lab data
-        lab_data = {
-            L("Test Name", "اسم التحليل"): [
-                L("Hemoglobin (Hb)", "الهيموجلوبين"),
-                L("Blood Glucose", "سكر الدم"),
-                L("Blood Pressure", "ضغط الدم"),
-                L("Urine Protein", "بروتين البول"),
-                L("Platelets", "الصفائح الدموية")
-            ],
-            L("Normal Range", "المعدل الطبيعي"): [
-                "12-16 g/dL",
-                "70-100 mg/dL",
-                "90-120/60-80 mmHg",
-                L("Negative", "سلبي"),
-                "150-400 × 10³/µL"
-            ],
-            L("Status", "الحالة"): [
-                L("Normal", "طبيعي"),
-                L("Normal", "طبيعي"),
-                L("Normal", "طبيعي"),
-                L("Normal", "طبيعي"),
-                L("Normal", "طبيعي")
-            ]
-        }
-        
-        df_labs = pd.DataFrame(lab_data)
-        st.dataframe(df_labs, use_container_width=True, hide_index=True)
-        
-        st.info(L(
-            "💡 **Note:** These are sample values. Actual patient lab results would be displayed here in a production environment.",
-            "💡 **ملاحظة:** هذه قيم تجريبية. سيتم عرض نتائج المختبر الفعلية للمريضة هنا في بيئة الإنتاج."
-        ))
-
-if st.session_state.show_meds:
-    with st.expander(L("💊 Medications Details", "💊 تفاصيل الأدوية"), expanded=True):
-        st.markdown(f"### {L('Prescribed Medications', 'الأدوية الموصوفة')}")
-        
-        # Sample medication data
-        med_data = {
-            L("Medication", "الدواء"): [
-                L("Prenatal Vitamins", "فيتامينات ما قبل الولادة"),
-                L("Folic Acid", "حمض الفوليك"),
-                L("Iron Supplement", "مكملات الحديد"),
-                L("Calcium", "الكالسيوم")
-            ],
-            L("Dosage", "الجرعة"): [
-                L("1 tablet daily", "قرص واحد يومياً"),
-                "400 mcg " + L("daily", "يومياً"),
-                "30 mg " + L("daily", "يومياً"),
-                "1000 mg " + L("daily", "يومياً")
-            ],
-            L("Frequency", "التكرار"): [
-                L("Once daily", "مرة يومياً"),
-                L("Once daily", "مرة يومياً"),
-                L("Once daily", "مرة يومياً"),
-                L("Twice daily", "مرتين يومياً")
-            ],
-            L("Duration", "المدة"): [
-                L("Throughout pregnancy", "طوال فترة الحمل"),
-                L("First trimester", "الثلث الأول"),
-                L("Throughout pregnancy", "طوال فترة الحمل"),
-                L("Throughout pregnancy", "طوال فترة الحمل")
-            ]
-        }
-        
-        df_meds = pd.DataFrame(med_data)
-        st.dataframe(df_meds, use_container_width=True, hide_index=True)
-        
-        st.info(L(
-            "💡 **Note:** These are sample medications. Actual patient prescriptions would be displayed here in a production environment.",
-            "💡 **ملاحظة:** هذه أدوية تجريبية. سيتم عرض الوصفات الطبية الفعلية للمريضة هنا في بيئة الإنتاج."
-        ))
-
-if st.session_state.show_records:
-    with st.expander(L("📋 Medical Records Details", "📋 تفاصيل السجل الطبي"), expanded=True):
-        st.markdown(f"### {L('Patient Medical History', 'السجل الطبي للمريضة')}")
-        
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            st.markdown(f"**{L('Personal Information', 'المعلومات الشخصية')}**")
-            st.write(f"• {L('Age', 'العمر')}: 28 {L('years', 'سنة')}")
-            st.write(f"• {L('Blood Type', 'فصيلة الدم')}: O+")
-            st.write(f"• {L('Allergies', 'الحساسية')}: {L('None reported', 'لا يوجد')}")
-            
-            st.markdown(f"**{L('Previous Pregnancies', 'الحمل السابق')}**")
-            st.write(f"• {L('Gravida', 'الحمل')}: 2")
-            st.write(f"• {L('Para', 'الولادة')}: 1")
-            st.write(f"• {L('Abortions', 'الإجهاض')}: 0")
-        
-        with col2:
-            st.markdown(f"**{L('Chronic Conditions', 'الأمراض المزمنة')}**")
-            st.write(f"• {L('Diabetes', 'السكري')}: {L('No', 'لا')}")
-            st.write(f"• {L('Hypertension', 'ارتفاع ضغط الدم')}: {L('No', 'لا')}")
-            st.write(f"• {L('Heart Disease', 'أمراض القلب')}: {L('No', 'لا')}")
-            
-            st.markdown(f"**{L('Recent Visits', 'الزيارات الأخيرة')}**")
-            st.write(f"• {L('Last Visit', 'آخر زيارة')}: {L('2 weeks ago', 'منذ أسبوعين')}")
-            st.write(f"• {L('Next Appointment', 'الموعد القادم')}: {L('1 week', 'أسبوع واحد')}")
-        
-        st.markdown("---")
-        
-        st.markdown(f"**{L('Notes', 'الملاحظات')}**")
-        st.info(L(
-            "Patient is in good general health. Regular prenatal checkups recommended. Continue current medication regimen.",
-            "المريضة في صحة عامة جيدة. يُنصح بإجراء فحوصات منتظمة قبل الولادة. الاستمرار في نظام الدواء الحالي."
-        ))
-        
-        st.info(L(
-            "💡 **Note:** This is sample medical record data. Actual patient records would be displayed here in a production environment.",
-            "💡 **ملاحظة:** هذا سجل طبي تجريبي. سيتم عرض السجل الطبي الفعلي للمريضة هنا في بيئة الإنتاج."
-        ))
+            df_labs = pd.DataFrame(lab_data)
+            st.dataframe(df_labs, use_container_width=True, hide_index=True)
+
+            st.info(L(
+                "💡 **Note:** These are sample values. Actual patient lab results would be displayed here in a production environment.",
+                "💡 **ملاحظة:** هذه قيم تجريبية. سيتم عرض نتائج المختبر الفعلية للمريضة هنا في بيئة الإنتاج."
+            ))
+
+    if st.session_state.show_meds:
+        with st.expander(L("💊 Medications Details", "💊 تفاصيل الأدوية"), expanded=True):
+            st.markdown(f"### {L('Prescribed Medications', 'الأدوية الموصوفة')}")
+
+            # Sample medication data
+            med_data = {
+                L("Medication", "الدواء"): [
+                    L("Prenatal Vitamins", "فيتامينات ما قبل الولادة"),
+                    L("Folic Acid", "حمض الفوليك"),
+                    L("Iron Supplement", "مكملات الحديد"),
+                    L("Calcium", "الكالسيوم")
+                ],
+                L("Dosage", "الجرعة"): [
+                    L("1 tablet daily", "قرص واحد يومياً"),
+                    "400 mcg " + L("daily", "يومياً"),
+                    "30 mg " + L("daily", "يومياً"),
+                    "1000 mg " + L("daily", "يومياً")
+                ],
+                L("Frequency", "التكرار"): [
+                    L("Once daily", "مرة يومياً"),
+                    L("Once daily", "مرة يومياً"),
+                    L("Once daily", "مرة يومياً"),
+                    L("Twice daily", "مرتين يومياً")
+                ],
+                L("Duration", "المدة"): [
+                    L("Throughout pregnancy", "طوال فترة الحمل"),
+                    L("First trimester", "الثلث الأول"),
+                    L("Throughout pregnancy", "طوال فترة الحمل"),
+                    L("Throughout pregnancy", "طوال فترة الحمل")
+                ]
+            }
+
+            df_meds = pd.DataFrame(med_data)
+            st.dataframe(df_meds, use_container_width=True, hide_index=True)
+
+            st.info(L(
+                "💡 **Note:** These are sample medications. Actual patient prescriptions would be displayed here in a production environment.",
+                "💡 **ملاحظة:** هذه أدوية تجريبية. سيتم عرض الوصفات الطبية الفعلية للمريضة هنا في بيئة الإنتاج."
+            ))
+
+    if st.session_state.show_records:
+        with st.expander(L("📋 Medical Records Details", "📋 تفاصيل السجل الطبي"), expanded=True):
+            st.markdown(f"### {L('Patient Medical History', 'السجل الطبي للمريضة')}")
+
+            col1, col2 = st.columns(2)
+
+            with col1:
+                st.markdown(f"**{L('Personal Information', 'المعلومات الشخصية')}**")
+                st.write(f"• {L('Age', 'العمر')}: 28 {L('years', 'سنة')}")
+                st.write(f"• {L('Blood Type', 'فصيلة الدم')}: O+")
+                st.write(f"• {L('Allergies', 'الحساسية')}: {L('None reported', 'لا يوجد')}")
+
+                st.markdown(f"**{L('Previous Pregnancies', 'الحمل السابق')}**")
+                st.write(f"• {L('Gravida', 'الحمل')}: 2")
+                st.write(f"• {L('Para', 'الولادة')}: 1")
+                st.write(f"• {L('Abortions', 'الإجهاض')}: 0")
+
+            with col2:
+                st.markdown(f"**{L('Chronic Conditions', 'الأمراض المزمنة')}**")
+                st.write(f"• {L('Diabetes', 'السكري')}: {L('No', 'لا')}")
+                st.write(f"• {L('Hypertension', 'ارتفاع ضغط الدم')}: {L('No', 'لا')}")
+                st.write(f"• {L('Heart Disease', 'أمراض القلب')}: {L('No', 'لا')}")
+
+                st.markdown(f"**{L('Recent Visits', 'الزيارات الأخيرة')}**")
+                st.write(f"• {L('Last Visit', 'آخر زيارة')}: {L('2 weeks ago', 'منذ أسبوعين')}")
+                st.write(f"• {L('Next Appointment', 'الموعد القادم')}: {L('1 week', 'أسبوع واحد')}")
+
+            st.markdown("---")
+
+            st.markdown(f"**{L('Notes', 'الملاحظات')}**")
+            st.info(L(
+                "Patient is in good general health. Regular prenatal checkups recommended. Continue current medication regimen.",
+                "المريضة في صحة عامة جيدة. يُنصح بإجراء فحوصات منتظمة قبل الولادة. الاستمرار في نظام الدواء الحالي."
+            ))
+
+            st.info(L(
+                "💡 **Note:** This is sample medical record data. Actual patient records would be displayed here in a production environment.",
+                "💡 **ملاحظة:** هذا سجل طبي تجريبي. سيتم عرض السجل الطبي الفعلي للمريضة هنا في بيئة الإنتاج."
+            ))
+
+clinical_dashboard()
 
 # =============================
 # History (styled container)
 # =============================
 st.markdown(f"<h2 class='section-header'>{L('Patient History', 'سجل الحالات')}</h2>", unsafe_allow_html=True)
-q = st.text_input(L("Search (ID/Name)", "بحث (رقم/اسم)"), key="hist_q")
-df = st.session_state.history.copy()
-if q:
-    df = df[df["patient_name"].str.contains(q, case=False, na=False) | df["patient_id"].str.contains(q, case=False, na=False)]
-
-# Display the history table
-st.dataframe(
-    df[["timestamp", "patient_id", "patient_name", "risk_level", "score_pct", "explanation"]]
-    .sort_values("timestamp", ascending=False),
-    use_container_width=True
-)
+@st.fragment
+def patient_history():
+    """History search, sorting, one page of the table and CSV export (reruns only this fragment)"""
+    history = st.session_state.history
+    sort_labels = {
+        "timestamp": L("Date", "التاريخ"),
+        "score_pct": L("Risk index", "مؤشر الخطورة"),
+        "patient_id": L("Patient ID", "رقم المريضة"),
+        "patient_name": L("Patient Name", "اسم المريضة"),
+        "risk_level": L("Risk level", "مستوى الخطورة"),
+    }
+    c1, c2, c3 = st.columns([3, 2, 1])
+    q = c1.text_input(L("Search (ID/Name)", "بحث (رقم/اسم)"), key="hist_q")
+    sort_column = c2.selectbox(L("Sort by", "ترتيب حسب"), SORT_COLUMNS, format_func=sort_labels.get, key="hist_sort")
+    descending = c3.toggle(L("Newest / highest first", "الأحدث / الأعلى أولاً"), value=True, key="hist_desc")
+
+    # Sort index per column, extended in place as rows are appended; the
+    # filtered row list is rebuilt only when the history, sort or search changes
+    indexes = st.session_state.setdefault("history_index", {})
+    index = indexes.setdefault(sort_column, HistoryIndex(sort_column))
+    order = index.order(history, descending)
+    rows = history_cached(
+        "rows",
+        lambda: order[search_mask(history, q)[order]] if q else order,
+        sort_column, descending, q
+    )
 
-# CSV Export
-col_map_en = {
-    "timestamp": "timestamp", "patient_id": "patient_id", "patient_name": "patient_name",
-    "risk_level": "risk_level", "score_pct": "score_pct", "explanation": "explanation",
-    "gestational_weeks": "gestational_weeks", "babyweight": "babyweight", "bmi": "bmi", "height": "height",
-    "systolic_bp": "systolic_bp", "diastolic_bp": "diastolic_bp", "prenatal_visits": "prenatal_visits",
-    "emergency_visits": "emergency_visits", "inpatient_visits": "inpatient_visits",
-    "diabetes": "diabetes", "hypertension": "hypertension", "twins": "twins", "deliverytype": "deliverytype"
-}
-
-col_map_ar = {
-    "timestamp": "التاريخ", "patient_id": "رقم المريضة", "patient_name": "اسم المريضة",
-    "risk_level": "مستوى الخطورة", "score_pct": "المؤشر", "explanation": "توضيح",
-    "gestational_weeks": "عمر الحمل (أسابيع)", "babyweight": "وزن الطفل", "bmi": "مؤشر كتلة الجسم", "height": "الطول",
-    "systolic_bp": "الضغط الانقباضي", "diastolic_bp": "الضغط الانبساطي", "prenatal_visits": "زيارات قبل الولادة",
-    "emergency_visits": "زيارات الطوارئ", "inpatient_visits": "الزيارات الداخلية",
-    "diabetes": "سكري", "hypertension": "ارتفاع ضغط", "twins": "توأم", "deliverytype": "نوع الولادة"
-}
-
-col_map = col_map_ar if AR else col_map_en
-
-# Ensure the DataFrame has the expected columns
-expected_columns = [
-    "timestamp", "patient_id", "patient_name", "risk_level", "score_pct", "explanation",
-    "gestational_weeks", "babyweight", "bmi", "height", "systolic_bp", "diastolic_bp", "prenatal_visits",
-    "emergency_visits", "inpatient_visits", "diabetes", "hypertension", "twins", "deliverytype"
-]
-
-# Create a copy of the DataFrame with only the expected columns
-df_renamed = st.session_state.history[expected_columns].copy()
-
-# Rename the columns
-df_renamed = df_renamed.rename(columns=col_map)
-
-# Write to BytesIO with UTF-8 encoding
-csv_bytes = io.BytesIO()
-df_renamed.to_csv(csv_bytes, index=False, encoding="utf-8-sig")
-csv_bytes.seek(0)
-
-st.markdown('<div class="download-history-btn">', unsafe_allow_html=True)
-st.download_button(
-    label=L("⬇️ Download history (CSV)", "⬇️ تنزيل السجل (CSV)"),
-    data=csv_bytes,
-    file_name=L("patient_history.csv", "سجل_الحالات.csv"),
-    mime="text/csv",
-    use_container_width=True
-)
-st.markdown('</div>', unsafe_allow_html=True)
+    c1, c2, c3 = st.columns([1, 1, 2])
+    page_size = c2.selectbox(L("Rows per page", "صفوف لكل صفحة"), [25, 50, 100, 250], index=1, key="hist_page_size")
+    pages = max(1, -(-len(rows) // page_size))
+    if st.session_state.get("hist_page", 1) > pages:
+        st.session_state.hist_page = pages
+    page = c1.number_input(L("Page", "الصفحة"), 1, pages, 1, key="hist_page")
+    first = (page - 1) * page_size
+    c3.markdown(
+        f"<div class='small' style='padding-top:2.2rem'>"
+        f"{L('Rows', 'الصفوف')} {min(first + 1, len(rows))}–{min(first + page_size, len(rows))} "
+        f"{L('of', 'من')} {len(rows)}</div>",
+        unsafe_allow_html=True
+    )
+
+    # Display one page of the history table
+    spill = st.session_state.history_spill
+    st.dataframe(history_page(history, rows, page, page_size, spill=spill), use_container_width=True)
+    footprint = spill.stats()
+    st.caption(L(
+        f"History memory: {footprint['memory_mb']:.1f} MB, {footprint['spilled_rows']} older rows on disk "
+        f"({footprint['disk_mb']:.1f} MB)",
+        f"ذاكرة السجل: {footprint['memory_mb']:.1f} ميجابايت، {footprint['spilled_rows']} صفًا أقدم على القرص "
+        f"({footprint['disk_mb']:.1f} ميجابايت)"
+    ))
+
+    # Export, built when asked for: the file (and the download button's copy
+    # of it) would otherwise hold the whole history in memory again
+    exports = {
+        "CSV": (lambda: history_csv(st.session_state.history, AR, spill=spill), "text/csv",
+                L("patient_history.csv", "سجل_الحالات.csv")),
+        "Parquet": (lambda: history_parquet(st.session_state.history, spill=spill), "application/vnd.apache.parquet",
+                    "patient_history.parquet"),
+        "Arrow": (lambda: history_arrow(st.session_state.history, spill=spill), "application/vnd.apache.arrow.file",
+                  "patient_history.arrow"),
+    }
+    st.markdown('<div class="download-history-btn">', unsafe_allow_html=True)
+    c1, c2 = st.columns([1, 3])
+    export_format = c1.selectbox(L("Format", "الصيغة"), list(exports), key="hist_export_format",
+                                 label_visibility="collapsed")
+    build, mime, file_name = exports[export_format]
+    export_key = (st.session_state.history_version, AR, export_format)
+    export_slot = c2.empty()
+    if st.session_state.get("hist_export") != export_key:
+        st.session_state.get("history_cache", {}).pop("export", None)
+        if export_slot.button(L(f"📄 Prepare history {export_format}", f"📄 تجهيز ملف السجل ({export_format})"),
+                              use_container_width=True):
+            st.session_state.hist_export = export_key
+    if st.session_state.get("hist_export") == export_key:
+        def export():
+            with span("history_export"):
+                return build()
+
+        export_slot.download_button(
+            label=L(f"⬇️ Download history ({export_format})", f"⬇️ تنزيل السجل ({export_format})"),
+            data=history_cached("export", export, export_format),
+            file_name=file_name,
+            mime=mime,
+            use_container_width=True
+        )
+    st.markdown('</div>', unsafe_allow_html=True)
 
-st.markdown(f'<div class="small">{L("Results are stored temporarily. Export CSV to keep them.", "النتائج تُحفظ مؤقتًا. صدّر CSV للاحتفاظ بها.")}</div>', unsafe_allow_html=True)
+    # Restore a Parquet or Arrow export: its rows are added to this session's history
+    uploads = st.session_state.setdefault("hist_imports", 0)
+    uploaded = st.file_uploader(L("Restore history (Parquet or Arrow export)", "استعادة السجل (ملف Parquet أو Arrow)"),
+                                type=["parquet", "arrow"], key=f"hist_import_{uploads}")
+    if uploaded is not None:
+        try:
+            with span("history_import"):
+                imported = read_history(uploaded.getvalue())
+        except ValueError as e:
+            st.error(L(f"Could not restore the history: {e}", f"تعذرت استعادة السجل: {e}"))
+        else:
+            restored = pd.concat([*spill.frames(), imported], ignore_index=True) if len(history) else imported
+            st.session_state.history = restored
+            st.session_state.history_version += 1
+            st.session_state.history_spill = get_spill_registry().attach(restored)
+            st.session_state.history_spill.trim()
+            # A new uploader key drops the uploaded bytes
+            st.session_state.hist_imports = uploads + 1
+            st.rerun()
+
+patient_history()
+
+st.markdown(f'<div class="small">{L("Results are stored temporarily. Export them to keep them; Parquet and Arrow exports can be restored.", "النتائج تُحفظ مؤقتًا. صدّر السجل للاحتفاظ به؛ يمكن استعادة ملفات Parquet وArrow.")}</div>', unsafe_allow_html=True)
 st.markdown('</div>', unsafe_allow_html=True)
+
+# Record the whole rerun (reruns cut short by st.stop() are not counted)
+RERUN_SECONDS.observe(time.perf_counter() - _rerun_start, "yes" if submitted else "no")
+if METRICS_FILE:
+    write_metrics_file(METRICS_FILE)
+
+if _models is not None and _models.shadow is not None:
+    with st.sidebar.expander(f"Shadow model {_models.shadow.version}"):
+        st.json(_models.shadow.summary())
+
+if _profiler:
+    _profiler.stop()
+    with st.sidebar.expander("Profiling (last 20 reruns)"):
+        st.dataframe(pd.DataFrame(summarize_profiles(last=20, top=15)["functions"]), hide_index=True)
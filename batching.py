@@ -0,0 +1,141 @@
+"""
+Micro-batching Module for Stillbirth Risk Assessment
+Collects scoring requests from concurrent callers (Streamlit sessions, API
+threads) and scores them with one vectorized model call per batch
+"""
+
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from preprocessing import predict_risk_batch
+
+# Number of recent queueing delays kept for percentile reporting
+DELAY_SAMPLES = 10000
+
+
+class _Pending:
+    __slots__ = ("item", "future", "enqueued")
+
+    def __init__(self, item):
+        self.item = item
+        self.future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class MicroBatcher:
+    """
+    Shared scheduler in front of a batch scoring function
+
+    A batch is dispatched when `max_batch` requests are waiting or when
+    `window_ms` has passed since the first request of the batch arrived,
+    whichever comes first. Each caller gets its own result back.
+
+    Args:
+        score_batch (callable): list of inputs -> list of results, same order
+        window_ms (float): Maximum time to hold the first request of a batch
+        max_batch (int): Maximum number of requests scored per call
+    """
+
+    def __init__(self, score_batch=predict_risk_batch, window_ms=2.0, max_batch=64):
+        self.score_batch = score_batch
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._batch_sizes = Counter()
+        self._delays = deque(maxlen=DELAY_SAMPLES)
+        self._requests = 0
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """Queue one input for scoring and return a Future for its result"""
+        pending = _Pending(item)
+        self._queue.put(pending)
+        return pending.future
+
+    def score(self, item, timeout=None):
+        """Score one input through the shared batch, blocking until done"""
+        return self.submit(item).result(timeout)
+
+    def close(self):
+        """Stop the dispatcher thread after the queued requests are scored"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = first.enqueued + self.window
+            stop = False
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                try:
+                    nxt = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    stop = True
+                    break
+                batch.append(nxt)
+            self._dispatch(batch)
+            if stop:
+                return
+
+    def _dispatch(self, batch):
+        started = time.perf_counter()
+        with self._lock:
+            self._requests += len(batch)
+            self._batch_sizes[len(batch)] += 1
+            self._delays.extend(started - p.enqueued for p in batch)
+
+        try:
+            results = list(self.score_batch([p.item for p in batch]))
+            # A short (or long) result list can't be matched to the requests:
+            # fail them all rather than leave callers waiting forever
+            if len(results) != len(batch):
+                raise ValueError(f"score_batch returned {len(results)} results for {len(batch)} requests")
+        except Exception as e:
+            for p in batch:
+                p.future.set_exception(e)
+            return
+        for p, result in zip(batch, results):
+            p.future.set_result(result)
+
+    def stats(self):
+        """
+        Batch-size distribution and queueing delay for tuning the window
+
+        Returns:
+            dict: requests, batches, mean_batch_size, batch_size_histogram
+                  ({size: count}) and queue_delay_ms percentiles over the
+                  most recent requests
+        """
+        with self._lock:
+            sizes = dict(sorted(self._batch_sizes.items()))
+            delays = np.array(self._delays) * 1000.0
+            requests = self._requests
+        batches = sum(sizes.values())
+        if len(delays):
+            p50, p95, p99 = np.percentile(delays, [50, 95, 99])
+            delay = {"p50": round(p50, 3), "p95": round(p95, 3),
+                     "p99": round(p99, 3), "max": round(float(delays.max()), 3)}
+        else:
+            delay = {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+        return {
+            "window_ms": self.window * 1000.0,
+            "max_batch": self.max_batch,
+            "requests": requests,
+            "batches": batches,
+            "mean_batch_size": round(requests / batches, 2) if batches else 0.0,
+            "batch_size_histogram": sizes,
+            "queue_delay_ms": delay,
+        }
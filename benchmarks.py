@@ -0,0 +1,358 @@
+"""
+Benchmark Suite for Stillbirth Risk Assessment
+Offline timings of the app's hot paths, with a regression gate
+
+    python benchmarks.py                                  # run all, print JSON
+    python benchmarks.py --quick                          # history at 1k/100k rows only
+    python benchmarks.py --output bench.json              # also write results
+    python benchmarks.py --save-baseline bench_baseline.json
+    python benchmarks.py --baseline bench_baseline.json --threshold 0.25
+
+Each case reports p50/p95/p99/mean latency in ms and throughput (calls/s,
+plus rows/s for history cases). With --baseline, the run exits with status 1
+when any case's p50 is more than --threshold (fraction) slower than stored.
+Only cases timed at least GATE_MIN_RUNS times are gated, and a case that
+looks slower is timed again before it counts as a regression. The run
+also exits with status 1 if a multi-chunk Parquet or Arrow export of a
+partly spilled history doesn't read back unchanged.
+No network access is needed: explanations are rule-based.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+import preprocessing
+from analytics import cohort_aggregates, render_charts
+from form_schema import sample_inputs
+from incremental import IncrementalScorer
+from model_artifact import load_artifact
+from trees import tree_ensemble
+from validation import validate_columns, validate_input
+from history import (HISTORY_COLUMNS, HistoryIndex, calculate_statistics, history_arrow, history_csv, history_page,
+                     history_parquet, read_history, search_history)
+from history_spill import SEGMENT_ROWS, HistorySpill
+from report import _setup_pdf_font, _wrap_lines, build_pdf, explanation_for_band, explanations_for_levels
+
+HISTORY_SIZES = [1_000, 100_000, 1_000_000]
+QUICK_HISTORY_SIZES = [1_000, 100_000]
+
+# Cases with fewer timed runs (here or in the baseline) are reported, not gated:
+# a p50 over a handful of runs moves by more than the threshold on a busy machine
+GATE_MIN_RUNS = 10
+
+SAMPLE_INPUT = {
+    "gestational_weeks": 36, "babyweight": 2.4, "prenatal_visits": 2,
+    "total_emergency_visits": 3, "height": 160, "bmi": 31.5,
+    "systolic_bp": 145, "diastolic_bp": 92, "diabetes": "yes", "hypertension": "yes",
+    "creatinine_mean": 0.9, "hba1c_mean": 7.1, "potassium_mean": 4.2,
+    "ferric_carboxymaltose_times": 1, "metoprolol_times": 2,
+    "total_inpatient_visits": 1, "twins": 0, "deliverytype": 2, "year": 31,
+}
+
+SAMPLE_REPORT_INPUTS = {
+    "gestational_weeks": 36, "bmi": 31.5, "systolic_bp": 145, "diastolic_bp": 92,
+    "prenatal_visits": 2, "diabetes": "yes", "hypertension": "yes",
+}
+
+
+def synthetic_history(n, seed=0):
+    """Deterministic history table of n rows in the session history shape"""
+    rng = np.random.default_rng(seed)
+    pct = rng.integers(0, 101, n)
+    level = np.where(pct <= 33, "Low", np.where(pct <= 66, "Moderate", "High"))
+    start = np.datetime64("2024-01-01T00:00:00")
+    ts = start + rng.integers(0, 3 * 365 * 86400, n).astype("timedelta64[s]")
+    ids = rng.integers(0, max(n // 3, 1), n)
+    return pd.DataFrame({
+        "timestamp": pd.Series(ts).dt.strftime("%Y-%m-%d %H:%M:%S"),
+        "patient_id": [f"23-{i:06d}" for i in ids],
+        "patient_name": [f"Patient {i}" for i in ids],
+        "risk_level": level,
+        "score_pct": pct,
+        "explanation": np.where(
+            pct > 66,
+            "High risk — increase monitoring. | Elevated blood pressure. | Diabetes present.",
+            "Low risk — continue standard care."),
+        "gestational_weeks": rng.integers(20, 43, n),
+        "babyweight": np.round(rng.uniform(0.5, 6.0, n), 1),
+        "bmi": np.round(rng.uniform(16.0, 45.0, n), 1),
+        "height": rng.integers(130, 201, n),
+        "systolic_bp": rng.integers(80, 221, n),
+        "diastolic_bp": rng.integers(50, 141, n),
+        "prenatal_visits": rng.integers(0, 31, n),
+        "emergency_visits": rng.integers(0, 21, n),
+        "inpatient_visits": rng.integers(0, 11, n),
+        "diabetes": rng.choice(["yes", "no"], n),
+        "hypertension": rng.choice(["yes", "no"], n),
+        "twins": rng.integers(0, 2, n),
+        "deliverytype": rng.integers(1, 4, n),
+        "model_version": "1.0.0",
+    })[HISTORY_COLUMNS]
+
+
+def export_roundtrip_errors(n=5000):
+    """
+    Export formats (with the error) whose multi-chunk export doesn't read back as the history
+
+    As in the app, the export goes through a HistorySpill with part of the
+    rows on disk, so it is written in SEGMENT_ROWS chunks whose label columns
+    take values the first chunk didn't have.
+    """
+    df = synthetic_history(n)
+    later = np.arange(n) >= SEGMENT_ROWS
+    df["model_version"] = np.where(later, "1.1.0", "1.0.0")
+    df["diabetes"] = np.where(later & (df["diabetes"] == "yes"), "نعم", df["diabetes"])
+    df["risk_level"] = np.where(later, df["risk_level"], "Low")
+    errors = []
+    with tempfile.TemporaryDirectory(prefix="bench-spill-") as spill_dir:
+        spill = HistorySpill(df.copy(), spill_dir=spill_dir)
+        spill.spill(spill.memory_bytes // 2)
+        for name, export in (("parquet", history_parquet), ("arrow", history_arrow)):
+            try:
+                if not read_history(export(spill.df, spill=spill)).equals(df):
+                    errors.append(f"{name}: rows differ after the round trip")
+            except Exception as e:
+                errors.append(f"{name}: {type(e).__name__}: {e}")
+    return errors
+
+
+def measure(fn, repeat, warmup=1):
+    """Wall-clock seconds of `repeat` calls to fn after `warmup` untimed calls"""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return np.array(times)
+
+
+def summarize(times, rows=None):
+    ms = times * 1000.0
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    mean = float(ms.mean())
+    result = {
+        "n": len(times),
+        "p50_ms": round(float(p50), 4),
+        "p95_ms": round(float(p95), 4),
+        "p99_ms": round(float(p99), 4),
+        "mean_ms": round(mean, 4),
+        "ops_per_s": round(1000.0 / mean, 2) if mean else None,
+    }
+    if rows:
+        result["rows_per_s"] = round(rows * 1000.0 / mean, 1) if mean else None
+    return result
+
+
+def build_cases(history_sizes):
+    """(name, fn, repeat, rows) for every benchmarked hot path"""
+    model, feature_names = preprocessing.get_model_artifacts()
+    bullets = explanation_for_band(SAMPLE_REPORT_INPUTS, "High", SAMPLE_INPUT)
+    bullets_ar = explanation_for_band(SAMPLE_REPORT_INPUTS, "مرتفع", SAMPLE_INPUT, arabic=True)
+
+    def pdf(arabic):
+        return build_pdf("23-001", "Sara A." if not arabic else "سارة", "2025-01-01 10:00:00", 72,
+                         "مرتفع" if arabic else "High", "high",
+                         bullets_ar if arabic else bullets, SAMPLE_REPORT_INPUTS, AR=arabic)
+
+    wrap_canvas = canvas.Canvas(None, pagesize=A4)
+    wrap_font = _setup_pdf_font(False)
+    long_text = " ".join(["Elevated blood pressure may indicate preeclampsia risk."] * 300)
+
+    def predict_risk_with_reload():
+        # The original predict_risk loaded the model from disk on every call
+        preprocessing.load_model_artifacts()
+        return preprocessing.predict_risk(SAMPLE_INPUT)
+
+    # Returning patients: the same inputs with a new systolic reading each time
+    trees = tree_ensemble(model)
+    scorer = IncrementalScorer()
+    cohort = sample_inputs(1000, seed=1)
+    cohort_ids = [f"23-{i:06d}" for i in range(len(cohort))]
+    reading = [0]
+
+    def reassess(n):
+        reading[0] = (reading[0] + 1) % 60
+        inputs = [dict(u, systolic_bp=100 + reading[0]) for u in cohort[:n]]
+        return inputs, cohort_ids[:n]
+
+    def rescore_full(n):
+        inputs, _ = reassess(n)
+        return trees.predict_alive_proba(preprocessing.features_matrix(inputs, feature_names))
+
+    def rescore_serving(n):
+        # What Evaluate and the API run without incremental scoring
+        inputs, _ = reassess(n)
+        return preprocessing.predict_risk_with_model(model, feature_names, inputs)
+
+    def rescore_incremental(n):
+        inputs, ids = reassess(n)
+        return scorer.score_batch(model, feature_names, inputs, ids)
+
+    # API/batch validation of form-shaped inputs (all valid, the common case)
+    validation_frame = pd.DataFrame.from_records(sample_inputs(10_000, seed=2))
+    validation_records = validation_frame.to_dict("records")
+    levels = ["High", "Moderate", "Low"] * (len(validation_records) // 3) + ["High"]
+
+    cases = [
+        ("preprocess_input_for_model", lambda: preprocessing.preprocess_input_for_model(SAMPLE_INPUT), 500, None),
+        ("preprocess_input", lambda: preprocessing.preprocess_input(SAMPLE_INPUT), 500, None),
+        ("predict_stillbirth_risk", lambda: preprocessing.predict_stillbirth_risk_batch(model, feature_names, [SAMPLE_INPUT]), 300, None),
+        ("predict_risk", lambda: preprocessing.predict_risk(SAMPLE_INPUT), 300, None),
+        ("predict_risk_reload", predict_risk_with_reload, 20, None),
+        ("model_load_joblib", preprocessing.load_joblib_artifacts, 20, None),
+        ("model_load_artifact", lambda: load_artifact(preprocessing.ARTIFACT_DIR), 20, None),
+        ("rescore_full", lambda: rescore_full(1), 300, None),
+        ("rescore_serving", lambda: rescore_serving(1), 300, None),
+        ("rescore_incremental", lambda: rescore_incremental(1), 300, None),
+        ("rescore_full_1k", lambda: rescore_full(1000), 20, 1000),
+        ("rescore_serving_1k", lambda: rescore_serving(1000), 20, 1000),
+        ("rescore_incremental_1k", lambda: rescore_incremental(1000), 20, 1000),
+        ("validate_input", lambda: validate_input(SAMPLE_INPUT), 500, None),
+        ("validate_columns_10k", lambda: validate_columns(validation_frame), 20, 10_000),
+        ("explanation_for_band_10k",
+         lambda: [explanation_for_band(u, level, u) for u, level in zip(validation_records, levels)], 10, 10_000),
+        ("explanations_for_levels_10k", lambda: explanations_for_levels(validation_frame, levels), 20, 10_000),
+        ("render_cohort_charts", lambda: render_charts(cohort_aggregates(synthetic_history(1000))), 10, None),
+        ("build_pdf_en", lambda: pdf(False), 30, None),
+        ("build_pdf_ar", lambda: pdf(True), 30, None),
+        ("wrap_lines_long_text", lambda: _wrap_lines(wrap_canvas, long_text, A4[0] - 100, wrap_font, 10), 30, None),
+    ]
+
+    # Exports re-read from disk by the import cases (removed at exit)
+    export_dir = tempfile.TemporaryDirectory(prefix="bench-history-")
+
+    def exported(df, label, fn, suffix):
+        path = os.path.join(export_dir.name, f"history_{label}.{suffix}")
+        with open(path, "wb") as f:
+            f.write(fn(df).getvalue())
+        return path
+
+    for n in history_sizes:
+        df = synthetic_history(n)
+        repeat = 50 if n <= 10_000 else (10 if n <= 100_000 else 3)
+        # Exports and imports: fewer runs, but enough to be gated up to 100k rows
+        few = max(repeat // 3, GATE_MIN_RUNS) if n <= 100_000 else 1
+        label = f"{n // 1000}k" if n < 1_000_000 else f"{n // 1_000_000}m"
+        csv_path = exported(df, label, history_csv, "csv")
+        parquet_path = exported(df, label, history_parquet, "parquet")
+        arrow_path = exported(df, label, history_arrow, "arrow")
+        cases += [
+            (f"calculate_statistics_{label}", lambda df=df: calculate_statistics(df), repeat, n),
+            (f"history_search_{label}", lambda df=df: search_history(df, "patient 12"), repeat, n),
+            (f"csv_export_{label}", lambda df=df: history_csv(df), few, n),
+            (f"parquet_export_{label}", lambda df=df: history_parquet(df), few, n),
+            (f"arrow_export_{label}", lambda df=df: history_arrow(df), few, n),
+            # (export_dir is bound so the files outlive build_cases)
+            (f"csv_import_{label}", lambda path=csv_path, d=export_dir: pd.read_csv(path, encoding="utf-8-sig"),
+             few, n),
+            (f"parquet_import_{label}", lambda path=parquet_path, d=export_dir: read_history(path),
+             few, n),
+            (f"arrow_import_{label}", lambda path=arrow_path, d=export_dir: read_history(path),
+             few, n),
+            (f"cohort_aggregates_{label}", lambda df=df: cohort_aggregates(df), few, n),
+            (f"history_index_{label}", lambda df=df: HistoryIndex("timestamp").order(df, True), repeat, n),
+            (f"history_page_{label}",
+             lambda df=df, rows=HistoryIndex("timestamp").order(df, True): history_page(df, rows, 2, 50), 50, None),
+        ]
+    return cases
+
+
+def run(history_sizes, only=None):
+    results, fns = {}, {}
+    for name, fn, repeat, rows in build_cases(history_sizes):
+        if only and not any(pattern in name for pattern in only):
+            continue
+        results[name] = summarize(measure(fn, repeat), rows)
+        fns[name] = (fn, repeat, rows)
+        print(f"{name:32s} p50 {results[name]['p50_ms']:10.3f} ms   p99 {results[name]['p99_ms']:10.3f} ms",
+              file=sys.stderr)
+    return results, fns
+
+
+def compare(results, baseline, threshold):
+    """
+    Cases whose p50 regressed by more than `threshold` against the baseline
+
+    Returns:
+        tuple: (regressions, names of cases left out for too few runs)
+    """
+    regressions, ungated = [], []
+    for name, current in results.items():
+        base = baseline.get("cases", {}).get(name)
+        if not base or not base.get("p50_ms"):
+            continue
+        if min(current["n"], base.get("n", 0)) < GATE_MIN_RUNS:
+            ungated.append(name)
+            continue
+        ratio = current["p50_ms"] / base["p50_ms"]
+        if ratio > 1.0 + threshold:
+            regressions.append({"case": name, "baseline_p50_ms": base["p50_ms"],
+                                "p50_ms": current["p50_ms"], "ratio": round(ratio, 3)})
+    return regressions, ungated
+
+
+def confirm(regressions, results, fns, baseline, threshold):
+    """Time each regressed case again and keep its faster run; cases still slower are returned"""
+    for regression in regressions:
+        name = regression["case"]
+        fn, repeat, rows = fns[name]
+        again = summarize(measure(fn, repeat), rows)
+        if again["p50_ms"] < results[name]["p50_ms"]:
+            results[name] = again
+    return compare({r["case"]: results[r["case"]] for r in regressions}, baseline, threshold)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the app's hot paths")
+    parser.add_argument("--quick", action="store_true", help="Skip the 1M-row history cases")
+    parser.add_argument("--only", nargs="*", help="Run only cases whose name contains one of these")
+    parser.add_argument("--output", help="Write the JSON results to this file")
+    parser.add_argument("--baseline", help="Fail when slower than this stored result file")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Allowed p50 slowdown against the baseline (0.25 = 25%%)")
+    parser.add_argument("--save-baseline", help="Store this run as the baseline file")
+    args = parser.parse_args()
+
+    warnings.filterwarnings("ignore")
+    results, fns = run(QUICK_HISTORY_SIZES if args.quick else HISTORY_SIZES, args.only)
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cases": results,
+    }
+
+    # Exports must read back unchanged, whatever the timings
+    report["export_roundtrip_errors"] = export_roundtrip_errors()
+    status = 1 if report["export_roundtrip_errors"] else 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions, ungated = compare(results, baseline, args.threshold)
+        regressions = confirm(regressions, results, fns, baseline, args.threshold)
+        report["regressions"] = regressions
+        report["ungated"] = ungated
+        status = 1 if regressions or status else 0
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    for path in filter(None, [args.output, args.save_baseline]):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
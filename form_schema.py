@@ -0,0 +1,54 @@
+"""
+Form Schema for Stillbirth Risk Assessment
+Ranges of the clinical inputs on the Streamlit form, keyed by the user_input
+field names used by preprocessing, and a sampler for synthetic inputs
+"""
+
+import numpy as np
+
+# number_input bounds of the app form (and of API/batch validation): (min, max, default, step)
+NUMBER_INPUTS = {
+    "gestational_weeks": (20, 42, 39, 1),
+    "babyweight": (0.5, 6.0, 3.2, 0.1),
+    "height": (130, 200, 165, 1),
+    "bmi": (16.0, 45.0, 27.0, 0.1),
+    "year": (15, 55, 28, 1),  # mother's age
+    "systolic_bp": (80, 220, 120, 1),
+    "diastolic_bp": (50, 140, 75, 1),
+    "prenatal_visits": (0, 30, 4, 1),
+    "total_emergency_visits": (0, 20, 0, 1),
+    "total_inpatient_visits": (0, 10, 0, 1),
+    "creatinine_mean": (0.0, 5.0, 0.0, 0.1),
+    "hba1c_mean": (0.0, 15.0, 0.0, 0.1),
+    "potassium_mean": (0.0, 10.0, 0.0, 0.1),
+    "ferric_carboxymaltose_times": (0, 20, 0, 1),
+    "metoprolol_times": (0, 50, 0, 1),
+}
+
+# selectbox inputs after mapping to model values
+CHOICE_INPUTS = {
+    "diabetes": ("no", "yes"),
+    "hypertension": ("no", "yes"),
+    "twins": (0, 1),
+    "deliverytype": (1, 2, 3),
+}
+
+
+def sample_inputs(n, seed=0):
+    """
+    Uniform random user inputs on the form's grid
+
+    Each number_input is drawn from its range in steps of its step size, and
+    each choice uniformly from its options.
+
+    Returns:
+        list: n user_input dicts
+    """
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for name, (low, high, _, step) in NUMBER_INPUTS.items():
+        values = low + rng.integers(0, int(round((high - low) / step)) + 1, n) * step
+        columns[name] = np.round(values, 1).tolist() if isinstance(step, float) else values.astype(int).tolist()
+    for name, options in CHOICE_INPUTS.items():
+        columns[name] = [options[i] for i in rng.integers(0, len(options), n)]
+    return [dict(zip(columns, row)) for row in zip(*columns.values())]
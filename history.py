@@ -0,0 +1,394 @@
+"""
+History Module for Stillbirth Risk Assessment
+Patient history table helpers: statistics, search, paging, and CSV, Parquet
+and Arrow export and import
+"""
+
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Column order of the session history table
+HISTORY_COLUMNS = [
+    "timestamp", "patient_id", "patient_name",
+    "risk_level", "score_pct", "explanation",
+    "gestational_weeks", "babyweight", "bmi", "height",
+    "systolic_bp", "diastolic_bp", "prenatal_visits",
+    "emergency_visits", "inpatient_visits",
+    "diabetes", "hypertension", "twins", "deliverytype",
+    "model_version"
+]
+
+# Columns shown in the on-screen history table
+DISPLAY_COLUMNS = ["timestamp", "patient_id", "patient_name", "risk_level", "score_pct", "explanation"]
+
+# Columns the on-screen table can be sorted by
+SORT_COLUMNS = ["timestamp", "score_pct", "patient_id", "patient_name", "risk_level"]
+
+# Typed columns of the Parquet and Arrow exports (names stay English in
+# both languages); "history_schema" is bumped when a column changes
+_LABEL = pa.dictionary(pa.int8(), pa.string())
+HISTORY_SCHEMA = pa.schema([
+    ("timestamp", pa.timestamp("s")),
+    ("patient_id", pa.string()),
+    ("patient_name", pa.string()),
+    ("risk_level", _LABEL),
+    ("score_pct", pa.int16()),
+    ("explanation", pa.string()),
+    ("gestational_weeks", pa.int16()),
+    ("babyweight", pa.float64()),
+    ("bmi", pa.float64()),
+    ("height", pa.int16()),
+    ("systolic_bp", pa.int16()),
+    ("diastolic_bp", pa.int16()),
+    ("prenatal_visits", pa.int16()),
+    ("emergency_visits", pa.int16()),
+    ("inpatient_visits", pa.int16()),
+    ("diabetes", _LABEL),
+    ("hypertension", _LABEL),
+    ("twins", pa.int8()),
+    ("deliverytype", pa.int8()),
+    ("model_version", pa.dictionary(pa.int32(), pa.string())),
+], metadata={"history_schema": "1"})
+
+# Compression of the Parquet and Arrow exports
+EXPORT_COMPRESSION = "zstd"
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Explanations longer than this are cut in the on-screen table (the CSV keeps them)
+EXPLANATION_CHARS = 120
+
+COL_MAP_EN = {
+    "timestamp": "timestamp", "patient_id": "patient_id", "patient_name": "patient_name",
+    "risk_level": "risk_level", "score_pct": "score_pct", "explanation": "explanation",
+    "gestational_weeks": "gestational_weeks", "babyweight": "babyweight", "bmi": "bmi", "height": "height",
+    "systolic_bp": "systolic_bp", "diastolic_bp": "diastolic_bp", "prenatal_visits": "prenatal_visits",
+    "emergency_visits": "emergency_visits", "inpatient_visits": "inpatient_visits",
+    "diabetes": "diabetes", "hypertension": "hypertension", "twins": "twins", "deliverytype": "deliverytype",
+    "model_version": "model_version"
+}
+
+COL_MAP_AR = {
+    "timestamp": "التاريخ", "patient_id": "رقم المريضة", "patient_name": "اسم المريضة",
+    "risk_level": "مستوى الخطورة", "score_pct": "المؤشر", "explanation": "توضيح",
+    "gestational_weeks": "عمر الحمل (أسابيع)", "babyweight": "وزن الطفل", "bmi": "مؤشر كتلة الجسم", "height": "الطول",
+    "systolic_bp": "الضغط الانقباضي", "diastolic_bp": "الضغط الانبساطي", "prenatal_visits": "زيارات قبل الولادة",
+    "emergency_visits": "زيارات الطوارئ", "inpatient_visits": "الزيارات الداخلية",
+    "diabetes": "سكري", "hypertension": "ارتفاع ضغط", "twins": "توأم", "deliverytype": "نوع الولادة",
+    "model_version": "إصدار النموذج"
+}
+
+
+def empty_history():
+    """Empty history table with the expected columns"""
+    return pd.DataFrame(columns=HISTORY_COLUMNS)
+
+
+def calculate_statistics(df):
+    """Calculate statistics from the history"""
+    if len(df) == 0:
+        return {
+            "total_cases": 0,
+            "low_risk": 0,
+            "moderate_risk": 0,
+            "high_risk": 0,
+            "avg_score": 0
+        }
+
+    total_cases = len(df)
+
+    # Count risk levels - handle both English and Arabic
+    low_risk = len(df[df["risk_level"].str.contains("Low|منخفض", case=False, na=False)])
+    moderate_risk = len(df[df["risk_level"].str.contains("Moderate|متوسط", case=False, na=False)])
+    high_risk = len(df[df["risk_level"].str.contains("High|مرتفع", case=False, na=False)])
+
+    avg_score = df["score_pct"].mean() if total_cases > 0 else 0
+
+    return {
+        "total_cases": total_cases,
+        "low_risk": low_risk,
+        "moderate_risk": moderate_risk,
+        "high_risk": high_risk,
+        "avg_score": round(avg_score, 1)
+    }
+
+
+def search_mask(df, q):
+    """Boolean array: patient name or ID contains q (case-insensitive)"""
+    return (df["patient_name"].str.contains(q, case=False, na=False)
+            | df["patient_id"].str.contains(q, case=False, na=False)).to_numpy(dtype=bool)
+
+
+def search_history(df, q):
+    """Rows whose patient name or ID contains q (case-insensitive)"""
+    if not q:
+        return df
+    return df[search_mask(df, q)]
+
+
+def _sort_keys(values, column):
+    """Comparable keys of one column (timestamps as int64, scores as floats)"""
+    if column == "timestamp":
+        parsed = pd.to_datetime(values, format=TIMESTAMP_FORMAT, errors="coerce")
+        return parsed.to_numpy(dtype="datetime64[ns]").view(np.int64)
+    if column == "score_pct":
+        return pd.to_numeric(values, errors="coerce").to_numpy(dtype=np.float64)
+    return values.astype(str).to_numpy(dtype=object)
+
+
+class HistoryIndex:
+    """
+    Row positions of the history in the order of one column
+
+    Built once with a stable argsort, then kept up to date as rows are
+    appended: new rows are merged in with a binary search, so an Evaluate
+    costs one array insert instead of re-sorting the whole history. Rows
+    with equal keys stay in insertion order.
+
+    Args:
+        column (str): One of SORT_COLUMNS
+    """
+
+    def __init__(self, column):
+        self.column = column
+        self._df = None
+        self._keys = None
+        self._order = None
+
+    def order(self, df, descending=False):
+        """
+        Positions of all rows of df, sorted
+
+        Returns:
+            np.ndarray: Row positions (descending is a reversed view)
+        """
+        n = len(df)
+        if self._df is not df or n < len(self._order):
+            # New or replaced table: full sort
+            keys = _sort_keys(df[self.column], self.column)
+            self._order = np.argsort(keys, kind="stable")
+            self._keys = keys[self._order]
+            self._df = df
+        elif n > len(self._order):
+            new_keys = _sort_keys(df[self.column].iloc[len(self._order):], self.column)
+            new_order = np.argsort(new_keys, kind="stable")
+            new_keys = new_keys[new_order]
+            at = np.searchsorted(self._keys, new_keys, side="right")
+            self._order = np.insert(self._order, at, new_order + len(self._order))
+            self._keys = np.insert(self._keys, at, new_keys)
+        return self._order[::-1] if descending else self._order
+
+
+def history_page(df, rows, page, page_size, explanation_chars=EXPLANATION_CHARS, spill=None):
+    """
+    One page of the on-screen history table
+
+    Only the page's rows are copied, so the cost does not depend on the
+    size of the history.
+
+    Args:
+        df (pd.DataFrame): History table
+        rows (np.ndarray): Positions of the rows to show, in display order
+        page (int): 1-based page number
+        page_size (int): Rows per page
+        explanation_chars (int): Longer explanations are cut with "…"
+        spill (HistorySpill): Reads back values of spilled rows (history_spill.py)
+
+    Returns:
+        pd.DataFrame: DISPLAY_COLUMNS of the page, indexed like the history
+    """
+    window = rows[(page - 1) * page_size:page * page_size]
+    if not len(window):
+        out = df[DISPLAY_COLUMNS].iloc[0:0]
+    elif spill is not None:
+        out = spill.rows(window, DISPLAY_COLUMNS)
+    else:
+        out = df.iloc[window][DISPLAY_COLUMNS].copy()
+    text = out["explanation"].astype(str)
+    long = text.str.len() > explanation_chars
+    out["explanation"] = text.where(~long, text.str.slice(0, explanation_chars - 1) + "…")
+    return out
+
+
+def history_csv(df, arabic=False, spill=None):
+    """
+    Export the history as UTF-8 (BOM) CSV with localized column names
+
+    Args:
+        df (pd.DataFrame): History table
+        arabic (bool): Arabic column names
+        spill (HistorySpill): Reads back spilled rows, one chunk at a time
+
+    Returns:
+        io.BytesIO: CSV bytes positioned at the start
+    """
+    col_map = COL_MAP_AR if arabic else COL_MAP_EN
+    csv_bytes = io.BytesIO()
+    if spill is None:
+        # Create a copy of the DataFrame with only the expected columns
+        df_renamed = df[HISTORY_COLUMNS].copy()
+
+        # Rename the columns
+        df_renamed = df_renamed.rename(columns=col_map)
+
+        # Write to BytesIO with UTF-8 encoding
+        df_renamed.to_csv(csv_bytes, index=False, encoding="utf-8-sig")
+    else:
+        csv_bytes.write("\ufeff".encode("utf-8"))
+        header = True
+        for chunk in spill.frames():
+            chunk.rename(columns=col_map).to_csv(csv_bytes, index=False, header=header, encoding="utf-8")
+            header = False
+        if header:
+            df[HISTORY_COLUMNS].iloc[0:0].rename(columns=col_map).to_csv(csv_bytes, index=False, encoding="utf-8")
+    csv_bytes.seek(0)
+    return csv_bytes
+
+
+def history_table(df):
+    """
+    The history as an Arrow table with HISTORY_SCHEMA types
+
+    Timestamps are parsed from the table's text; values that don't fit a
+    column's type (e.g. unparseable timestamps) raise ValueError.
+    """
+    frame = df[HISTORY_COLUMNS].copy()
+    frame["timestamp"] = pd.to_datetime(frame["timestamp"], format=TIMESTAMP_FORMAT, errors="coerce")
+    for column in ("risk_level", "diabetes", "hypertension", "model_version"):
+        frame[column] = frame[column].astype(object).where(frame[column].notna(), None)
+    try:
+        return pa.Table.from_pandas(frame, schema=HISTORY_SCHEMA, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        raise ValueError(f"history does not fit the export schema: {e}") from e
+
+
+def _history_chunks(df, spill):
+    """History tables in row order: one, or one per spill chunk (bounded memory)"""
+    if spill is None:
+        yield history_table(df)
+    else:
+        for chunk in spill.frames():
+            yield history_table(chunk)
+
+
+def _shared_dictionaries(tables):
+    """
+    The tables with each label column on one growing dictionary
+
+    An Arrow IPC file allows a single dictionary per field, extended only by
+    deltas. Each chunk's labels are remapped onto the values seen so far,
+    new values appended at the end.
+    """
+    known = {}
+    for table in tables:
+        for i, field in enumerate(table.schema):
+            if not pa.types.is_dictionary(field.type):
+                continue
+            column = table.column(i).combine_chunks()
+            dictionary = column.dictionary.to_pylist()
+            values = known.setdefault(field.name, {})
+            for value in dictionary:
+                values.setdefault(value, len(values))
+            if dictionary == list(values) and table.column(i).num_chunks == 1:
+                continue
+            remap = pa.array([values[v] for v in dictionary], field.type.index_type)
+            shared = pa.DictionaryArray.from_arrays(remap.take(column.indices),
+                                                    pa.array(list(values), pa.string()))
+            table = table.set_column(i, field, shared)
+        yield table
+
+
+def history_parquet(df, spill=None):
+    """
+    Export the history as Parquet (typed columns, zstd)
+
+    Args:
+        df (pd.DataFrame): History table
+        spill (HistorySpill): Reads back spilled rows, one chunk at a time
+
+    Returns:
+        io.BytesIO: Parquet bytes positioned at the start
+    """
+    out = io.BytesIO()
+    with pq.ParquetWriter(out, HISTORY_SCHEMA, compression=EXPORT_COMPRESSION) as writer:
+        for table in _history_chunks(df, spill):
+            writer.write_table(table)
+    out.seek(0)
+    return out
+
+
+def history_arrow(df, spill=None):
+    """
+    Export the history as an Arrow IPC file (typed columns, zstd buffers)
+
+    Args:
+        df (pd.DataFrame): History table
+        spill (HistorySpill): Reads back spilled rows, one chunk at a time
+
+    Returns:
+        io.BytesIO: Arrow file bytes positioned at the start
+    """
+    out = io.BytesIO()
+    options = pa.ipc.IpcWriteOptions(compression=EXPORT_COMPRESSION, emit_dictionary_deltas=True)
+    with pa.ipc.new_file(out, HISTORY_SCHEMA, options=options) as writer:
+        for table in _shared_dictionaries(_history_chunks(df, spill)):
+            writer.write_table(table)
+    out.seek(0)
+    return out
+
+
+def read_history(source):
+    """
+    History table from a Parquet or Arrow export
+
+    Files on disk are memory-mapped. The result has the dtypes of a history
+    built in the app: timestamps as text, labels as strings, whole numbers
+    as int64 (float64 where values are missing).
+
+    Args:
+        source: File path, bytes, or a binary file object
+
+    Returns:
+        pd.DataFrame: HISTORY_COLUMNS
+    """
+    if isinstance(source, (str, os.PathLike)):
+        reader = pa.memory_map(os.fspath(source))
+    else:
+        data = source if isinstance(source, (bytes, bytearray, memoryview)) else source.read()
+        reader = pa.BufferReader(pa.py_buffer(data))
+    head = reader.read(6)
+    reader.seek(0)
+    try:
+        if head[:4] == b"PAR1":
+            table = pq.read_table(reader)
+        elif head == b"ARROW1":
+            table = pa.ipc.open_file(reader).read_all()
+        else:
+            raise ValueError("not a Parquet or Arrow history file")
+    except pa.ArrowException as e:
+        raise ValueError(f"unreadable history file: {e}") from e
+
+    missing = [c for c in HISTORY_COLUMNS if c not in table.column_names]
+    if missing:
+        raise ValueError(f"history file is missing columns: {', '.join(missing)}")
+    table = table.select(HISTORY_COLUMNS)
+    try:
+        table = table.cast(HISTORY_SCHEMA)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError) as e:
+        raise ValueError(f"history file columns have unexpected types: {e}") from e
+
+    # Arrow's text form of a timestamp[s] is TIMESTAMP_FORMAT
+    table = table.set_column(0, "timestamp", table.column("timestamp").cast(pa.string()))
+    # Hashing every string to share repeats only pays off for explanations
+    # (rule-based ones repeat); ids, names and timestamps are mostly unique
+    df = table.drop_columns(["explanation"]).to_pandas(deduplicate_objects=False)
+    df.insert(HISTORY_COLUMNS.index("explanation"), "explanation", table.column("explanation").to_pandas())
+    # Labels arrive as categoricals: their rows share one string per label
+    return df.astype({c: object if isinstance(df[c].dtype, pd.CategoricalDtype) else np.int64
+                      for c in df.columns
+                      if isinstance(df[c].dtype, pd.CategoricalDtype) or pd.api.types.is_integer_dtype(df[c].dtype)})
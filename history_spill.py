@@ -0,0 +1,287 @@
+"""
+History Spill Module for Stillbirth Risk Assessment
+Caps the memory each session's history table takes by moving the bulky
+columns of older rows to a private file on local disk
+
+A session's history keeps growing for as long as the session lives, and
+most of each row is text nobody looks at again: the explanation and the
+yes/no and version text columns (SPILL_COLUMNS). Once a session's history
+exceeds HISTORY_MEMORY_MB, those columns of its oldest rows are written to
+an append-only segment file and cleared in the table. The columns used for
+sorting, search, statistics and the cohort charts stay in memory, so those
+never touch the disk. The table page and the export read the spilled
+values back when they need them.
+
+Across sessions, HISTORY_MEMORY_TOTAL_MB caps the process: when all
+histories together exceed it, the sessions idle the longest are spilled
+first. A session's file is removed when its session state is dropped.
+
+    HISTORY_MEMORY_MB=4 HISTORY_MEMORY_TOTAL_MB=256 streamlit run app.py
+"""
+
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import time
+import weakref
+
+import numpy as np
+
+from history import HISTORY_COLUMNS
+
+# Memory budget of one session's history, and of all sessions in the process
+HISTORY_MEMORY_MB = float(os.getenv("HISTORY_MEMORY_MB", "8"))
+HISTORY_MEMORY_TOTAL_MB = float(os.getenv("HISTORY_MEMORY_TOTAL_MB", "256"))
+
+# Spill files go here (one per session, removed with the session)
+HISTORY_SPILL_DIR = os.getenv("HISTORY_SPILL_DIR") or os.path.join(tempfile.gettempdir(), "stillbirth-history")
+
+# Columns of older rows moved to disk; the rest stay for sorting, search,
+# statistics and the cohort charts
+SPILL_COLUMNS = ["explanation", "diabetes", "hypertension", "model_version"]
+
+# A spill brings the session down to this share of its budget, and moves at
+# least SPILL_MIN of the budget (rows keep their in-memory columns, so a long
+# history can stay over budget; it then spills in chunks, not row by row)
+SPILL_TARGET = 0.5
+SPILL_MIN = 0.25
+
+# Rows per segment of the spill file (read back whole)
+SEGMENT_ROWS = 2048
+
+_SPILL_POSITIONS = [HISTORY_COLUMNS.index(c) for c in SPILL_COLUMNS]
+
+
+def _string_bytes(value):
+    return sys.getsizeof(value) if isinstance(value, str) else 0
+
+
+def row_bytes(values):
+    """Memory of one history row: 8 bytes per cell and the index, plus its strings"""
+    return 8 * (len(values) + 1) + sum(_string_bytes(v) for v in values)
+
+
+def frame_bytes(df):
+    """Memory of a history table (deep; strings counted once per cell)"""
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def _remove(file):
+    file.close()
+    try:
+        os.remove(file.name)
+    except OSError:
+        pass
+
+
+class HistorySpill:
+    """
+    Memory accounting and spilling for one session's history table
+
+    The table stays the session's own DataFrame (the same object, so sort
+    indexes and caches keyed on it keep working); rows [0, spilled) have
+    SPILL_COLUMNS set to None in it and stored on disk. Appends, spills and
+    reads of spilled values take the instance lock, so another session can
+    spill this one while it is idle.
+
+    Args:
+        df (pd.DataFrame): The session's history table (HISTORY_COLUMNS)
+        budget_mb (float): Memory budget of the table
+        spill_dir (str): Directory of the spill file
+    """
+
+    def __init__(self, df, budget_mb=HISTORY_MEMORY_MB, spill_dir=HISTORY_SPILL_DIR):
+        self.df = df
+        self.budget = int(budget_mb * 1024 * 1024)
+        self.spill_dir = spill_dir
+        self.spilled = 0
+        self.memory_bytes = frame_bytes(df)
+        # String bytes of SPILL_COLUMNS in the rows still in memory
+        self.payload_bytes = int(df.iloc[:, _SPILL_POSITIONS].map(_string_bytes).to_numpy().sum())
+        self.disk_bytes = 0
+        self.last_active = time.monotonic()
+        self._starts = []    # first row of each segment
+        self._segments = []  # (file offset, bytes) of each segment
+        self._file = None
+        self._lock = threading.RLock()
+
+    def touch(self):
+        """Mark the session active (idle sessions are spilled first)"""
+        self.last_active = time.monotonic()
+
+    def append(self, values):
+        """
+        Add a history row, spilling older rows if the budget is exceeded
+
+        Args:
+            values (list): Row in HISTORY_COLUMNS order
+        """
+        with self._lock:
+            self.df.loc[len(self.df)] = values
+            self.memory_bytes += row_bytes(values)
+            self.payload_bytes += sum(_string_bytes(values[i]) for i in _SPILL_POSITIONS)
+            self.touch()
+            self.trim()
+
+    def trim(self):
+        """Spill older rows if the table is over budget (e.g. after an append or import)"""
+        with self._lock:
+            if self.memory_bytes > self.budget and self.payload_bytes >= self.budget * SPILL_MIN:
+                self.spill(int(self.budget * SPILL_TARGET))
+
+    def spill(self, target_bytes=0):
+        """
+        Move SPILL_COLUMNS of the oldest in-memory rows to disk until the
+        table is at most target_bytes (or nothing is left to spill)
+
+        Returns:
+            int: Rows spilled
+        """
+        with self._lock:
+            start = self.spilled
+            n = len(self.df)
+            if start >= n or self.memory_bytes <= target_bytes:
+                return 0
+            payload = self.df.iloc[start:, _SPILL_POSITIONS]
+            freed = payload.map(_string_bytes).to_numpy().sum(axis=1).cumsum()
+            # Fewest rows that bring the table under the target
+            stop = start + min(int((freed < self.memory_bytes - target_bytes).sum()) + 1, n - start)
+
+            if self._file is None:
+                os.makedirs(self.spill_dir, mode=0o700, exist_ok=True)
+                self._file = tempfile.NamedTemporaryFile(dir=self.spill_dir, prefix="history-", suffix=".spill",
+                                                         delete=False)
+                weakref.finalize(self, _remove, self._file)
+            self._file.seek(0, os.SEEK_END)
+            for first in range(start, stop, SEGMENT_ROWS):
+                last = min(first + SEGMENT_ROWS, stop)
+                data = pickle.dumps(payload.iloc[first - start:last - start].to_numpy(dtype=object),
+                                    protocol=pickle.HIGHEST_PROTOCOL)
+                self._starts.append(first)
+                self._segments.append((self._file.tell(), len(data)))
+                self._file.write(data)
+                self.disk_bytes += len(data)
+            self._file.flush()
+
+            # Only after the values are on disk are they dropped from the table
+            self.df.iloc[start:stop, _SPILL_POSITIONS] = None
+            self.memory_bytes -= int(freed[stop - start - 1])
+            self.payload_bytes -= int(freed[stop - start - 1])
+            self.spilled = stop
+            return stop - start
+
+    def _fill(self, out, positions):
+        """Put the spilled values of the rows at positions into out (same row order)"""
+        spilled = positions < self.spilled
+        columns = [(c, SPILL_COLUMNS.index(c)) for c in SPILL_COLUMNS if c in out.columns]
+        if not spilled.any() or not columns:
+            return out
+        values = {c: out[c].to_numpy(dtype=object, copy=True) for c, _ in columns}
+        segment_of = np.searchsorted(self._starts, positions, side="right") - 1
+        for segment in np.unique(segment_of[spilled]):
+            offset, size = self._segments[segment]
+            self._file.seek(offset)
+            stored = pickle.loads(self._file.read(size))
+            hit = spilled & (segment_of == segment)
+            rows = positions[hit] - self._starts[segment]
+            for column, i in columns:
+                values[column][hit] = stored[rows, i]
+        for column, _ in columns:
+            out[column] = values[column]
+        return out
+
+    def rows(self, positions, columns=None):
+        """
+        Copy of the rows at positions with the spilled values read back
+
+        Args:
+            positions (np.ndarray): Row positions
+            columns (list): Columns to return (default HISTORY_COLUMNS)
+
+        Returns:
+            pd.DataFrame: Indexed like the history
+        """
+        positions = np.asarray(positions)
+        with self._lock:
+            out = self.df.iloc[positions][columns or HISTORY_COLUMNS].copy()
+            return self._fill(out, positions)
+
+    def frames(self, chunk_rows=SEGMENT_ROWS):
+        """Yield the whole history in row order as complete chunks (for export)"""
+        n = len(self.df)
+        for first in range(0, n, chunk_rows):
+            yield self.rows(np.arange(first, min(first + chunk_rows, n)))
+
+    def stats(self):
+        """Rows, spilled rows, memory and disk MB, seconds idle"""
+        return {
+            "rows": len(self.df),
+            "spilled_rows": self.spilled,
+            "memory_mb": round(self.memory_bytes / 1024 / 1024, 2),
+            "disk_mb": round(self.disk_bytes / 1024 / 1024, 2),
+            "idle_s": round(time.monotonic() - self.last_active, 1),
+        }
+
+
+class SpillRegistry:
+    """
+    The HistorySpill of every live session in the process
+
+    Sessions are held weakly: a session whose state is dropped leaves the
+    registry, and its spill file is removed.
+
+    Args:
+        total_mb (float): Memory budget of all histories together
+        budget_mb (float): Per-session budget
+        spill_dir (str): Directory of the spill files
+    """
+
+    def __init__(self, total_mb=HISTORY_MEMORY_TOTAL_MB, budget_mb=HISTORY_MEMORY_MB, spill_dir=HISTORY_SPILL_DIR):
+        self.total = int(total_mb * 1024 * 1024)
+        self.budget_mb = budget_mb
+        self.spill_dir = spill_dir
+        self._sessions = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def attach(self, df):
+        """HistorySpill for a session's history table"""
+        spill = HistorySpill(df, self.budget_mb, self.spill_dir)
+        with self._lock:
+            self._sessions.add(spill)
+        return spill
+
+    def enforce(self):
+        """
+        Spill whole sessions, longest idle first, until all histories fit
+        SPILL_TARGET of the process budget
+
+        Returns:
+            int: Rows spilled
+        """
+        with self._lock:
+            sessions = sorted(self._sessions, key=lambda s: s.last_active)
+        total = sum(s.memory_bytes for s in sessions)
+        spilled = 0
+        if total <= self.total:
+            return 0
+        for spill in sessions:
+            if total <= self.total * SPILL_TARGET:
+                break
+            before = spill.memory_bytes
+            spilled += spill.spill(0)
+            total -= before - spill.memory_bytes
+        return spilled
+
+    def stats(self):
+        """Per-session stats (longest idle first) and the process total"""
+        with self._lock:
+            sessions = sorted(self._sessions, key=lambda s: s.last_active)
+        rows = [s.stats() for s in sessions]
+        return {
+            "sessions": rows,
+            "memory_mb": round(sum(r["memory_mb"] for r in rows), 2),
+            "disk_mb": round(sum(r["disk_mb"] for r in rows), 2),
+            "total_mb": round(self.total / 1024 / 1024, 1),
+        }
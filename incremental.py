@@ -0,0 +1,226 @@
+"""
+Incremental Rescoring for Stillbirth Risk Assessment
+Reassesses a returning patient by re-walking only the trees that split on
+the features that changed since the patient's last assessment
+
+For each patient_id the scorer keeps the model feature row and the leaf
+reached in every tree (600 int32, about 2.4 KB per patient), in an LRU of
+INCREMENTAL_MAX_PATIENTS entries. On reassessment it compares the new row
+with the stored one, looks up the trees that split on any changed feature
+(TreeEnsemble.feature_usage) and walks only those; every other tree still
+lands in its stored leaf. The margin is then summed from all leaves in
+booster order, so the score is bit for bit the full evaluation's.
+
+A new BP reading (systolic) re-walks 261 of the 600 trees, two more
+prenatal visits 192. Entries are kept per flattened model, so a reloaded or
+shadow model never reuses another model's leaves.
+
+Offline study: against the serving path (the booster's inplace_predict
+for batches) this is not faster, so the app and the API don't use it.
+
+    python incremental.py --samples 2000      # exactness check + timings
+"""
+
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from form_schema import NUMBER_INPUTS, sample_inputs
+from preprocessing import classify_risk, features_matrix, get_model_artifacts, predict_risk_with_model
+from trees import accumulate, sigmoid, tree_ensemble
+
+# Patients whose last leaf indices are kept
+INCREMENTAL_MAX_PATIENTS = 10_000
+
+_Entry = namedtuple("_Entry", "trees row leaves")
+
+
+class IncrementalScorer:
+    """
+    Per-patient cache of leaf indices with partial re-traversal
+
+    Args:
+        max_patients (int): Least recently assessed patients beyond this are forgotten
+    """
+
+    def __init__(self, max_patients=INCREMENTAL_MAX_PATIENTS):
+        self.max_patients = max_patients
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.full = 0
+        self.incremental = 0
+        self.unchanged = 0
+        self.trees_walked = 0
+
+    def score_batch(self, model, feature_names, user_inputs, patient_ids):
+        """
+        Score inputs, reusing each patient's previous traversal
+
+        Rows are grouped by which features changed, and each group walks its
+        trees in one call, so a batch of reassessments costs about as much
+        as a full batch over the trees that actually need walking.
+
+        Args:
+            model: ModelArtifact or fitted XGBClassifier
+            feature_names (list): Model feature order
+            user_inputs (list): User input dicts
+            patient_ids (list): Patient id per input (empty ids are never cached)
+
+        Returns:
+            list: classify_risk dicts, as predict_risk_with_model returns them
+        """
+        trees = tree_ensemble(model)
+        features = features_matrix(user_inputs, feature_names)
+        keys = [(patient_id, id(trees)) if patient_id else None for patient_id in patient_ids]
+        with self._lock:
+            entries = [self._entries.get(key) if key else None for key in keys]
+        entries = [e if e is not None and e.trees is trees else None for e in entries]
+
+        # Rows without a usable entry are walked in full, the rest grouped by
+        # the set of changed features
+        leaves = np.empty((len(features), trees.n_trees), dtype=np.int32)
+        groups, full_rows = {}, []
+        for i, (row, entry) in enumerate(zip(features, entries)):
+            if entry is None:
+                full_rows.append(i)
+                continue
+            changed = ~((row == entry.row) | (np.isnan(row) & np.isnan(entry.row)))
+            groups.setdefault(changed.tobytes(), (changed, []))[1].append(i)
+            leaves[i] = entry.leaves
+
+        if full_rows:
+            leaves[full_rows] = trees.leaf_indices(features[full_rows])
+            self.full += len(full_rows)
+            self.trees_walked += len(full_rows) * trees.n_trees
+        usage = trees.feature_usage(features.shape[1])
+        for changed, rows in groups.values():
+            walk = np.flatnonzero(usage[changed].any(axis=0))
+            if not len(walk):
+                self.unchanged += len(rows)
+                continue
+            leaves[np.ix_(rows, walk)] = trees.leaf_indices(features[rows], walk)
+            self.incremental += len(rows)
+            self.trees_walked += len(rows) * len(walk)
+
+        with self._lock:
+            for key, row, row_leaves in zip(keys, features, leaves):
+                if key:
+                    self._entries[key] = _Entry(trees, row.copy(), row_leaves.copy())
+                    self._entries.move_to_end(key)
+            while len(self._entries) > self.max_patients:
+                self._entries.popitem(last=False)
+
+        alive_probability = sigmoid(accumulate(trees.base_margin, trees.value[leaves]))
+        return [classify_risk(1 - p) for p in alive_probability]
+
+    def forget(self, patient_id):
+        """Drop a patient's cached traversals (all models)"""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == patient_id]:
+                del self._entries[key]
+
+    def stats(self):
+        scored = self.full + self.incremental + self.unchanged
+        return {
+            "patients": len(self._entries),
+            "full": self.full,
+            "incremental": self.incremental,
+            "unchanged": self.unchanged,
+            "mean_trees_walked": round(self.trees_walked / scored, 1) if scored else None,
+        }
+
+
+def reassessment(user_input, field, rng):
+    """The same inputs with one number_input field moved by a few steps"""
+    low, high, _, step = NUMBER_INPUTS[field]
+    value = user_input[field] + int(rng.choice([-3, -2, -1, 1, 2, 3])) * step
+    changed = dict(user_input)
+    changed[field] = round(min(max(value, low), high), 1) if isinstance(step, float) else int(min(max(value, low), high))
+    return changed
+
+
+def compare(n_samples=2000, seed=0, fields=("systolic_bp", "prenatal_visits", "bmi")):
+    """
+    Incremental vs full rescoring of returning patients
+
+    Each sampled patient is assessed once, then reassessed with one field
+    changed, one at a time and as one batch. Reports mismatches against
+    full scoring of the flattened trees (must be 0), trees walked and
+    latency, both against the full numpy walk and against the serving path
+    (predict_risk_with_model, the booster's inplace_predict for batches).
+    """
+    model, feature_names = get_model_artifacts()
+    trees = tree_ensemble(model)
+    rng = np.random.default_rng(seed)
+    patients = sample_inputs(n_samples, seed)
+    # The booster's first batch call is slow; keep that out of the timings
+    predict_risk_with_model(model, feature_names, patients)
+    results = {}
+    for field in fields:
+        scorer = IncrementalScorer(max_patients=n_samples)
+        ids = [f"p{i}" for i in range(n_samples)]
+        for patient_id, user_input in zip(ids, patients):
+            scorer.score_batch(model, feature_names, [user_input], [patient_id])
+        changed = [reassessment(u, field, rng) for u in patients]
+
+        start = time.perf_counter()
+        incremental = [scorer.score_batch(model, feature_names, [u], [i])[0] for i, u in zip(ids, changed)]
+        incremental_s = time.perf_counter() - start
+        walked = scorer.trees_walked - n_samples * trees.n_trees
+
+        start = time.perf_counter()
+        full_proba = [trees.predict_alive_proba(features_matrix([u], feature_names))[0] for u in changed]
+        full_s = time.perf_counter() - start
+        full = [classify_risk(1 - p) for p in full_proba]
+        start = time.perf_counter()
+        for u in changed:
+            predict_risk_with_model(model, feature_names, [u])
+        serving_s = time.perf_counter() - start
+
+        # The whole cohort reassessed in one call, against one full numpy walk
+        scorer.score_batch(model, feature_names, patients, ids)
+        start = time.perf_counter()
+        batch = scorer.score_batch(model, feature_names, changed, ids)
+        batch_s = time.perf_counter() - start
+        start = time.perf_counter()
+        trees.predict_alive_proba(features_matrix(changed, feature_names))
+        full_batch_s = time.perf_counter() - start
+        start = time.perf_counter()
+        predict_risk_with_model(model, feature_names, changed)
+        serving_batch_s = time.perf_counter() - start
+
+        results[field] = {
+            "score_mismatches": sum(a["risk_score"] != b["risk_score"] or a["risk_score"] != c["risk_score"]
+                                    for a, b, c in zip(full, incremental, batch)),
+            "mean_trees_walked": round(walked / n_samples, 1),
+            "single_full_ms": round(full_s * 1000 / n_samples, 4),
+            "single_incremental_ms": round(incremental_s * 1000 / n_samples, 4),
+            "single_speedup": round(full_s / incremental_s, 2),
+            "single_serving_ms": round(serving_s * 1000 / n_samples, 4),
+            "single_serving_speedup": round(serving_s / incremental_s, 2),
+            "batch_full_ms": round(full_batch_s * 1000, 2),
+            "batch_incremental_ms": round(batch_s * 1000, 2),
+            "batch_speedup": round(full_batch_s / batch_s, 2),
+            "batch_serving_ms": round(serving_batch_s * 1000, 2),
+            "batch_serving_speedup": round(serving_batch_s / batch_s, 2),
+        }
+    return {"samples": n_samples, "trees": trees.n_trees, "reassessments": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check incremental rescoring against full evaluation")
+    parser.add_argument("--samples", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    result = compare(args.samples, args.seed)
+    print(json.dumps(result, indent=2))
+    return 1 if any(r["score_mismatches"] for r in result["reassessments"].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
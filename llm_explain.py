@@ -0,0 +1,418 @@
+"""
+Batch LLM Explanations for Stillbirth Risk Assessment
+Generates AI explanations for a whole list of patients with an async
+OpenAI-compatible client, within the provider's rate limits
+
+Also holds the prompt and the bullet parsing the app uses for a single
+patient (openrouter_explain_risk), so both paths ask the same question.
+
+    concurrency     at most LLM_CONCURRENCY requests in flight
+    rate limit      token bucket of LLM_RATE_PER_MINUTE requests (burst
+                    LLM_BURST); the default 20/min is OpenRouter's limit for
+                    ':free' models, 0 disables it
+    retries         429, 5xx, timeouts and connection errors are retried up
+                    to LLM_MAX_RETRIES times with full-jitter exponential
+                    backoff, never sooner than the server's Retry-After
+    packing         LLM_PACK patients of the same language per prompt, each
+                    answered under its own 'Patient N:' line; a patient
+                    missing from the answer is asked for again on its own
+
+A patient whose requests all fail gets the rule-based explanation, as in
+the app.
+
+    python llm_explain.py inputs.jsonl --out explanations.jsonl
+    python llm_explain.py --standin --samples 300 --standin-latency-ms 800   # patients/min offline
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import time
+from collections import namedtuple
+
+import openai
+
+from report import explanation_for_band, localized_band
+
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+LLM_RATE_PER_MINUTE = float(os.getenv("LLM_RATE_PER_MINUTE", "20"))
+LLM_BURST = int(os.getenv("LLM_BURST", "1"))
+LLM_PACK = int(os.getenv("LLM_PACK", "1"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "60"))
+
+# Backoff before retry n (from 0) is uniform in [0, min(cap, base * 2**n)]
+RETRY_BASE_S = 1.0
+RETRY_CAP_S = 30.0
+
+DEFAULT_MODEL = "openai/gpt-oss-20b:free"
+BULLETS_PER_PATIENT = 4
+MAX_TOKENS_PER_PATIENT = 400
+PAD_BULLET = "Continue regular monitoring and follow medical advice."
+
+EXTRA_HEADERS = {
+    "HTTP-Referer": "https://yourappname.streamlit.app",
+    "X-Title": "Stillbirth Risk Assessment"
+}
+
+SYSTEM_PROMPT = (
+    "You are a clinical assistant specializing in maternal and neonatal health. "
+    "You MUST provide exactly 4 bullet points explaining stillbirth risk factors. "
+    "Each bullet point must:\n"
+    "1. Start with a dash (-) or bullet (•)\n"
+    "2. Be 1-2 sentences maximum\n"
+    "3. Focus on one specific risk factor from the patient data\n"
+    "4. Be factual and clinical (no diagnosis or treatment advice)\n\n"
+    "Format example:\n"
+    "- High BMI increases cardiovascular stress during pregnancy\n"
+    "- Limited prenatal visits reduce early detection of complications\n"
+    "- Elevated blood pressure may indicate preeclampsia risk\n"
+    "- Advanced gestational age requires closer monitoring"
+)
+
+PACKED_SYSTEM_PROMPT = SYSTEM_PROMPT + (
+    "\n\nSeveral patients are given, each introduced by a 'Patient N:' line. "
+    "Answer every patient in the same order: a line 'Patient N:' followed by "
+    "exactly 4 bullet points about that patient only."
+)
+
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+
+_PATIENT_HEADER = re.compile(r"^[\s#>*_-]*Patient\s+(\d+)\s*[*_]*\s*:?[*_]*\s*$", re.MULTILINE | re.IGNORECASE)
+
+# bullets: the explanation; source: 'llm' or 'rules'; error: last LLM error, if any
+Explanation = namedtuple("Explanation", "bullets source error")
+
+
+def risk_factors_text(inputs):
+    """The notable inputs, as listed in the prompt"""
+    risk_factors = []
+    if inputs.get("bmi", 0) >= 30:
+        risk_factors.append(f"BMI: {inputs['bmi']}")
+    if inputs.get("systolic_bp", 0) >= 140:
+        risk_factors.append(f"Systolic BP: {inputs['systolic_bp']}")
+    if inputs.get("prenatal_visits", 0) < 4:
+        risk_factors.append(f"Prenatal visits: {inputs['prenatal_visits']}")
+    if inputs.get("gestational_weeks", 0) < 37:
+        risk_factors.append(f"Gestational weeks: {inputs['gestational_weeks']}")
+    if inputs.get("diabetes") in ['yes', 'نعم']:
+        risk_factors.append("Diabetes: present")
+    if inputs.get("hypertension") in ['yes', 'نعم']:
+        risk_factors.append("Hypertension: present")
+    return ", ".join(risk_factors) if risk_factors else "Standard pregnancy parameters"
+
+
+def user_prompt(band_text, pct, inputs, arabic=False):
+    """Prompt for one patient"""
+    language = "Arabic" if arabic else "English"
+    return f"""
+Language: {language}
+Risk Level: {band_text} ({pct}%)
+Key Risk Factors: {risk_factors_text(inputs)}
+
+Provide exactly 4 bullet points explaining the risk level based on these factors.
+"""
+
+
+def packed_prompt(patients, arabic=False):
+    """Prompt for several patients (band_text, pct, inputs) in one language"""
+    language = "Arabic" if arabic else "English"
+    blocks = [
+        f"Patient {n}:\nRisk Level: {band_text} ({pct}%)\nKey Risk Factors: {risk_factors_text(inputs)}"
+        for n, (band_text, pct, inputs) in enumerate(patients, 1)
+    ]
+    return (f"\nLanguage: {language}\n\n" + "\n\n".join(blocks) +
+            f"\n\nProvide exactly 4 bullet points for each of the {len(patients)} patients, "
+            "under its 'Patient N:' line.\n")
+
+
+def bullet_lines(text):
+    """Bullet point lines of an answer, markers removed"""
+    bullets = []
+    for line in text.split("\n"):
+        line = line.strip()
+        # Remove common bullet point markers
+        if line.startswith(("- ", "• ", "* ", "1.", "2.", "3.", "4.")):
+            line = line.lstrip("-•* 1234.")
+            line = line.strip()
+            if line:  # Only add non-empty lines
+                bullets.append(line)
+    return bullets
+
+
+def parse_bullets(text):
+    """Exactly 4 bullets from an answer: padded with a generic one, or cut"""
+    bullets = bullet_lines(text)
+    while len(bullets) < BULLETS_PER_PATIENT:
+        bullets.append(PAD_BULLET)
+    return bullets[:BULLETS_PER_PATIENT]
+
+
+def split_patients(text, n):
+    """
+    Per-patient sections of a packed answer
+
+    Args:
+        text (str): Answer with 'Patient N:' header lines
+        n (int): Patients in the prompt
+
+    Returns:
+        list: Section text per patient, None where the answer has no
+        section (or no bullets) for that patient
+    """
+    sections = [None] * n
+    headers = list(_PATIENT_HEADER.finditer(text))
+    for header, following in zip(headers, headers[1:] + [None]):
+        number = int(header.group(1))
+        body = text[header.end():following.start() if following else len(text)]
+        if 1 <= number <= n and sections[number - 1] is None and bullet_lines(body):
+            sections[number - 1] = body
+    return sections
+
+
+class TokenBucket:
+    """
+    Request rate limiter for asyncio tasks; waiters are served in order
+
+    Args:
+        rate_per_minute (float): Sustained rate (0 disables the limit)
+        burst (int): Requests that may go out back to back
+    """
+
+    def __init__(self, rate_per_minute, burst=1):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return 0.0
+
+
+def default_client(timeout=LLM_TIMEOUT_S):
+    """AsyncOpenAI client for OPENROUTER_BASE_URL / OPENROUTER_API_KEY (retries are ours)"""
+    return openai.AsyncOpenAI(
+        base_url=os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1"),
+        api_key=os.getenv("OPENROUTER_API_KEY"),
+        max_retries=0,
+        timeout=timeout,
+    )
+
+
+class BatchExplainer:
+    """
+    Explanations for many patients through one async client
+
+    Use within a single event loop (see explain_batch for a blocking call).
+
+    Args:
+        client: openai.AsyncOpenAI (default: default_client())
+        model (str): Model name (default OPENROUTER_MODEL)
+        concurrency (int): Requests in flight
+        rate_per_minute (float): Token bucket rate (0: unlimited)
+        burst (int): Token bucket size
+        pack (int): Patients per prompt
+        max_retries (int): Retries per request
+    """
+
+    def __init__(self, client=None, model=None, concurrency=LLM_CONCURRENCY, rate_per_minute=LLM_RATE_PER_MINUTE,
+                 burst=LLM_BURST, pack=LLM_PACK, max_retries=LLM_MAX_RETRIES):
+        self.client = client or default_client()
+        self.model = model or os.getenv("OPENROUTER_MODEL", DEFAULT_MODEL)
+        self.pack = max(pack, 1)
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(rate_per_minute, burst)
+        self._slots = asyncio.Semaphore(max(concurrency, 1))
+        self.requests = 0
+        self.retries = 0
+        self.unpacked = 0
+        self.failed = 0
+
+    async def _complete(self, system_prompt, prompt, max_tokens):
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            try:
+                async with self._slots:
+                    self.requests += 1
+                    completion = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=[
+                            {"role": "system", "content": system_prompt},
+                            {"role": "user", "content": prompt},
+                        ],
+                        temperature=0.5,
+                        max_tokens=max_tokens,
+                        extra_headers=EXTRA_HEADERS,
+                    )
+                return completion.choices[0].message.content.strip()
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                backoff = random.uniform(0, min(RETRY_CAP_S, RETRY_BASE_S * 2 ** attempt))
+                await asyncio.sleep(max(backoff, _retry_after(e)))
+
+    async def _explain_one(self, patient):
+        band_text, pct, inputs, arabic = patient
+        try:
+            text = await self._complete(SYSTEM_PROMPT, user_prompt(band_text, pct, inputs, arabic),
+                                        MAX_TOKENS_PER_PATIENT)
+            return Explanation(parse_bullets(text), "llm", None)
+        except Exception as e:
+            self.failed += 1
+            return Explanation(explanation_for_band(inputs, band_text, inputs, arabic), "rules", str(e))
+
+    async def _explain_pack(self, patients):
+        if len(patients) == 1:
+            return [await self._explain_one(patients[0])]
+        arabic = patients[0][3]
+        try:
+            text = await self._complete(PACKED_SYSTEM_PROMPT, packed_prompt([p[:3] for p in patients], arabic),
+                                        MAX_TOKENS_PER_PATIENT * len(patients))
+            sections = split_patients(text, len(patients))
+        except Exception:
+            sections = [None] * len(patients)
+        results = [Explanation(parse_bullets(s), "llm", None) if s is not None else None for s in sections]
+        missing = [i for i, r in enumerate(results) if r is None]
+        self.unpacked += len(missing)
+        for i, result in zip(missing, await asyncio.gather(*(self._explain_one(patients[i]) for i in missing))):
+            results[i] = result
+        return results
+
+    async def explain(self, patients):
+        """
+        Explain patients concurrently
+
+        Args:
+            patients (list): (band_text, pct, inputs, arabic) per patient, as
+                openrouter_explain_risk takes them
+
+        Returns:
+            list: Explanation per patient, in order
+        """
+        packs = []
+        for arabic in (False, True):
+            indices = [i for i, p in enumerate(patients) if bool(p[3]) == arabic]
+            packs += [indices[i:i + self.pack] for i in range(0, len(indices), self.pack)]
+        answers = await asyncio.gather(*(self._explain_pack([patients[i] for i in pack]) for pack in packs))
+        results = [None] * len(patients)
+        for pack, answer in zip(packs, answers):
+            for i, explanation in zip(pack, answer):
+                results[i] = explanation
+        return results
+
+    def stats(self):
+        return {"requests": self.requests, "retries": self.retries, "unpacked": self.unpacked,
+                "rule_based": self.failed}
+
+
+def explain_batch(patients, **kwargs):
+    """
+    Blocking BatchExplainer.explain (kwargs as BatchExplainer takes them)
+
+    Returns:
+        (list, dict): Explanation per patient and BatchExplainer.stats()
+    """
+    async def run():
+        explainer = BatchExplainer(**kwargs)
+        try:
+            return await explainer.explain(patients), explainer.stats()
+        finally:
+            await explainer.client.close()
+    return asyncio.run(run())
+
+
+def scored_patients(user_inputs, arabic=False):
+    """(band_text, pct, inputs, arabic) per input, scored with the serving model"""
+    from preprocessing import get_model_artifacts, predict_risk_with_model
+
+    model, feature_names = get_model_artifacts()
+    results = predict_risk_with_model(model, feature_names, user_inputs)
+    return [(localized_band(r["risk_level"], arabic), r["risk_percentage"], u, arabic)
+            for r, u in zip(results, user_inputs)]
+
+
+def main():
+    from dotenv import load_dotenv
+
+    from form_schema import sample_inputs
+    from openrouter_standin import start_standin
+
+    parser = argparse.ArgumentParser(description="Explain a batch of patients with the LLM")
+    parser.add_argument("inputs", nargs="?", help="JSONL file of user_input dicts (default: --samples synthetic)")
+    parser.add_argument("--out", help="Write {'explanation': [...], 'source': ...} lines")
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--arabic", action="store_true")
+    parser.add_argument("--concurrency", type=int, default=LLM_CONCURRENCY)
+    parser.add_argument("--rate-per-minute", type=float, default=LLM_RATE_PER_MINUTE, help="0 disables the limit")
+    parser.add_argument("--burst", type=int, default=LLM_BURST)
+    parser.add_argument("--pack", type=int, default=LLM_PACK, help="Patients per prompt")
+    parser.add_argument("--max-retries", type=int, default=LLM_MAX_RETRIES)
+    parser.add_argument("--standin", action="store_true", help="Run against a local openrouter_standin.py")
+    parser.add_argument("--standin-latency-ms", type=float, default=800.0)
+    parser.add_argument("--standin-rate-limit", type=int, default=0, help="Stand-in's requests/minute before 429")
+    parser.add_argument("--standin-error-rate", type=float, default=0.0, help="Share of stand-in requests failing 503")
+    args = parser.parse_args()
+
+    load_dotenv()
+    standin = None
+    if args.standin:
+        standin, base_url = start_standin(latency_ms=args.standin_latency_ms, rate_limit_rpm=args.standin_rate_limit,
+                                          error_rate=args.standin_error_rate)
+        os.environ.update(OPENROUTER_BASE_URL=base_url, OPENROUTER_API_KEY="standin")
+
+    if args.inputs:
+        with open(args.inputs, encoding="utf-8") as f:
+            user_inputs = [json.loads(line) for line in f if line.strip()]
+    else:
+        user_inputs = sample_inputs(args.samples, seed=0)
+    patients = scored_patients(user_inputs, args.arabic)
+
+    start = time.perf_counter()
+    explanations, stats = explain_batch(
+        patients, concurrency=args.concurrency, rate_per_minute=args.rate_per_minute, burst=args.burst,
+        pack=args.pack, max_retries=args.max_retries
+    )
+    elapsed = time.perf_counter() - start
+    if standin:
+        standin.shutdown()
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            for explanation in explanations:
+                f.write(json.dumps({"explanation": explanation.bullets, "source": explanation.source,
+                                    "error": explanation.error}, ensure_ascii=False) + "\n")
+    print(json.dumps(dict(
+        patients=len(patients),
+        elapsed_s=round(elapsed, 2),
+        patients_per_minute=round(len(patients) / elapsed * 60, 1),
+        **stats,
+    ), indent=2))
+    return 0 if not stats["rule_based"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
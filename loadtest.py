@@ -0,0 +1,431 @@
+"""
+Load Test Harness for Stillbirth Risk Assessment
+Drives N concurrent virtual clinician sessions through the real app.py over
+Streamlit's websocket protocol, fully offline
+
+    python loadtest.py --sessions 20 --iterations 5 --llm-latency-ms 800
+    python loadtest.py --no-llm --interactions 20 --history-rows 200
+
+By default it starts the local OpenRouter stand-in (openrouter_standin.py)
+and a headless `streamlit run app.py` pointed at it. Each session loads the
+page, then per iteration fills and submits the patient form, prepares and
+downloads the PDF, searches the history and downloads the CSV. The report
+(JSON) has per-action latency percentiles plus the server's RSS growth and
+CPU use.
+
+--interactions times each kind of interaction in a single session instead
+(dashboard toggle, history search, language switch, evaluate, PDF report).
+
+Use --url to target an already running server instead (RSS/CPU are then
+only reported when --server-pid is given).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from tornado.httpclient import AsyncHTTPClient
+from tornado.websocket import websocket_connect
+
+from openrouter_standin import start_standin
+
+WIDGET_TYPES = ("text_input", "number_input", "selectbox", "radio", "button", "download_button")
+
+
+class VirtualSession:
+    """One browser tab: a websocket session plus the widget ids it has seen"""
+
+    def __init__(self, base_url, name):
+        self.base_url = base_url.rstrip("/")
+        self.name = name
+        self.conn = None
+        self.widgets = {}
+        self.downloads = {}
+        self.states = {}
+        self.fragments = {}
+
+    async def connect(self):
+        ws_url = self.base_url.replace("http", "ws", 1) + "/_stcore/stream"
+        self.conn = await websocket_connect(ws_url, max_message_size=256 * 1024 * 1024)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+    async def rerun(self, widget_values=(), triggers=()):
+        """
+        Send a rerun with the session's widget values and wait for it to finish
+
+        Like the browser, a change that only touches widgets of one
+        st.fragment reruns just that fragment.
+
+        Returns:
+            float: Seconds from sending the rerun to script_finished
+        """
+        for wid, kind, value in widget_values:
+            state = BackMsg().rerun_script.widget_states.widgets.add()
+            state.id = wid
+            setattr(state, kind, value)
+            self.states[wid] = state
+
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        msg.rerun_script.page_script_hash = ""
+        touched = {self.fragments.get(wid, "") for wid, _, _ in widget_values} | {
+            self.fragments.get(wid, "") for wid in triggers}
+        if len(touched) == 1 and "" not in touched:
+            msg.rerun_script.fragment_id = touched.pop()
+        for state in self.states.values():
+            msg.rerun_script.widget_states.widgets.add().CopyFrom(state)
+        for wid in triggers:
+            state = msg.rerun_script.widget_states.widgets.add()
+            state.id = wid
+            state.trigger_value = True
+
+        start = time.perf_counter()
+        await self.conn.write_message(msg.SerializeToString(), binary=True)
+        failed = False
+        while True:
+            raw = await self.conn.read_message()
+            if raw is None:
+                raise ConnectionError("websocket closed by server")
+            fwd = ForwardMsg()
+            fwd.ParseFromString(raw)
+            kind = fwd.WhichOneof("type")
+            if kind == "delta" and fwd.delta.WhichOneof("type") == "new_element":
+                element = fwd.delta.new_element
+                etype = element.WhichOneof("type")
+                if etype in WIDGET_TYPES:
+                    widget = getattr(element, etype)
+                    self.widgets[widget.label] = widget.id
+                    self.fragments[widget.id] = fwd.delta.fragment_id
+                    if etype == "download_button":
+                        self.downloads[widget.label] = widget.url
+                elif etype == "exception":
+                    failed = True
+            elif kind == "script_finished":
+                elapsed = time.perf_counter() - start
+                if failed:
+                    raise RuntimeError("script raised an exception")
+                return elapsed
+
+    def widget(self, prefix):
+        for label, wid in self.widgets.items():
+            if label.startswith(prefix):
+                return wid
+        raise KeyError(f"no widget labelled {prefix!r} in session {self.name}")
+
+    async def download(self, prefix):
+        url = next(u for label, u in self.downloads.items() if label.startswith(prefix))
+        start = time.perf_counter()
+        response = await AsyncHTTPClient().fetch(self.base_url + url)
+        if not response.body:
+            raise RuntimeError(f"empty download for {prefix!r}")
+        return time.perf_counter() - start
+
+
+async def run_session(base_url, index, iterations, think, latencies, errors, rng):
+    session = VirtualSession(base_url, f"s{index}")
+
+    async def timed(action, coro):
+        try:
+            latencies[action].append(await coro)
+        except Exception as e:
+            errors[action].append(f"{session.name}: {e}")
+
+    try:
+        await session.connect()
+        await timed("load", session.rerun())
+        for i in range(iterations):
+            patient_id = f"LT-{index:03d}-{i:03d}"
+            form = [
+                (session.widget("Patient ID"), "string_value", patient_id),
+                (session.widget("Patient Name"), "string_value", f"Load Test {index}"),
+                (session.widget("BMI"), "double_value", round(rng.uniform(16.0, 45.0), 1)),
+                (session.widget("Systolic BP"), "int_value", rng.randint(80, 220)),
+                (session.widget("Prenatal visits"), "int_value", rng.randint(0, 30)),
+            ]
+            await timed("evaluate", session.rerun(form, triggers=[session.widget("Evaluate")]))
+            await asyncio.sleep(think)
+            await timed("prepare_pdf", session.rerun(triggers=[session.widget("📄 Prepare PDF report")]))
+            await timed("download_pdf", session.download("⬇️ Download Result"))
+            await timed("search", session.rerun([(session.widget("Search"), "string_value", patient_id[:6])]))
+            await timed("prepare_csv", session.rerun(triggers=[session.widget("📄 Prepare history CSV")]))
+            await timed("download_csv", session.download("⬇️ Download history"))
+            await asyncio.sleep(think)
+    except Exception as e:
+        errors["session"].append(f"{session.name}: {e}")
+    finally:
+        session.close()
+
+
+async def time_interactions(base_url, history_rows, repeat, pause=0.5, server_pid=None):
+    """
+    Rerun latency per interaction type, in a single session
+
+    The session first evaluates history_rows patients, then repeats each
+    interaction: toggling a dashboard panel, typing a history search,
+    switching language (there and back), evaluating a patient and preparing
+    its PDF report. Each is
+    sent `pause` seconds after the last one finished, as a user would;
+    back to back, every rerun would also wait for the full gc.collect()
+    Streamlit runs after the previous one. With server_pid, the server CPU
+    time of each interaction (including that collection) is reported too.
+
+    Returns:
+        dict: Interaction -> latency percentiles (ms)
+    """
+    session = VirtualSession(base_url, "interactions")
+    rng = random.Random(0)
+    latencies = defaultdict(list)
+    cpu = defaultdict(list)
+
+    def form(i):
+        return [
+            (session.widget("Patient ID"), "string_value", f"IT-{i:04d}"),
+            (session.widget("Patient Name"), "string_value", f"Interaction {i}"),
+            (session.widget("Systolic BP"), "int_value", rng.randint(80, 220)),
+        ]
+
+    try:
+        await session.connect()
+        await session.rerun()
+        for i in range(history_rows):
+            await session.rerun(form(i), triggers=[session.widget("Evaluate")])
+        language = session.widget("Language")
+        for i in range(repeat):
+            steps = [
+                ("dashboard_toggle", lambda: session.rerun(triggers=[session.widget("🔬")])),
+                ("search", lambda: session.rerun([(session.widget("Search"), "string_value", f"IT-{i % 10}")])),
+                ("language", lambda: session.rerun([(language, "int_value", 1)])),
+                ("language", lambda: session.rerun([(language, "int_value", 0)])),
+                ("evaluate", lambda: session.rerun(form(history_rows + i), triggers=[session.widget("Evaluate")])),
+                ("prepare_pdf", lambda: session.rerun(triggers=[session.widget("📄 Prepare PDF report")])),
+            ]
+            for action, step in steps:
+                await asyncio.sleep(pause)
+                before = _proc_stats(server_pid) if server_pid else None
+                latencies[action].append(await step())
+                if before:
+                    await asyncio.sleep(pause)
+                    cpu[action].append(_proc_stats(server_pid)[1] - before[1])
+    finally:
+        session.close()
+
+    report = {}
+    for action, values in latencies.items():
+        values = np.array(values) * 1000.0
+        p50, p95 = np.percentile(values, [50, 95])
+        report[action] = {"count": len(values), "p50_ms": round(float(p50), 1),
+                          "p95_ms": round(float(p95), 1), "mean_ms": round(float(values.mean()), 1)}
+        if cpu[action]:
+            report[action]["server_cpu_ms"] = round(float(np.mean(cpu[action])) * 1000.0, 1)
+    return report
+
+
+def _proc_stats(pid):
+    """(rss_kb, cpu_seconds) of a process from /proc, or None"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            rss = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        ticks = os.sysconf("SC_CLK_TCK")
+        return rss, (int(fields[11]) + int(fields[12])) / ticks
+    except (OSError, StopIteration, ValueError):
+        return None
+
+
+class ResourceMonitor(threading.Thread):
+    """Samples the server process's RSS and CPU time while the test runs"""
+
+    def __init__(self, pid, interval=0.5):
+        super().__init__(name="resource-monitor", daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while True:
+            stats = _proc_stats(self.pid)
+            if stats:
+                self.samples.append((time.perf_counter(),) + stats)
+            if self._stop_event.wait(self.interval):
+                return
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def report(self):
+        if len(self.samples) < 2:
+            return None
+        (t0, rss0, cpu0), (t1, rss1, cpu1) = self.samples[0], self.samples[-1]
+        return {
+            "rss_start_mb": round(rss0 / 1024, 1),
+            "rss_end_mb": round(rss1 / 1024, 1),
+            "rss_peak_mb": round(max(s[1] for s in self.samples) / 1024, 1),
+            "rss_growth_mb": round((rss1 - rss0) / 1024, 1),
+            "cpu_seconds": round(cpu1 - cpu0, 2),
+            "cpu_utilization": round((cpu1 - cpu0) / (t1 - t0), 3),
+        }
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_app_server(port, llm_base_url):
+    """Launch a headless `streamlit run app.py` and wait until it is healthy"""
+    env = dict(os.environ)
+    if llm_base_url:
+        env.update(OPENROUTER_BASE_URL=llm_base_url, OPENROUTER_API_KEY="standin")
+    else:
+        env.update(OPENROUTER_API_KEY="sk-or-v1-your-key-here")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py"),
+         "--server.headless", "true", "--server.port", str(port), "--browser.gatherUsageStats", "false"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    health = f"http://127.0.0.1:{port}/_stcore/health"
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            import urllib.request
+            with urllib.request.urlopen(health, timeout=1) as r:
+                if r.status == 200:
+                    return proc
+        except OSError:
+            time.sleep(0.3)
+    proc.terminate()
+    raise RuntimeError("streamlit server did not become healthy within 60s")
+
+
+def summarize(latencies, errors, wall):
+    actions = {}
+    for action in ("load", "evaluate", "search", "prepare_pdf", "download_pdf", "prepare_csv", "download_csv"):
+        values = np.array(latencies.get(action, [])) * 1000.0
+        entry = {"count": len(values), "errors": len(errors.get(action, []))}
+        if len(values):
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            entry.update(p50_ms=round(float(p50), 1), p95_ms=round(float(p95), 1),
+                         p99_ms=round(float(p99), 1), max_ms=round(float(values.max()), 1),
+                         mean_ms=round(float(values.mean()), 1),
+                         per_second=round(len(values) / wall, 2))
+        actions[action] = entry
+    return actions
+
+
+async def run_load(base_url, sessions, iterations, think, ramp, seed):
+    latencies, errors = defaultdict(list), defaultdict(list)
+    rng = random.Random(seed)
+    tasks = []
+    for i in range(sessions):
+        tasks.append(asyncio.ensure_future(
+            run_session(base_url, i, iterations, think, latencies, errors, random.Random(rng.random()))))
+        await asyncio.sleep(ramp)
+    await asyncio.gather(*tasks)
+    return latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session load test for app.py")
+    parser.add_argument("--sessions", type=int, default=10, help="Concurrent virtual sessions")
+    parser.add_argument("--iterations", type=int, default=3, help="Evaluate/search/download rounds per session")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Pause between actions")
+    parser.add_argument("--ramp-ms", type=float, default=50.0, help="Delay between session starts")
+    parser.add_argument("--llm-latency-ms", type=float, default=500.0, help="Stand-in LLM latency")
+    parser.add_argument("--no-llm", action="store_true", help="Run with rule-based explanations only")
+    parser.add_argument("--url", help="Existing app server (default: start one)")
+    parser.add_argument("--server-pid", type=int, help="PID to monitor when using --url")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the JSON report here")
+    parser.add_argument("--interactions", type=int, metavar="REPEAT",
+                        help="Instead of the load test, time each interaction type REPEAT times in one session")
+    parser.add_argument("--history-rows", type=int, default=50,
+                        help="Patients evaluated before timing interactions")
+    args = parser.parse_args()
+
+    standin = None
+    llm_base_url = None
+    if not args.no_llm:
+        standin, llm_base_url = start_standin(latency_ms=args.llm_latency_ms)
+
+    proc = None
+    if args.url:
+        base_url, pid = args.url, args.server_pid
+    else:
+        port = _free_port()
+        proc = start_app_server(port, llm_base_url)
+        base_url, pid = f"http://127.0.0.1:{port}", proc.pid
+
+    if args.interactions:
+        try:
+            report = {
+                "history_rows": args.history_rows,
+                "interactions": asyncio.run(time_interactions(
+                    base_url, args.history_rows, args.interactions, args.think_ms / 1000.0 or 0.5, pid)),
+            }
+        finally:
+            if proc:
+                proc.terminate()
+                proc.wait()
+            if standin:
+                standin.shutdown()
+        text = json.dumps(report, indent=2)
+        print(text)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+        return 0
+
+    monitor = ResourceMonitor(pid) if pid else None
+    if monitor:
+        monitor.start()
+    try:
+        start = time.perf_counter()
+        latencies, errors = asyncio.run(run_load(
+            base_url, args.sessions, args.iterations, args.think_ms / 1000.0, args.ramp_ms / 1000.0, args.seed))
+        wall = time.perf_counter() - start
+    finally:
+        if monitor:
+            monitor.stop()
+        if proc:
+            proc.terminate()
+            proc.wait()
+        if standin:
+            standin.shutdown()
+
+    report = {
+        "sessions": args.sessions,
+        "iterations": args.iterations,
+        "llm_latency_ms": None if args.no_llm else args.llm_latency_ms,
+        "wall_seconds": round(wall, 2),
+        "actions": summarize(latencies, errors, wall),
+        "server": monitor.report() if monitor else None,
+        "errors": {k: v[:5] for k, v in errors.items() if v},
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
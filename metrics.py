@@ -0,0 +1,155 @@
+"""
+Metrics Module for Stillbirth Risk Assessment
+Low-overhead latency histograms for the Evaluate flow and the API, exposed
+in the Prometheus text format over HTTP or as a local metrics file
+
+Recording a span costs one lock and one bisect (about a microsecond), so
+instrumentation stays enabled in production.
+"""
+
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds in seconds, from sub-millisecond scoring to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram keyed by label values"""
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        """Record one value (seconds) for the given label values"""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        """{label values: (per-bucket counts, sum, count)}"""
+        with self._lock:
+            return {k: (list(v[0]), v[1], v[2]) for k, v in self._series.items()}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label_values, (counts, total, count) in sorted(self.snapshot().items()):
+            labels = ",".join(f'{n}="{v}"' for n, v in zip(self.label_names, label_values))
+            prefix = labels + "," if labels else ""
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+            suffix = "{" + labels + "}" if labels else ""
+            lines.append(f"{self.name}_sum{suffix} {total:.6f}")
+            lines.append(f"{self.name}_count{suffix} {count}")
+        return "\n".join(lines)
+
+
+REGISTRY = {}
+_registry_lock = threading.Lock()
+
+
+def histogram(name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+    """Get or create a registered histogram"""
+    with _registry_lock:
+        if name not in REGISTRY:
+            REGISTRY[name] = Histogram(name, help_text, label_names, buckets)
+        return REGISTRY[name]
+
+
+STAGE_SECONDS = histogram(
+    "evaluate_stage_seconds",
+    "Latency of each stage of the Evaluate flow",
+    ("stage",)
+)
+RERUN_SECONDS = histogram(
+    "app_rerun_seconds",
+    "Latency of a whole Streamlit script rerun",
+    ("submitted",)
+)
+API_REQUEST_SECONDS = histogram(
+    "api_request_seconds",
+    "Latency of scoring API requests",
+    ("path",)
+)
+
+
+@contextmanager
+def span(stage, hist=STAGE_SECONDS):
+    """Time the enclosed block into `hist` under the given label value"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        hist.observe(time.perf_counter() - start, stage)
+
+
+def render_prometheus():
+    """All registered histograms in the Prometheus text exposition format"""
+    with _registry_lock:
+        hists = list(REGISTRY.values())
+    return "\n".join(h.render() for h in hists) + "\n"
+
+
+_last_write = [0.0]
+
+
+def write_metrics_file(path, min_interval=5.0):
+    """
+    Atomically write the metrics text to `path`, at most every `min_interval` seconds
+
+    Returns:
+        bool: True if the file was written
+    """
+    now = time.monotonic()
+    if now - _last_write[0] < min_interval:
+        return False
+    _last_write[0] = now
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+    os.replace(tmp, path)
+    return True
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            body, status = b"not found\n", 404
+        else:
+            body, status = render_prometheus().encode("utf-8"), 200
+        self.send_response(status)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve_metrics(port, host="127.0.0.1"):
+    """Serve GET /metrics from a daemon thread; returns the server"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
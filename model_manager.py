@@ -0,0 +1,305 @@
+"""
+Model Manager for Stillbirth Risk Assessment
+Keeps the serving model current without restarts: watches the model
+artifact (or the joblib fallback), loads and validates a new version on a
+background thread, and swaps it in atomically
+
+Every scoring call takes one ModelVersion snapshot and uses it for the whole
+batch, so requests already in flight finish on the version they started on.
+Results are tagged with 'model_version'. With SHADOW_MODEL_PATH set, served
+requests are also handed to a ShadowScorer (shadow.py) for a candidate model.
+
+With FAST_MODEL_DIR set, the reduced model built by reduce_model.py is served
+instead of the full one, but only while its fidelity report passes the
+FAST_MODEL_* limits and it was reduced from the full artifact on disk.
+"""
+
+import hashlib
+import math
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+
+from model_artifact import MANIFEST_NAME, ArtifactError, has_manifest, load_artifact, read_manifest
+from preprocessing import (ARTIFACT_DIR, MODEL_PATH, input_to_features, load_joblib_artifacts,
+                           predict_risk_with_model)
+from shadow import ShadowScorer
+
+# Seconds between checks of the model files (0 disables watching)
+MODEL_POLL_SECONDS = float(os.getenv("MODEL_POLL_SECONDS", "5"))
+
+# Candidate model scored in the shadow of live traffic, and its disagreement log
+SHADOW_MODEL_PATH = os.getenv("SHADOW_MODEL_PATH")
+SHADOW_LOG = os.getenv("SHADOW_LOG")
+
+# Reduced model (reduce_model.py) and the fidelity it must have been measured at
+FAST_MODEL_DIR = os.getenv("FAST_MODEL_DIR")
+FAST_MODEL_MIN_BAND_AGREEMENT = float(os.getenv("FAST_MODEL_MIN_BAND_AGREEMENT", "0.999"))
+FAST_MODEL_MAX_SCORE_DELTA = float(os.getenv("FAST_MODEL_MAX_SCORE_DELTA", "2.0"))
+
+# Features the input mapping produces; a new model must use exactly these
+EXPECTED_FEATURES = sorted(input_to_features({}))
+
+# Smoke inputs scored before a new version is accepted
+SMOKE_INPUTS = [
+    {},
+    {"gestational_weeks": 36, "babyweight": 2.4, "prenatal_visits": 2, "bmi": 31.5,
+     "systolic_bp": 145, "diastolic_bp": 92, "diabetes": "yes", "hypertension": "yes"},
+]
+
+ModelVersion = namedtuple("ModelVersion", "model feature_names version source loaded_at")
+
+
+class ModelValidationError(Exception):
+    """New model failed the schema check or the smoke prediction"""
+
+
+def validate_model(model, feature_names):
+    """
+    Schema check plus a smoke prediction; raises ModelValidationError
+
+    The feature list must be exactly the features built by input_to_features
+    (in any order) and the smoke inputs must score to finite probabilities.
+    """
+    if len(set(feature_names)) != len(feature_names):
+        raise ModelValidationError("duplicate feature names")
+    if sorted(feature_names) != EXPECTED_FEATURES:
+        missing = sorted(set(EXPECTED_FEATURES) - set(feature_names))
+        extra = sorted(set(feature_names) - set(EXPECTED_FEATURES))
+        raise ModelValidationError(f"feature mismatch (missing {missing}, unexpected {extra})")
+    try:
+        results = predict_risk_with_model(model, feature_names, SMOKE_INPUTS)
+    except Exception as e:
+        raise ModelValidationError(f"smoke prediction failed: {e}") from e
+    for r in results:
+        if not (math.isfinite(r["risk_score"]) and 0.0 <= r["risk_score"] <= 1.0):
+            raise ModelValidationError(f"smoke prediction out of range: {r['risk_score']}")
+
+
+def check_fast_model(fast_dir, full_dir, min_band_agreement=FAST_MODEL_MIN_BAND_AGREEMENT,
+                     max_score_delta=FAST_MODEL_MAX_SCORE_DELTA):
+    """
+    Whether a reduced artifact may be served in place of the full one
+
+    Its manifest must carry a fidelity report within the limits (score delta
+    in risk percentage points), measured against the full artifact in
+    full_dir (same content hash).
+
+    Returns:
+        (bool, str): Decision and the reason for it
+    """
+    try:
+        has_manifest(fast_dir)  # (waits out a swap in progress)
+        manifest = read_manifest(fast_dir)
+    except ArtifactError as e:
+        return False, str(e)
+    report = manifest.get("fidelity")
+    if not report:
+        return False, "no fidelity report in the manifest"
+    if report["band_agreement"] < min_band_agreement:
+        return False, f"band agreement {report['band_agreement']} below {min_band_agreement}"
+    if report["max_score_delta"] > max_score_delta:
+        return False, f"max score delta {report['max_score_delta']} above {max_score_delta}"
+    try:
+        full_hash = read_manifest(full_dir)["content_hash"]
+    except ArtifactError as e:
+        return False, f"full model: {e}"
+    if manifest.get("reduced_from", {}).get("content_hash") != full_hash:
+        return False, "reduced from a different full model"
+    return True, (f"band agreement {report['band_agreement']}, max score delta {report['max_score_delta']}, "
+                  f"{report.get('single_row_speedup')}x single row")
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (path, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class ModelManager:
+    """
+    Serving model with background hot reload
+
+    Args:
+        artifact_dir (str): Model artifact directory (preferred source)
+        model_path (str): joblib fallback when the artifact has no manifest
+        poll_seconds (float): Interval between file checks; 0 disables watching
+        shadow_path (str): Candidate artifact directory or joblib file to shadow-score
+        shadow_log (str): JSONL file for shadow disagreement aggregates
+        fast_dir (str): Reduced artifact served instead when check_fast_model passes
+    """
+
+    def __init__(self, artifact_dir=ARTIFACT_DIR, model_path=MODEL_PATH, poll_seconds=MODEL_POLL_SECONDS,
+                 shadow_path=SHADOW_MODEL_PATH, shadow_log=SHADOW_LOG, fast_dir=FAST_MODEL_DIR):
+        self.artifact_dir = artifact_dir
+        self.model_path = model_path
+        self.fast_dir = fast_dir
+        self.fast_status = None
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.reloads = 0
+        self.failed_reloads = 0
+        self.last_error = None
+        self.last_checked = None
+
+        # The first load must succeed; later failures keep the serving version
+        self._fingerprint = self._source_fingerprint()
+        self._current = self._load()
+        self.shadow = ShadowScorer(shadow_path, shadow_log) if shadow_path else None
+
+        self._thread = None
+        if poll_seconds > 0:
+            self._thread = threading.Thread(target=self._watch, name="model-watcher", daemon=True)
+            self._thread.start()
+
+    def current(self):
+        """The serving ModelVersion (an immutable snapshot)"""
+        return self._current
+
+    def score_batch(self, user_inputs, score_fn=predict_risk_with_model):
+        """
+        Score inputs with one model version and tag each result with it
+
+        Args:
+            user_inputs (list): User input dicts
+            score_fn (callable): (model, feature_names, user_inputs) -> results
+        """
+        if not user_inputs:
+            return []
+        snapshot = self._current
+        results = score_fn(snapshot.model, snapshot.feature_names, user_inputs)
+        for r in results:
+            r["model_version"] = snapshot.version
+        if self.shadow is not None:
+            self.shadow.submit(user_inputs, results, snapshot.version, score_fn)
+        return results
+
+    def shadow_served(self, user_inputs, results):
+        """
+        Queue results served without scoring (result store hits) for the shadow model
+
+        Args:
+            user_inputs (list): User input dicts
+            results (list): Their served results, tagged with 'model_version'
+        """
+        if self.shadow is not None and user_inputs:
+            self.shadow.submit(user_inputs, results, results[0]["model_version"])
+
+    def check(self):
+        """
+        Reload if the model files changed since the last check
+
+        Returns:
+            bool: True if a new version was swapped in
+        """
+        self.last_checked = time.time()
+        fingerprint = self._source_fingerprint()
+        if fingerprint == self._fingerprint:
+            return False
+        # Remember the attempt either way so a broken file isn't retried
+        # until it changes again
+        self._fingerprint = fingerprint
+        return self.reload()
+
+    def reload(self):
+        """Load, validate and swap in the model on disk; False if rejected"""
+        try:
+            candidate = self._load()
+        except Exception as e:
+            self.failed_reloads += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            print(f"Model reload rejected, keeping {self._current.version}: {self.last_error}", file=sys.stderr)
+            return False
+        if candidate.version == self._current.version and candidate.source == self._current.source:
+            return False
+        with self._lock:
+            previous, self._current = self._current, candidate
+            self.reloads += 1
+            self.last_error = None
+        print(f"Model swapped: {previous.version} -> {candidate.version}", file=sys.stderr)
+        return True
+
+    def status(self):
+        snapshot = self._current
+        return {
+            "version": snapshot.version,
+            "source": snapshot.source,
+            "loaded_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(snapshot.loaded_at)),
+            "features": len(snapshot.feature_names),
+            "reloads": self.reloads,
+            "failed_reloads": self.failed_reloads,
+            "last_error": self.last_error,
+            "poll_seconds": self.poll_seconds,
+            "shadow_candidate": self.shadow.version if self.shadow is not None else None,
+            "fast_model": self.fast_status,
+        }
+
+    def close(self):
+        self._stop_event.set()
+        if self.shadow is not None:
+            self.shadow.close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _watch(self):
+        while not self._stop_event.wait(self.poll_seconds):
+            try:
+                self.check()
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+
+    def _manifest_path(self):
+        return os.path.join(self.artifact_dir, MANIFEST_NAME)
+
+    def _source_fingerprint(self):
+        """Cheap change detector: stat of the manifests, else of the joblib file"""
+        fingerprint = ()
+        if self.fast_dir:
+            fingerprint = _stat(os.path.join(self.fast_dir, MANIFEST_NAME)) or ()
+        for path in (self._manifest_path(), self.model_path):
+            st = _stat(path)
+            if st is not None:
+                return fingerprint + st
+        return fingerprint or None
+
+    def _serving_dir(self):
+        """The fast artifact when it qualifies, else the full one"""
+        if not self.fast_dir:
+            return self.artifact_dir
+        ok, reason = check_fast_model(self.fast_dir, self.artifact_dir)
+        self.fast_status = {"path": self.fast_dir, "serving": ok, "reason": reason}
+        if not ok:
+            print(f"Not serving the fast model {self.fast_dir}: {reason}", file=sys.stderr)
+        return self.fast_dir if ok else self.artifact_dir
+
+    def _load(self):
+        if has_manifest(self.artifact_dir):
+            serving_dir = self._serving_dir()
+            artifact = load_artifact(serving_dir)
+            model, feature_names = artifact, artifact.features
+            # Same version label with different content gets the hash appended
+            version = artifact.version
+            current = getattr(self, "_current", None)
+            if (current is not None and current.version == version
+                    and getattr(current.model, "content_hash", None) not in (None, artifact.content_hash)):
+                version = f"{version}+{artifact.content_hash[:8]}"
+            source = serving_dir
+        else:
+            model, feature_names = load_joblib_artifacts(self.model_path)
+            version = f"joblib-{_file_sha256(self.model_path)[:12]}"
+            source = self.model_path
+        validate_model(model, feature_names)
+        return ModelVersion(model, feature_names, version, source, time.time())
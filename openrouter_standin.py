@@ -0,0 +1,162 @@
+"""
+Local OpenRouter Stand-in for Stillbirth Risk Assessment
+Minimal OpenAI-compatible /chat/completions server for offline load tests
+and batch explanation runs; no network access or API key needed
+
+    python openrouter_standin.py --port 8900 --latency-ms 800
+    python openrouter_standin.py --rate-limit-rpm 20 --error-rate 0.05   # 429s and 503s like the real one
+
+Point the app at it with:
+
+    OPENROUTER_BASE_URL=http://127.0.0.1:8900/api/v1 OPENROUTER_API_KEY=test
+"""
+
+import argparse
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BULLETS_EN = [
+    "- Blood pressure readings should be reviewed at each visit",
+    "- Body mass index influences cardiovascular load in pregnancy",
+    "- Regular prenatal visits support early detection of complications",
+    "- Gestational age guides the intensity of fetal monitoring",
+]
+BULLETS_AR = [
+    "- يجب مراجعة قراءات ضغط الدم في كل زيارة",
+    "- يؤثر مؤشر كتلة الجسم على العبء القلبي أثناء الحمل",
+    "- تساعد الزيارات المنتظمة قبل الولادة على الاكتشاف المبكر للمضاعفات",
+    "- يحدد عمر الحمل مستوى مراقبة الجنين",
+]
+
+
+def completion_text(messages):
+    """Canned bullets in the requested language; one block per 'Patient N:' if several"""
+    prompt = "\n".join(str(m.get("content", "")) for m in messages if m.get("role") == "user")
+    bullets = BULLETS_AR if "Language: Arabic" in prompt else BULLETS_EN
+    patients = re.findall(r"^Patient (\d+):", prompt, flags=re.MULTILINE)
+    if not patients:
+        return "\n".join(bullets)
+    return "\n\n".join(f"Patient {p}:\n" + "\n".join(bullets) for p in patients)
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    latency = 0.0
+    rate_limit_rpm = 0
+    error_rate = 0.0
+    accepted = None  # arrival times within the last minute (when rate limited)
+    lock = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not self.path.endswith("/chat/completions"):
+            self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+        try:
+            body = json.loads(raw or b"{}")
+        except ValueError as e:
+            self._send(400, {"error": {"message": str(e)}})
+            return
+
+        retry_after = self._over_limit()
+        if retry_after:
+            self._send(429, {"error": {"message": "Rate limit exceeded", "code": 429}},
+                       {"Retry-After": str(retry_after)})
+            return
+        if self.error_rate and random.random() < self.error_rate:
+            self._send(503, {"error": {"message": "Provider unavailable", "code": 503}})
+            return
+
+        time.sleep(self.latency)
+        text = completion_text(body.get("messages", []))
+        self._send(200, {
+            "id": f"standin-{time.time_ns()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "standin"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+        })
+
+    def _over_limit(self):
+        """Seconds to wait if this request exceeds rate_limit_rpm over the last minute, else 0"""
+        if not self.rate_limit_rpm:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            while self.accepted and self.accepted[0] <= now - 60:
+                self.accepted.popleft()
+            if len(self.accepted) >= self.rate_limit_rpm:
+                return max(1, math.ceil(self.accepted[0] + 60 - now))
+            self.accepted.append(now)
+            return 0
+
+    def _send(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_standin(port=0, host="127.0.0.1", latency_ms=0.0, rate_limit_rpm=0, error_rate=0.0):
+    """
+    Start the stand-in on a daemon thread
+
+    Args:
+        latency_ms (float): Simulated model latency per request
+        rate_limit_rpm (int): Requests per rolling minute before answering 429 (0: no limit)
+        error_rate (float): Share of requests answered with 503
+
+    Returns:
+        (server, base_url): base_url is suitable for OPENROUTER_BASE_URL
+    """
+    handler = type("Handler", (StandinHandler,), {
+        "latency": latency_ms / 1000.0,
+        "rate_limit_rpm": rate_limit_rpm,
+        "error_rate": error_rate,
+        "accepted": deque(),
+        "lock": threading.Lock(),
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="openrouter-standin", daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/api/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenRouter stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Simulated model latency per request")
+    parser.add_argument("--rate-limit-rpm", type=int, default=0, help="Requests per minute before 429 (0: no limit)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    args = parser.parse_args()
+
+    server, base_url = start_standin(args.port, args.host, args.latency_ms, args.rate_limit_rpm, args.error_rate)
+    print(f"OpenRouter stand-in at {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,32 +3,84 @@ Preprocessing Module for Stillbirth Risk Assessment
 Handles feature engineering and prediction for Streamlit app with XGBoost model
 """
 
-import joblib
 import pandas as pd
 import numpy as np
 import os
 
-# Load trained model and feature names
+from form_schema import NUMBER_INPUTS
+from model_artifact import has_manifest, load_artifact
+
+# Model artifact directory (manifest + native model + flattened trees);
+# the joblib pickle is only used when no artifact has been exported
+ARTIFACT_DIR = os.getenv('MODEL_ARTIFACT_DIR', os.path.join(os.path.dirname(__file__), 'model'))
 MODEL_PATH = os.path.join(os.path.dirname(__file__), 'xgb_model.joblib')
-FEATURES_PATH = os.path.join(os.path.dirname(__file__), 'features_used.txt')
+
+
+# Model artifacts held in memory after the first load
+_ARTIFACTS = None
 
 
 def load_model_artifacts():
-    """Load trained XGBoost model and feature names"""
-    # Load the XGBoost model
-    model = joblib.load(MODEL_PATH)
+    """
+    Load the model and feature names
     
-    # Load feature names from features_used.txt
-    with open(FEATURES_PATH, 'r') as f:
-        feature_names = [line.strip() for line in f if line.strip() and line.strip() != 'feature']
+    Prefers the artifact directory, whose manifest carries the feature list
+    and whose file hashes are checked on load; falls back to the joblib pickle.
     
-    return model, feature_names
+    Returns:
+        tuple: (model, feature_names)
+    """
+    if has_manifest(ARTIFACT_DIR):
+        artifact = load_artifact(ARTIFACT_DIR)
+        return artifact, artifact.features
+    return load_joblib_artifacts()
+
+
+def load_joblib_artifacts(model_path=MODEL_PATH):
+    """Load the pickled XGBClassifier; feature names come from its booster"""
+    import joblib
+    model = joblib.load(model_path)
+    return model, list(model.get_booster().feature_names)
+
+
+def get_model_artifacts():
+    """Return the in-memory model and feature names, loading them on first use"""
+    global _ARTIFACTS
+    if _ARTIFACTS is None:
+        _ARTIFACTS = load_model_artifacts()
+    return _ARTIFACTS
 
 
 def preprocess_input(user_input):
     """
     Convert user input from Streamlit form to model features
     
+    Args:
+        user_input (dict): Dictionary with user inputs from Streamlit
+        
+    Returns:
+        pd.DataFrame: Single-row dataframe with all features
+    """
+    return pd.DataFrame([input_to_features(user_input)])
+
+
+def preprocess_batch(user_inputs):
+    """
+    Convert a list of user input dicts to a multi-row feature dataframe
+    
+    Args:
+        user_inputs (list): List of dictionaries in the Streamlit form shape
+        
+    Returns:
+        pd.DataFrame: One row per input, columns as in preprocess_input
+    """
+    return pd.DataFrame([input_to_features(u) for u in user_inputs])
+
+
+def input_to_features(user_input):
+    """
+    Map one user input dict to a dict of model features
+    
     Expected features (20 total):
     1. pregnancyduration
     2. babyweight
@@ -55,7 +107,7 @@ def preprocess_input(user_input):
         user_input (dict): Dictionary with user inputs from Streamlit
         
     Returns:
-        pd.DataFrame: Single-row dataframe with all features
+        dict: Feature name -> value for all features
     """
     # Initialize feature dictionary with exact feature names
     features = {}
@@ -121,11 +173,20 @@ def preprocess_input(user_input):
     # Feature 19: deliverytype (1=vaginal, 2=cesarean, etc.)
     features['deliverytype'] = user_input.get('deliverytype', 1)
     
-    # Feature 20: year
-    from datetime import datetime
-    features['year'] = user_input.get('year', datetime.now().year)
+    # Feature 20: year (mother's age, the form's default when absent)
+    features['year'] = user_input.get('year', NUMBER_INPUTS['year'][2])
     
-    return pd.DataFrame([features])
+    return features
+
+
+def preprocess_input_for_model(user_input):
+    """
+    Convert user input to model features (Streamlit app variant)
+    
+    Same mapping as preprocess_input; the 'year' feature carries the
+    mother's age and defaults to the form's 28.
+    """
+    return pd.DataFrame([input_to_features(user_input)])
 
 
 def align_features(df, required_features):
@@ -144,37 +205,84 @@ def align_features(df, required_features):
     return df
 
 
-def predict_risk(user_input):
+def features_matrix(user_inputs, feature_names):
     """
-    Make prediction using the trained XGBoost model
-    
-    Args:
-        user_input (dict): User inputs from Streamlit form
+    Build the aligned float32 model matrix directly from user input dicts
     
-    Returns:
-        dict: {
-            'risk_score': float (0-1, probability of stillbirth),
-            'risk_percentage': int (0-100),
-            'risk_level': str ('Low', 'Moderate', 'High'),
-            'risk_band': str ('low', 'mod', 'high')
-        }
+    Equivalent to align_features(preprocess_batch(user_inputs), feature_names)
+    but skips the intermediate dataframe, which dominates single-row latency.
+    Missing features are filled with 0 as in align_features.
     """
-    # Load model and features
-    model, feature_names = load_model_artifacts()
-    
-    # Preprocess input
-    features_df = preprocess_input(user_input)
+    rows = [input_to_features(u) for u in user_inputs]
+    return np.array(
+        [[row.get(name, 0) for name in feature_names] for row in rows],
+        dtype=np.float32
+    ).reshape(len(rows), len(feature_names))
+
+
+# Numeric user_input fields -> (model feature, default), as in input_to_features
+NUMERIC_FEATURES = {
+    'gestational_weeks': ('pregnancyduration', 39),
+    'babyweight': ('babyweight', 3.2),
+    'prenatal_visits': ('visit_pregnancy_clinic', 4),
+    'total_emergency_visits': ('total_emergency_visits', 0),
+    'height': ('height', 165),
+    'bmi': ('bmi', 27.0),
+    'systolic_bp': ('systolic', 120),
+    'diastolic_bp': ('diastolic', 75),
+    'creatinine_mean': ('Creatinine (Mass/volume) in Serum or Plasma_mean', 0.0),
+    'hba1c_mean': ('Hemoglobin A1c/Hemoglobin. Total in Blood_mean', 0.0),
+    'potassium_mean': ('Potassium (Moles/volume) in Serum or Plasma_mean', 0.0),
+    'ferric_carboxymaltose_times': ('ferric carboxymaltose_times', 0),
+    'metoprolol_times': ('metoprolol_times', 0),
+    'total_inpatient_visits': ('total_inpatient_visits', 0),
+    'twins': ('twins', 0),
+    'deliverytype': ('deliverytype', 1),
+    'year': ('year', NUMBER_INPUTS['year'][2]),  # mother's age
+}
+
+
+def features_matrix_from_columns(columns, feature_names):
+    """
+    Vectorized features_matrix over a dataframe of user_input columns
     
-    # Align with model features
-    features_df = align_features(features_df, feature_names)
+    Absent columns and null cells take the input_to_features defaults, so
+    for inputs without nulls the matrix equals features_matrix(...) exactly.
+    Expects clean values (see validation.validate_columns).
     
-    # Make prediction - predict probability of survival (isalive=1)
-    # The model predicts probability of being alive
-    alive_probability = model.predict_proba(features_df)[0, 1]
+    Args:
+        columns (pd.DataFrame): One row per input, user_input field names as columns
+        feature_names (list): Model feature order
+    """
+    n = len(columns)
+    features = {}
+    for field, (name, default) in NUMERIC_FEATURES.items():
+        if field in columns:
+            features[name] = pd.to_numeric(columns[field]).fillna(default).to_numpy(dtype=np.float64)
+        else:
+            features[name] = np.full(n, default, dtype=np.float64)
+    features['weight'] = features['bmi'] * (features['height'] / 100.0) ** 2
+    for field, name in (('diabetes', 'has_diabetes'), ('hypertension', 'has_hypertension')):
+        present = columns[field].isin(['yes', 'نعم']).to_numpy() if field in columns else np.zeros(n, dtype=bool)
+        features[name] = present.astype(np.float64)
+    
+    matrix = np.zeros((n, len(feature_names)), dtype=np.float32)
+    for j, name in enumerate(feature_names):
+        if name in features:
+            matrix[:, j] = features[name]
+    return matrix
+
+
+def classify_risk(death_probability):
+    """
+    Map a stillbirth probability to the percentage and 3-level band
     
-    # Stillbirth risk is the complement
-    death_probability = 1 - alive_probability
+    Args:
+        death_probability (float): Probability of stillbirth (0-1)
     
+    Returns:
+        dict: risk_score, risk_percentage, risk_level, risk_band
+    """
     # Convert to percentage (0-100)
     risk_percentage = int(round(death_probability * 100))
     
@@ -190,8 +298,95 @@ def predict_risk(user_input):
         risk_band = 'high'
     
     return {
-        'risk_score': death_probability,
+        'risk_score': float(death_probability),
         'risk_percentage': risk_percentage,
         'risk_level': risk_level,
         'risk_band': risk_band
     }
+
+
+def predict_alive_proba(model, features):
+    """
+    Probability of survival (isalive=1) for every row of aligned features
+    
+    Uses the booster's in-place prediction on a float32 matrix, which gives
+    the same values as model.predict_proba(features)[:, 1] without the
+    scikit-learn wrapper and DMatrix construction overhead. Model artifacts
+    pick between their flattened trees and the booster by batch size.
+    
+    Args:
+        model: Fitted XGBClassifier or ModelArtifact
+        features: Aligned pd.DataFrame or 2-D array in feature order
+    """
+    if isinstance(features, pd.DataFrame):
+        features = features.to_numpy(dtype=np.float32)
+    matrix = np.ascontiguousarray(features, dtype=np.float32)
+    if hasattr(model, 'predict_alive_proba'):
+        return model.predict_alive_proba(matrix)
+    return np.asarray(model.get_booster().inplace_predict(matrix)).reshape(-1)
+
+
+def predict_risk(user_input):
+    """
+    Make prediction using the trained XGBoost model
+    
+    Args:
+        user_input (dict): User inputs from Streamlit form
+    
+    Returns:
+        dict: {
+            'risk_score': float (0-1, probability of stillbirth),
+            'risk_percentage': int (0-100),
+            'risk_level': str ('Low', 'Moderate', 'High'),
+            'risk_band': str ('low', 'mod', 'high')
+        }
+    """
+    return predict_risk_batch([user_input])[0]
+
+
+def predict_risk_batch(user_inputs):
+    """
+    Score many inputs with a single model call
+    
+    Args:
+        user_inputs (list): User input dicts in the Streamlit form shape
+    
+    Returns:
+        list: One predict_risk result dict per input, in order
+    """
+    if not user_inputs:
+        return []
+    
+    # Model and features stay in memory between calls
+    model, feature_names = get_model_artifacts()
+    return predict_risk_with_model(model, feature_names, user_inputs)
+
+
+def predict_risk_with_model(model, feature_names, user_inputs):
+    """predict_risk_batch against an explicitly given model and feature order"""
+    # Preprocess and align all rows at once
+    features = features_matrix(user_inputs, feature_names)
+    
+    # The model predicts probability of being alive; stillbirth risk is the complement
+    alive_probability = predict_alive_proba(model, features)
+    
+    return [classify_risk(1 - p) for p in alive_probability]
+
+
+def predict_risk_columns(model, feature_names, columns):
+    """predict_risk_with_model for a dataframe of validated user_input columns"""
+    alive_probability = predict_alive_proba(model, features_matrix_from_columns(columns, feature_names))
+    return [classify_risk(1 - p) for p in alive_probability]
+
+
+def predict_stillbirth_risk_batch(model, feature_names, user_inputs):
+    """Score several inputs with one XGBoost call"""
+    # Preprocess input and ensure features are in correct order
+    features_df = pd.concat([preprocess_input_for_model(u) for u in user_inputs], ignore_index=True)
+    features_df = features_df[feature_names]
+    
+    # Make prediction (model predicts probability of being alive)
+    alive_probability = predict_alive_proba(model, features_df)
+    
+    # Convert to percentage and classify risk level
+    return [classify_risk(1 - p) for p in alive_probability]
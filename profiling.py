@@ -0,0 +1,242 @@
+"""
+Profiling Module for Stillbirth Risk Assessment
+On-demand per-rerun profiles of the Streamlit script, written to a rotating
+local directory
+
+Modes:
+    sample    a background thread samples the rerun's stack every few ms and
+              writes collapsed stacks (*.collapsed, one "a;b;c count" line per
+              stack) ready for flamegraph.pl / speedscope
+    cprofile  deterministic cProfile of the rerun, written as *.prof
+
+Summary of the top cumulative functions over the last N reruns:
+
+    python profiling.py --dir profiles --last 20 --top 15
+"""
+
+import argparse
+import cProfile
+import glob
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(__file__), "profiles"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+SAMPLE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000.0
+
+MODES = ("sample", "cprofile")
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+
+def _collapse(frame, root_file=None):
+    """
+    Root-first 'a;b;c' stack for one frame
+
+    With root_file, frames above the outermost frame from that file (the
+    Streamlit runner and threading machinery) are dropped.
+    """
+    codes = []
+    while frame is not None:
+        codes.append(frame.f_code)
+        frame = frame.f_back
+    codes.reverse()
+    if root_file is not None:
+        for i, code in enumerate(codes):
+            if code.co_filename == root_file:
+                codes = codes[i:]
+                break
+    return ";".join(_frame_label(code) for code in codes)
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, target, interval, root_file=None):
+        super().__init__(name="rerun-sampler", daemon=True)
+        self.target = target
+        self.interval = interval
+        self.root_file = root_file
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        # A finished thread's ident can be reused by another thread
+        while not self._stop_event.wait(self.interval) and self.target.is_alive():
+            frame = sys._current_frames().get(self.target.ident)
+            if frame is not None:
+                self.stacks[_collapse(frame, self.root_file)] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+class RerunProfiler:
+    """
+    Profile one rerun of the calling thread
+
+    stop() is meant to be called at the end of the script. A rerun cut short
+    (st.stop(), an exception) is stopped when its script thread ends, and
+    one interrupted by a rerun on the same thread (st.rerun()) when the next
+    profiler starts there; its profile is written either way.
+
+    Args:
+        mode (str): 'sample' or 'cprofile'
+        out_dir (str): Directory for profile files (created on demand)
+        keep (int): Newest files kept; older ones are deleted
+        interval (float): Sampling interval in seconds ('sample' mode)
+        root_file (str): Script path; sampled stacks start at its frames
+    """
+
+    _seq = 0
+    _seq_lock = threading.Lock()
+    # Running profiler per script thread
+    _active = {}
+
+    def __init__(self, mode="sample", out_dir=PROFILE_DIR, keep=PROFILE_KEEP, interval=SAMPLE_INTERVAL,
+                 root_file=None):
+        if mode not in MODES:
+            raise ValueError(f"unknown profiling mode {mode!r}; expected one of {MODES}")
+        self.mode = mode
+        self.out_dir = out_dir
+        self.keep = keep
+        self.interval = interval
+        self.root_file = root_file
+        self.path = None
+        self._thread = None
+        self._sampler = None
+        self._profile = None
+        self._stopped = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        thread = threading.current_thread()
+        with RerunProfiler._seq_lock:
+            previous = RerunProfiler._active.get(thread)
+            RerunProfiler._active[thread] = self
+        if previous is not None:
+            previous.stop()
+        self._thread = thread
+        if self.mode == "sample":
+            self._sampler = _Sampler(thread, self.interval, self.root_file)
+            self._sampler.start()
+        else:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        threading.Thread(target=self._stop_after, name="rerun-profiler", daemon=True).start()
+        return self
+
+    def _stop_after(self):
+        self._thread.join()
+        self.stop()
+
+    def stop(self):
+        """Stop profiling and write the profile file; returns its path (once stopped, the same path)"""
+        with self._lock:
+            if self._stopped:
+                return self.path
+            self._stopped = True
+            with RerunProfiler._seq_lock:
+                if RerunProfiler._active.get(self._thread) is self:
+                    del RerunProfiler._active[self._thread]
+                RerunProfiler._seq += 1
+                seq = RerunProfiler._seq
+            os.makedirs(self.out_dir, exist_ok=True)
+            stem = os.path.join(self.out_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{seq:06d}")
+
+            if self.mode == "sample":
+                self._sampler.stop()
+                path = stem + ".collapsed"
+                with open(path, "w", encoding="utf-8") as f:
+                    for stack, count in self._sampler.stacks.most_common():
+                        f.write(f"{stack} {count}\n")
+            else:
+                # (disabling from another thread after the script thread ended is harmless)
+                self._profile.disable()
+                path = stem + ".prof"
+                self._profile.dump_stats(path)
+
+            _rotate(self.out_dir, self.keep)
+            self.path = path
+            return path
+
+
+def _profile_files(out_dir):
+    files = glob.glob(os.path.join(out_dir, "*.collapsed")) + glob.glob(os.path.join(out_dir, "*.prof"))
+    return sorted(files, key=os.path.getmtime)
+
+
+def _rotate(out_dir, keep):
+    files = _profile_files(out_dir)
+    for path in files[:max(len(files) - keep, 0)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def summarize(out_dir=PROFILE_DIR, last=20, top=15):
+    """
+    Top functions by cumulative (inclusive) cost over the newest profiles
+
+    Sampled profiles count the samples in which a function is anywhere on
+    the stack; cProfile files contribute their cumulative seconds.
+
+    Returns:
+        dict: reruns, samples, and 'functions' as a list of
+              {function, samples | seconds, share} sorted by cost
+    """
+    files = _profile_files(out_dir)[-last:]
+    collapsed = [p for p in files if p.endswith(".collapsed")]
+    profs = [p for p in files if p.endswith(".prof")]
+
+    inclusive = Counter()
+    total_samples = 0
+    for path in collapsed:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                stack, _, count = line.rstrip("\n").rpartition(" ")
+                count = int(count)
+                total_samples += count
+                for label in set(stack.split(";")):
+                    inclusive[label] += count
+
+    functions = [
+        {"function": label, "samples": n, "share": round(n / total_samples, 4)}
+        for label, n in inclusive.most_common(top)
+    ] if total_samples else []
+
+    if profs:
+        stats = pstats.Stats(*profs)
+        total = stats.total_tt or 1.0
+        by_cum = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+        functions += [
+            {"function": f"{name} ({os.path.basename(filename)}:{line})",
+             "seconds": round(ct, 6), "share": round(ct / total, 4)}
+            for (filename, line, name), (_, _, _, ct, _) in by_cum
+        ]
+
+    return {"reruns": len(files), "samples": total_samples, "functions": functions}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize per-rerun profiles")
+    parser.add_argument("--dir", default=PROFILE_DIR)
+    parser.add_argument("--last", type=int, default=20, help="Number of newest reruns to include")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    summary = summarize(args.dir, args.last, args.top)
+    print(f"{summary['reruns']} reruns, {summary['samples']} samples")
+    for row in summary["functions"]:
+        cost = f"{row['samples']:8d} samples" if "samples" in row else f"{row['seconds']:10.4f} s"
+        print(f"{row['share'] * 100:6.1f}%  {cost}  {row['function']}")
+
+
+if __name__ == "__main__":
+    main()
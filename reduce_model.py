@@ -0,0 +1,333 @@
+"""
+Model Reduction Tool for Stillbirth Risk Assessment
+Builds a smaller, faster version of the ensemble and a fidelity report
+against the full model on synthetic inputs from the form's ranges
+
+Reductions are applied to the booster's JSON, so the result is a regular
+XGBoost model that exports like any other artifact:
+
+    trees K   keep the first K boosting rounds
+    depth D   cut every tree at depth D; each cut node becomes a leaf with
+              the sum_hessian-weighted mean of the leaf values below it
+
+The mean margin contribution of everything removed (measured on the sample)
+is folded into the base score, unless --no-bias-correction is given.
+
+    python reduce_model.py --trees 200 --depth 5 --out model_fast
+    python reduce_model.py --search --out model_fast --min-band-agreement 0.999 --max-score-delta 2
+    python reduce_model.py --check      # depth cuts stay close to the full model
+
+The fidelity report (band agreement, score deltas, speedup, pass/fail
+against the limits) is stored in the reduced artifact's manifest; the app
+serves the reduced model only when it passes (see FAST_MODEL_DIR).
+"""
+
+import argparse
+import copy
+import json
+import math
+import sys
+import time
+
+import numpy as np
+
+from form_schema import sample_inputs
+from model_artifact import export_artifact
+from preprocessing import ARTIFACT_DIR, features_matrix
+from shadow import load_candidate
+from trees import TreeEnsemble
+
+DEFAULT_SAMPLES = 100_000
+DEFAULT_MIN_BAND_AGREEMENT = 0.999
+DEFAULT_MAX_SCORE_DELTA = 2.0
+
+SEARCH_TREES = (50, 100, 150, 200, 300, 400, 500, 600)
+SEARCH_DEPTHS = (3, 4, 5, 6)
+
+# --check: all trees cut one level below full depth must stay this close
+CHECK_MIN_BAND_AGREEMENT = 0.99
+CHECK_MAX_MEAN_SCORE_DELTA = 1.0
+
+
+def _subtree_leaf_values(tree):
+    """
+    Per node, the sum_hessian-weighted mean of the leaf values below it
+
+    Leaf values are the leaves' split_conditions, which XGBoost stores with
+    the learning rate applied; base_weights of internal nodes are not.
+    """
+    left, right = tree["left_children"], tree["right_children"]
+    hessian, values = tree["sum_hessian"], tree["split_conditions"]
+    order = [0]
+    for node in order:
+        if left[node] != -1:
+            order.extend((left[node], right[node]))
+    weighted, weight = {}, {}
+    for node in reversed(order):
+        if left[node] == -1:
+            weight[node] = max(hessian[node], 1e-12)
+            weighted[node] = values[node] * weight[node]
+        else:
+            weight[node] = weight[left[node]] + weight[right[node]]
+            weighted[node] = weighted[left[node]] + weighted[right[node]]
+    return {node: weighted[node] / weight[node] for node in order}
+
+
+def _cut_tree(tree, depth):
+    """Copy of one tree (xgboost JSON) with nodes below `depth` removed"""
+    left, right = tree["left_children"], tree["right_children"]
+    order, level = [0], {0: 0}
+    for node in order:
+        if left[node] != -1 and level[node] < depth:
+            for child in (left[node], right[node]):
+                level[child] = level[node] + 1
+                order.append(child)
+    new_id = {old: new for new, old in enumerate(order)}
+    leaf_value = _subtree_leaf_values(tree)
+
+    out = {key: [] for key in ("left_children", "right_children", "parents", "split_indices",
+                               "split_conditions", "split_type", "default_left", "base_weights",
+                               "loss_changes", "sum_hessian")}
+    for old in order:
+        internal = left[old] != -1 and level[old] < depth
+        parent = tree["parents"][old]
+        out["left_children"].append(new_id[left[old]] if internal else -1)
+        out["right_children"].append(new_id[right[old]] if internal else -1)
+        out["parents"].append(new_id.get(parent, parent) if old != 0 else parent)
+        out["split_indices"].append(tree["split_indices"][old] if internal else 0)
+        out["split_conditions"].append(tree["split_conditions"][old] if internal else leaf_value[old])
+        out["split_type"].append(0)
+        out["default_left"].append(tree["default_left"][old] if internal else 0)
+        out["base_weights"].append(tree["base_weights"][old])
+        out["loss_changes"].append(tree["loss_changes"][old] if internal else 0.0)
+        out["sum_hessian"].append(tree["sum_hessian"][old])
+
+    cut = dict(tree, **out)
+    cut["tree_param"] = dict(tree["tree_param"], num_nodes=str(len(order)), num_deleted="0")
+    return cut
+
+
+def reduce_booster(booster, n_trees=None, depth=None, margin_shift=0.0):
+    """
+    New booster with the first n_trees rounds, cut at depth, base margin shifted
+
+    Args:
+        booster: Full binary:logistic xgboost.Booster
+        n_trees (int): Rounds to keep (None keeps all)
+        depth (int): Maximum tree depth (None keeps full depth)
+        margin_shift (float): Added to the base margin
+
+    Returns:
+        xgboost.Booster
+    """
+    import xgboost as xgb
+
+    model_json = json.loads(booster.save_raw("json"))
+    learner = model_json["learner"]
+    gbtree = learner["gradient_booster"]["model"]
+    if any(tree["split_type"] and any(tree["split_type"]) for tree in gbtree["trees"]):
+        raise ValueError("categorical splits are not supported")
+
+    n_trees = len(gbtree["trees"]) if n_trees is None else min(n_trees, len(gbtree["trees"]))
+    trees = [copy.deepcopy(t) for t in gbtree["trees"][:n_trees]]
+    if depth is not None:
+        trees = [_cut_tree(t, depth) for t in trees]
+    for i, tree in enumerate(trees):
+        tree["id"] = i
+    gbtree["trees"] = trees
+    gbtree["tree_info"] = gbtree["tree_info"][:n_trees]
+    gbtree["gbtree_model_param"]["num_trees"] = str(n_trees)
+    if "iteration_indptr" in gbtree:
+        gbtree["iteration_indptr"] = gbtree["iteration_indptr"][:n_trees + 1]
+
+    reduced = xgb.Booster()
+    reduced.load_model(bytearray(json.dumps(model_json).encode("utf-8")))
+    if margin_shift:
+        # Set as a parameter: a base_score edited in the JSON is not applied on load
+        base_score = float(learner["learner_model_param"]["base_score"])
+        margin = math.log(base_score / (1.0 - base_score)) + margin_shift
+        reduced.set_param({"base_score": 1.0 / (1.0 + math.exp(-margin))})
+    return reduced
+
+
+def _bands(risk_pct):
+    rounded = np.rint(risk_pct)
+    return np.where(rounded <= 33, 0, np.where(rounded <= 66, 1, 2))
+
+
+def _single_row_ms(booster, X, repeat=300):
+    """p50 latency of scoring one row with the flattened trees (the serving path)"""
+    trees = TreeEnsemble.from_booster(booster)
+    times = []
+    for i in range(repeat):
+        row = X[i % len(X)][None, :]
+        start = time.perf_counter()
+        trees.predict_alive_proba(row)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times) * 1000.0)
+
+
+def _batch_rows_per_s(booster, X, rows=10_000, repeat=3):
+    batch = X[:rows]
+    best = min(_timed(lambda: booster.inplace_predict(batch)) for _ in range(repeat))
+    return len(batch) / best
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def fidelity(full_risk, reduced_risk):
+    """Band agreement and score deltas (risk percentage points) of two predictions"""
+    full_bands, reduced_bands = _bands(full_risk), _bands(reduced_risk)
+    delta = np.abs(reduced_risk - full_risk)
+    names = ("Low", "Moderate", "High")
+    transitions = {}
+    for a in range(3):
+        for b in range(3):
+            count = int(((full_bands == a) & (reduced_bands == b)).sum())
+            if a != b and count:
+                transitions[f"{names[a]}>{names[b]}"] = count
+    return {
+        "samples": int(len(full_risk)),
+        "band_agreement": round(float((full_bands == reduced_bands).mean()), 6),
+        "band_transitions": transitions,
+        "percentage_agreement": round(float((np.rint(full_risk) == np.rint(reduced_risk)).mean()), 6),
+        "max_score_delta": round(float(delta.max()), 4),
+        "mean_score_delta": round(float(delta.mean()), 4),
+        "p99_score_delta": round(float(np.percentile(delta, 99)), 4),
+        "full_band_share": {names[i]: round(float((full_bands == i).mean()), 4) for i in range(3)},
+    }
+
+
+def _risk_pct(booster, X):
+    return (1.0 - booster.inplace_predict(X)) * 100.0
+
+
+def build_reduced(booster, X, n_trees, depth, bias_correction=True):
+    """Reduced booster, with its base margin corrected on the sample X"""
+    reduced = reduce_booster(booster, n_trees, depth)
+    if not bias_correction:
+        return reduced
+    shift = float(np.mean(booster.inplace_predict(X, predict_type="margin")
+                          - reduced.inplace_predict(X, predict_type="margin")))
+    return reduce_booster(booster, n_trees, depth, margin_shift=shift)
+
+
+def passes(report, min_band_agreement, max_score_delta):
+    return report["band_agreement"] >= min_band_agreement and report["max_score_delta"] <= max_score_delta
+
+
+def check_depth_cut(booster, X, full_risk):
+    """
+    Fidelity of every tree cut one level below full depth, without bias correction
+
+    Removing one level changes each tree's output only by the spread of its
+    deepest leaves, so a sound cut stays close to the full model.
+
+    Returns:
+        (passed, report)
+    """
+    depth = TreeEnsemble.from_booster(booster).max_depth - 1
+    report = fidelity(full_risk, _risk_pct(reduce_booster(booster, depth=depth), X))
+    report["depth"] = depth
+    passed = (report["band_agreement"] >= CHECK_MIN_BAND_AGREEMENT
+              and report["mean_score_delta"] <= CHECK_MAX_MEAN_SCORE_DELTA)
+    return passed, report
+
+
+def search(booster, X, full_risk, min_band_agreement, max_score_delta, bias_correction=True):
+    """
+    Cheapest (trees x depth) configuration that passes the limits
+
+    The full model itself is not a candidate.
+
+    Returns:
+        (n_trees, depth, report) or None, plus every configuration tried
+    """
+    full_trees = booster.num_boosted_rounds()
+    full_depth = TreeEnsemble.from_booster(booster).max_depth
+    configs = [(t, d) for t in SEARCH_TREES for d in SEARCH_DEPTHS if t < full_trees or d < full_depth]
+    tried = []
+    for n_trees, depth in sorted(configs, key=lambda c: c[0] * c[1]):
+        reduced = build_reduced(booster, X, n_trees, depth, bias_correction)
+        report = fidelity(full_risk, _risk_pct(reduced, X))
+        tried.append({"trees": n_trees, "depth": depth, "band_agreement": report["band_agreement"],
+                      "max_score_delta": report["max_score_delta"]})
+        print(f"trees {n_trees:4d} depth {depth}: band agreement {report['band_agreement']:.5f}, "
+              f"max delta {report['max_score_delta']:.3f}", file=sys.stderr)
+        if passes(report, min_band_agreement, max_score_delta):
+            return (n_trees, depth, report), tried
+    return None, tried
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a reduced model with a fidelity report")
+    parser.add_argument("--model", default=ARTIFACT_DIR, help="Full model: artifact directory or joblib file")
+    parser.add_argument("--out", default="model_fast", help="Reduced artifact directory")
+    parser.add_argument("--trees", type=int, help="Boosting rounds to keep")
+    parser.add_argument("--depth", type=int, help="Maximum tree depth")
+    parser.add_argument("--search", action="store_true", help="Pick the cheapest configuration that passes")
+    parser.add_argument("--check", action="store_true", help="Only check that a depth cut stays close to the full model")
+    parser.add_argument("--samples", type=int, default=DEFAULT_SAMPLES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-band-agreement", type=float, default=DEFAULT_MIN_BAND_AGREEMENT)
+    parser.add_argument("--max-score-delta", type=float, default=DEFAULT_MAX_SCORE_DELTA,
+                        help="Largest allowed risk difference in percentage points")
+    parser.add_argument("--no-bias-correction", action="store_true")
+    args = parser.parse_args()
+
+    model, feature_names, version = load_candidate(args.model)
+    booster = model.get_booster()
+    X = features_matrix(sample_inputs(args.samples, args.seed), feature_names)
+    full_risk = _risk_pct(booster, X)
+    bias_correction = not args.no_bias_correction
+
+    if args.check:
+        passed, report = check_depth_cut(booster, X, full_risk)
+        print(json.dumps(dict(report, passed=passed), indent=2))
+        return 0 if passed else 1
+
+    tried = None
+    if args.search:
+        found, tried = search(booster, X, full_risk, args.min_band_agreement, args.max_score_delta, bias_correction)
+        if found is None:
+            print("no configuration passes the limits", file=sys.stderr)
+            return 1
+        n_trees, depth, _ = found
+    else:
+        n_trees, depth = args.trees, args.depth
+
+    reduced = build_reduced(booster, X, n_trees, depth, bias_correction)
+    report = fidelity(full_risk, _risk_pct(reduced, X))
+    full_ms, reduced_ms = _single_row_ms(booster, X), _single_row_ms(reduced, X)
+    full_rps, reduced_rps = _batch_rows_per_s(booster, X), _batch_rows_per_s(reduced, X)
+    report.update({
+        "single_row_ms": {"full": round(full_ms, 4), "reduced": round(reduced_ms, 4)},
+        "single_row_speedup": round(full_ms / reduced_ms, 2),
+        "batch_rows_per_s": {"full": round(full_rps), "reduced": round(reduced_rps)},
+        "batch_speedup": round(reduced_rps / full_rps, 2),
+        "limits": {"min_band_agreement": args.min_band_agreement, "max_score_delta": args.max_score_delta},
+    })
+    report["passed"] = passes(report, args.min_band_agreement, args.max_score_delta)
+    if tried:
+        report["search"] = tried
+
+    reduced_from = {"path": args.model, "version": version,
+                    "content_hash": getattr(model, "content_hash", None)}
+    manifest = export_artifact(
+        reduced, feature_names, args.out,
+        version=f"{version}-t{reduced.num_boosted_rounds()}d{depth or 'full'}",
+        extra={"reduced_from": reduced_from,
+               "reduction": {"trees": reduced.num_boosted_rounds(), "depth": depth,
+                             "bias_correction": bias_correction, "samples": args.samples, "seed": args.seed},
+               "fidelity": report},
+    )
+    print(json.dumps({"version": manifest["version"], "fidelity": report}, indent=2))
+    return 0 if report["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
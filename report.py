@@ -0,0 +1,432 @@
+"""
+Report Module for Stillbirth Risk Assessment
+Rule-based explanations and PDF report rendering shared by the Streamlit app
+and the headless scoring service
+"""
+
+import io
+import operator
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+from reportlab.lib import colors
+from reportlab.lib.units import mm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+
+# ---- Arabic text support ----
+try:
+    from arabic_reshaper import reshape
+    from bidi.algorithm import get_display
+    ARABIC_SUPPORT = True
+except ImportError:
+    ARABIC_SUPPORT = False
+
+LOGO_PATH = os.path.join(os.path.dirname(__file__), 'AI4Life.png')
+
+BAND_TEXT_AR = {"Low": "منخفض", "Moderate": "متوسط", "High": "مرتفع"}
+
+
+def localized_band(risk_level, arabic=False):
+    """Display text for a 'Low' / 'Moderate' / 'High' risk level"""
+    return BAND_TEXT_AR[risk_level] if arabic else risk_level
+
+
+# =============================
+# Rule-based explanation
+# =============================
+# Line opening the explanation, per risk level (English, Arabic)
+BAND_NOTES = {
+    "High": ("High risk — increase monitoring.", "خطر مرتفع — عزّز المراقبة."),
+    "Moderate": ("Moderate risk — tighten follow-up.", "خطر متوسط — شدد المتابعة."),
+    "Low": ("Low risk — continue standard care.", "خطر منخفض — استمر بالرعاية المعتادة."),
+}
+
+# Notes after the band line, in this order; rules sharing a note key are
+# OR-ed. (feature, operator, threshold, default when absent, note key)
+EXPLANATION_RULES = (
+    ("gestational_weeks", "<", 34, 39, "preterm"),
+    ("babyweight", "<", 2.5, 3.2, "low_birth_weight"),
+    ("systolic_bp", ">=", 140, 120, "blood_pressure"),
+    ("diastolic_bp", ">=", 90, 75, "blood_pressure"),
+    ("diabetes", "in", ("yes", "نعم"), "no", "diabetes"),
+    ("hypertension", "in", ("yes", "نعم"), "no", "hypertension"),
+    ("prenatal_visits", "<", 3, 4, "prenatal_care"),
+    ("bmi", ">=", 30, 27.0, "bmi"),
+    ("total_emergency_visits", ">", 2, 0, "emergency_visits"),
+    ("hba1c_mean", ">", 6.5, 0, "hba1c"),
+)
+
+EXPLANATION_NOTES = {
+    "preterm": ("Preterm pregnancy detected.", "حمل مبكر."),
+    "low_birth_weight": ("Low birth weight detected.", "وزن منخفض عند الولادة."),
+    "blood_pressure": ("Elevated blood pressure.", "ضغط دم مرتفع."),
+    "diabetes": ("Diabetes present.", "وجود سكري."),
+    "hypertension": ("Hypertension present.", "ارتفاع ضغط الدم."),
+    "prenatal_care": ("Limited prenatal care.", "قلّة المتابعة قبل الولادة."),
+    "bmi": ("Elevated BMI.", "ارتفاع مؤشر كتلة الجسم."),
+    "emergency_visits": ("Multiple emergency visits.", "زيارات طوارئ متعددة."),
+    "hba1c": ("Elevated HbA1c levels.", "ارتفاع مستوى السكر التراكمي."),
+}
+
+MAX_EXPLANATION_NOTES = 4
+
+_COMPARE = {"<": operator.lt, ">=": operator.ge, ">": operator.gt}
+
+# Note keys in output order
+_NOTE_KEYS = tuple(dict.fromkeys(key for *_, key in EXPLANATION_RULES))
+
+# The band line for English or Arabic band text
+_BAND_NOTE_BY_TEXT = {
+    **{level: notes[0] for level, notes in BAND_NOTES.items()},
+    **{BAND_TEXT_AR[level]: notes[1] for level, notes in BAND_NOTES.items()},
+}
+
+
+def _rule_applies(op, value, threshold):
+    if op == "in":
+        return str(value).lower() in threshold
+    return _COMPARE[op](value, threshold)
+
+
+def explanation_for_band(d, band_text, user_input=None, arabic=False):
+    """Fallback explanation when LLM is unavailable"""
+    # Use user_input if available, otherwise use d
+    input_data = user_input if user_input else d
+
+    fired = {key for feature, op, threshold, default, key in EXPLANATION_RULES
+             if _rule_applies(op, input_data.get(feature, default), threshold)}
+    notes = [EXPLANATION_NOTES[key][arabic] for key in _NOTE_KEYS if key in fired]
+    return [_BAND_NOTE_BY_TEXT[band_text]] + notes[:MAX_EXPLANATION_NOTES]
+
+
+def explanation_masks(frame):
+    """
+    Which notes apply to each row, for a whole batch at once
+
+    Args:
+        frame (pd.DataFrame): User input columns, one row per input (absent
+            columns and null cells take the rule's default)
+
+    Returns:
+        np.ndarray: Bool (rows, notes) in _NOTE_KEYS order
+    """
+    masks = np.zeros((len(frame), len(_NOTE_KEYS)), dtype=bool)
+    for feature, op, threshold, default, key in EXPLANATION_RULES:
+        if feature not in frame:
+            if _rule_applies(op, default, threshold):
+                masks[:, _NOTE_KEYS.index(key)] = True
+            continue
+        column = frame[feature]
+        if op == "in":
+            # Choice columns hold a handful of distinct values: test each once
+            codes, uniques = pd.factorize(column)
+            outcomes = [_rule_applies(op, value, threshold) for value in uniques]
+            fired = np.array(outcomes + [_rule_applies(op, default, threshold)], dtype=bool)[codes]
+        else:
+            values = pd.to_numeric(column, errors="coerce").to_numpy(dtype=np.float64)
+            values = np.where(np.isnan(values), default, values)
+            fired = _COMPARE[op](values, threshold)
+        masks[:, _NOTE_KEYS.index(key)] |= fired
+    return masks
+
+
+def explanations_for_levels(frame, risk_levels, arabic=False):
+    """
+    explanation_for_band for every row of a batch
+
+    Rules are evaluated as column masks; rows with the same level and the
+    same notes share one assembled list, so the per-row cost is a copy.
+
+    Args:
+        frame (pd.DataFrame): User input columns, one row per input
+        risk_levels (list): 'Low' / 'Moderate' / 'High' per row
+        arabic (bool): Arabic text
+
+    Returns:
+        list: Bullet list per row
+    """
+    masks = explanation_masks(frame)
+    levels = list(BAND_NOTES)
+    level_codes = pd.Categorical(risk_levels, categories=levels).codes.astype(np.int64)
+    if (level_codes < 0).any():
+        raise ValueError(f"risk levels must be one of {levels}")
+    note_codes = masks.astype(np.int64) @ (1 << np.arange(len(_NOTE_KEYS), dtype=np.int64))
+    combos, inverse = np.unique(note_codes * len(levels) + level_codes, return_inverse=True)
+
+    templates = []
+    for combo in combos.tolist():
+        note_code, level = divmod(combo, len(levels))
+        notes = [EXPLANATION_NOTES[key][arabic] for k, key in enumerate(_NOTE_KEYS) if note_code >> k & 1]
+        templates.append([BAND_NOTES[levels[level]][arabic]] + notes[:MAX_EXPLANATION_NOTES])
+    return [templates[i].copy() for i in inverse.tolist()]
+
+# =============================
+# PDF helpers (nicer layout)
+# =============================
+BRAND_NAME_EN = "Stillbirth Risk Assessment"
+BRAND_NAME_AR = "تقييم خطر الجنين"
+
+def _arabic_text(text):
+    """Reshape Arabic text for proper display in PDF"""
+    if not text or not ARABIC_SUPPORT:
+        return text
+    try:
+        # Check if text contains Arabic characters
+        if any('\u0600' <= c <= '\u06FF' for c in str(text)):
+            reshaped = reshape(str(text))
+            bidi_text = get_display(reshaped)
+            return bidi_text
+    except:
+        pass
+    return text
+
+def _setup_pdf_font(use_arabic):
+    if use_arabic:
+        # Try multiple font paths for Arabic support
+        font_paths = [
+            "NotoNaskhArabic-Regular.ttf",
+            "C:/Windows/Fonts/arial.ttf",
+            "C:/Windows/Fonts/tahoma.ttf",
+            "C:/Windows/Fonts/simpo.ttf",
+            "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+            "arial.ttf"
+        ]
+        
+        for ttf in font_paths:
+            if os.path.exists(ttf):
+                try:
+                    pdfmetrics.registerFont(TTFont("ArabicFont", ttf))
+                    return "ArabicFont"
+                except:
+                    continue
+        
+        # Fallback: Try to use Helvetica but warn
+        if not ARABIC_SUPPORT:
+            warnings.warn("Arabic font not found. PDF may not display Arabic text correctly.")
+    
+    return "Helvetica"
+
+def _wrap_lines(c, text, max_width, font, size):
+    c.setFont(font, size)
+    words = str(text).split()
+    lines, cur = [], ""
+    for w in words:
+        probe = (cur + " " + w).strip()
+        if pdfmetrics.stringWidth(probe, font, size) <= max_width:
+            cur = probe
+        else:
+            if cur:
+                lines.append(cur)
+            cur = w
+    if cur:
+        lines.append(cur)
+    return lines or [""]
+
+def _draw_header(c, W, H, AR, font):
+    # Light green matching website background
+    c.setFillColor(colors.HexColor("#ecfdf5"))  # Soft green matching site background
+    c.rect(0, H - 40 * mm, W, 40 * mm, stroke=0, fill=1)
+    
+    # Try to add logo
+    try:
+        logo_paths = ["Streamlit/AI4Life.png", "AI4Life.png", LOGO_PATH]
+        for logo_path in logo_paths:
+            if os.path.exists(logo_path):
+                c.drawImage(logo_path, 20 * mm, H - 38 * mm, width=25 * mm, height=25 * mm, preserveAspectRatio=True, mask='auto')
+                break
+    except:
+        pass
+    
+    # Dark text for light background
+    c.setFillColor(colors.HexColor("#0f172a"))  # Dark slate for better contrast
+    c.setFont(font, 18)
+    title = _arabic_text(BRAND_NAME_AR) if AR else BRAND_NAME_EN
+    # For Arabic (RTL), draw from right side
+    if AR:
+        title_width = pdfmetrics.stringWidth(title, font, 18)
+        c.drawString(W - 20 * mm - title_width, H - 26 * mm, title)
+    else:
+        c.drawString(50 * mm, H - 26 * mm, title)
+    
+    c.setFont(font, 10)
+    c.setFillColor(colors.HexColor("#475569"))  # Muted gray for subtitle
+    subtitle = "Risk assessment report" if not AR else _arabic_text("تقرير تقييم الخطورة")
+    if AR:
+        subtitle_width = pdfmetrics.stringWidth(subtitle, font, 10)
+        c.drawString(W - 20 * mm - subtitle_width, H - 32 * mm, subtitle)
+    else:
+        c.drawString(50 * mm, H - 32 * mm, subtitle)
+
+def _draw_badge(c, x, y, band_code, band_text, font):
+    colors_map = {"low": "#16a34a", "mod": "#d97706", "high": "#dc2626"}
+    c.setFillColor(colors.HexColor(colors_map[band_code]))
+    c.roundRect(x, y, 42 * mm, 10 * mm, 5 * mm, stroke=0, fill=1)
+    # Add subtle border
+    c.setStrokeColor(colors.HexColor(colors_map[band_code]))
+    c.setLineWidth(0.5)
+    c.roundRect(x, y, 42 * mm, 10 * mm, 5 * mm, stroke=1, fill=0)
+    c.setFillColor(colors.white)
+    c.setFont(font, 11)
+    c.drawCentredString(x + 21 * mm, y + 3.2 * mm, _arabic_text(str(band_text)))
+
+def _draw_gauge(c, x, y, w, h, pct, font, AR):
+    if AR:
+        # Arabic (RTL): High (red) on left, Low (green) on right
+        c.setFillColor(colors.HexColor("#fecaca"))  # High/Red
+        c.rect(x, y, w * 0.33, h, stroke=0, fill=1)
+        c.setFillColor(colors.HexColor("#fde68a"))  # Moderate/Yellow
+        c.rect(x + w * 0.33, y, w * 0.34, h, stroke=0, fill=1)
+        c.setFillColor(colors.HexColor("#86efac"))  # Low/Green
+        c.rect(x + w * 0.67, y, w * 0.33, h, stroke=0, fill=1)
+    else:
+        # English (LTR): Low (green) on left, High (red) on right
+        c.setFillColor(colors.HexColor("#86efac"))  # Low/Green
+        c.rect(x, y, w * 0.33, h, stroke=0, fill=1)
+        c.setFillColor(colors.HexColor("#fde68a"))  # Moderate/Yellow
+        c.rect(x + w * 0.33, y, w * 0.34, h, stroke=0, fill=1)
+        c.setFillColor(colors.HexColor("#fecaca"))  # High/Red
+        c.rect(x + w * 0.67, y, w * 0.33, h, stroke=0, fill=1)
+    
+    # Green border matching website theme
+    c.setStrokeColor(colors.HexColor("#10b981"))
+    c.setLineWidth(1.5)
+    c.rect(x, y, w, h, stroke=1, fill=0)
+    c.setFont(font, 9)
+    c.setFillColor(colors.HexColor("#334155"))
+    
+    if AR:
+        # Arabic labels (RTL): High - Moderate - Low
+        labels = [_arabic_text("مرتفع"), _arabic_text("متوسط"), _arabic_text("منخفض")]
+        c.drawString(x, y - 5 * mm, labels[0])  # High on left
+        c.drawCentredString(x + w * 0.50, y - 5 * mm, labels[1])  # Moderate center
+        c.drawRightString(x + w, y - 5 * mm, labels[2])  # Low on right
+    else:
+        # English labels (LTR): Low - Moderate - High
+        c.drawString(x, y - 5 * mm, "Low")
+        c.drawCentredString(x + w * 0.50, y - 5 * mm, "Moderate")
+        c.drawRightString(x + w, y - 5 * mm, "High")
+    
+    # Draw marker - reverse position for Arabic
+    if AR:
+        marker_pos = x + ((100 - max(2, min(98, pct))) / 100.0) * w
+    else:
+        marker_pos = x + (max(2, min(98, pct)) / 100.0) * w
+    
+    # Green marker line matching website theme
+    c.setStrokeColor(colors.HexColor("#10b981"))
+    c.setLineWidth(3)
+    c.line(marker_pos, y - 2 * mm, marker_pos, y + h + 2 * mm)
+    c.setFont(font, 9)
+    c.setFillColor(colors.HexColor("#10b981"))
+    c.drawCentredString(marker_pos, y + h + 3.5 * mm, str(pct))
+
+def _draw_kv(c, x, y, font, label, value, AR=False):
+    c.setFont(font, 10)
+    c.setFillColor(colors.HexColor("#334155"))
+    
+    if AR:
+        # Right-to-left layout
+        label_ar = _arabic_text(label)
+        value_ar = _arabic_text(str(value))
+        text = f"{label_ar}: {value_ar}"
+        c.drawRightString(x + 170 * mm, y, text)
+    else:
+        c.drawString(x, y, f"{label}: ")
+        c.setFont(font, 10)
+        c.setFillColor(colors.black)
+        c.drawString(x + 42 * mm, y, str(value))
+
+def _draw_inputs_table(c, x, y, font, rows, AR):
+    col_w = [60 * mm, 50 * mm]
+    row_h = 7 * mm
+    c.setFont(font, 10)
+    for i, (k, v) in enumerate(rows):
+        yy = y - i * row_h
+        if i % 2 == 0:
+            # Light green tint for alternating rows
+            c.setFillColor(colors.HexColor("#f0fdf4"))
+            c.rect(x, yy - row_h + 1.5 * mm, sum(col_w), row_h, stroke=0, fill=1)
+        c.setFillColor(colors.black)
+        
+        key_text = _arabic_text(str(k)) if AR else str(k)
+        val_text = _arabic_text(str(v)) if AR else str(v)
+        
+        if AR:
+            # Right-to-left: draw key from right, value from left
+            c.drawRightString(x + col_w[0] + col_w[1] - 3 * mm, yy - 4.7 * mm, key_text)
+            c.drawString(x + 3 * mm, yy - 4.7 * mm, val_text)
+        else:
+            c.drawString(x + 3 * mm, yy - 4.7 * mm, key_text)
+            c.drawRightString(x + col_w[0] + col_w[1] - 3 * mm, yy - 4.7 * mm, val_text)
+
+def build_pdf(patient_id, patient_name, timestamp, pct, band_text, band_code, bullets, d, AR=False):
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=A4)
+    W, H = A4
+    font_main = _setup_pdf_font(AR)
+    c.setTitle("Stillbirth Risk Assessment Report")
+    _draw_header(c, W, H, AR, font_main)
+    y = H - 48 * mm
+    c.setFont(font_main, 11)
+    _draw_kv(c, 20 * mm, y, font_main, ("Timestamp" if not AR else "التاريخ"), timestamp, AR)
+    y -= 7 * mm
+    _draw_kv(c, 20 * mm, y, font_main, ("Patient ID" if not AR else "رقم المريضة"), patient_id, AR)
+    y -= 7 * mm
+    _draw_kv(c, 20 * mm, y, font_main, ("Patient Name" if not AR else "اسم المريضة"), patient_name, AR)
+    y -= 12 * mm
+    _draw_badge(c, 20 * mm, y, band_code, band_text, font_main)
+    c.setFont(font_main, 11)
+    risk_text = f"Risk Index (0–100): {pct}" if not AR else _arabic_text(f"مؤشر الخطورة (٠–١٠٠): {pct}")
+    if AR:
+        c.drawRightString(W - 20 * mm, y - 8 * mm, risk_text)
+    else:
+        c.drawString(20 * mm, y - 8 * mm, risk_text)
+    _draw_gauge(c, 20 * mm, y - 22 * mm, 170 * mm, 8 * mm, pct, font_main, AR)
+    y = y - 40 * mm
+    c.setFont(font_main, 12)
+    if AR:
+        c.drawRightString(W - 20 * mm, y, _arabic_text("ملاحظات"))
+    else:
+        c.drawString(20 * mm, y, "Notes")
+    y -= 7 * mm
+    c.setFont(font_main, 10)
+    max_w = W - 40 * mm
+    for b in bullets:
+        if AR:
+            line = _arabic_text(f"{b} •")
+        else:
+            line = f"• {b}"
+        for ln in _wrap_lines(c, line, max_w, font_main, 10):
+            if AR:
+                c.drawRightString(W - 20 * mm, y, ln)
+            else:
+                c.drawString(20 * mm, y, ln)
+            y -= 6 * mm
+    y -= 6 * mm
+    c.setFont(font_main, 12)
+    if AR:
+        c.drawRightString(W - 20 * mm, y, _arabic_text("المدخلات"))
+    else:
+        c.drawString(20 * mm, y, "Inputs")
+    y -= 4 * mm
+    rows = [
+        ("Gestational age (weeks)" if not AR else "عمر الحمل (أسابيع)", d["gestational_weeks"]),
+        ("BMI", d["bmi"]),
+        ("Systolic BP" if not AR else "الضغط الانقباضي", d["systolic_bp"]),
+        ("Diastolic BP" if not AR else "الضغط الانبساطي", d["diastolic_bp"]),
+        ("Prenatal visits" if not AR else "زيارات ما قبل الولادة", d["prenatal_visits"]),
+        ("Diabetes" if not AR else "سكري", "yes" if d["diabetes"] == "yes" else "no"),
+        ("Hypertension" if not AR else "ارتفاع ضغط", "yes" if d["hypertension"] == "yes" else "no"),
+    ]
+    if AR:
+        rows = [(k, ("نعم" if v == "yes" else "لا") if isinstance(v, str) else v) for k, v in rows]
+    _draw_inputs_table(c, 20 * mm, y, font_main, rows, AR)
+    c.showPage()
+    c.save()
+    return buf.getvalue()
@@ -0,0 +1,320 @@
+"""
+Result Store Module for Stillbirth Risk Assessment
+Persistent, content-addressed store of assessment results, so repeated
+inputs (double submits, language toggles, reruns of the same batch file)
+return the stored result instead of being scored, explained or rendered
+again
+
+Keys are SHA-256 digests of what determines the result:
+
+    score        model content hash (the version label for joblib models),
+                 scoring variant, feature names and the canonical float32
+                 feature row. Inputs that map to the same features share a
+                 key (e.g. "نعم" and "yes", or fields the model ignores).
+    explanation  the score key plus language (LLM explanations; the
+                 rule-based ones take microseconds and aren't stored)
+    pdf          every build_pdf argument (patient, timestamp, bullets, ...)
+
+Entries live in one SQLite file (WAL mode, so the app, the API and batch
+jobs can share it). Retention: entries not used for RESULT_STORE_MAX_AGE_DAYS
+are dropped, and once the values exceed RESULT_STORE_MAX_MB the least
+recently used are dropped down to 90% of it.
+
+    RESULT_STORE_PATH=results.db python api.py
+    python result_store.py results.db            # entries, bytes and hit rates
+    python result_store.py results.db --prune
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+import numpy as np
+
+# SQLite file shared by the app, the API and batch jobs (unset: no store)
+RESULT_STORE_PATH = os.getenv("RESULT_STORE_PATH")
+RESULT_STORE_MAX_MB = float(os.getenv("RESULT_STORE_MAX_MB", "256"))
+RESULT_STORE_MAX_AGE_DAYS = float(os.getenv("RESULT_STORE_MAX_AGE_DAYS", "30"))
+
+# Retention is checked after this many new entries
+PRUNE_EVERY = 256
+
+# Last-access times closer together than this aren't rewritten on a hit
+TOUCH_SECONDS = 60.0
+
+# Keys looked up per SQL statement
+LOOKUP_CHUNK = 500
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key BLOB PRIMARY KEY,
+    kind TEXT NOT NULL,
+    is_json INTEGER NOT NULL,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed);
+"""
+
+
+def model_identity(model, version=None):
+    """What identifies a model's predictions: its artifact content hash, else its version label"""
+    return getattr(model, "content_hash", None) or version
+
+
+def score_keys(identity, feature_names, features, variant="full"):
+    """
+    Score key per row of a feature matrix
+
+    Args:
+        identity (str): model_identity() of the scoring model
+        feature_names (list): Model feature order
+        features (np.ndarray): features_matrix(...) rows
+        variant (str): Scoring path, for paths whose results differ from full scoring
+
+    Returns:
+        list: 32-byte digests
+    """
+    rows = np.ascontiguousarray(features, dtype=np.float32) + np.float32(0)  # -0.0 -> 0.0
+    rows[np.isnan(rows)] = np.nan  # one NaN bit pattern
+    prefix = hashlib.sha256("\0".join(["score", identity, variant, *feature_names]).encode("utf-8") + b"\0")
+    keys = []
+    for row in rows:
+        h = prefix.copy()
+        h.update(row.tobytes())
+        keys.append(h.digest())
+    return keys
+
+
+def content_key(kind, *parts):
+    """Key of a derived result (explanation, pdf) from JSON-serialisable parts"""
+    payload = json.dumps([kind, *[p.hex() if isinstance(p, bytes) else p for p in parts]],
+                         ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).digest()
+
+
+class ResultStore:
+    """
+    SQLite-backed key/value store with age and size retention
+
+    Values are dicts/lists (stored as JSON) or bytes. Safe to share
+    between threads; several processes may open the same file.
+
+    Args:
+        path (str): SQLite file
+        max_mb (float): Size of stored values before LRU eviction
+        max_age_days (float): Entries unused for this long are dropped (0 keeps them)
+    """
+
+    def __init__(self, path, max_mb=RESULT_STORE_MAX_MB, max_age_days=RESULT_STORE_MAX_AGE_DAYS):
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.max_age = max_age_days * 86400.0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=10.0, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        # Keys are random, so lookups and inserts touch pages all over the file
+        self._db.execute("PRAGMA cache_size=-65536")
+        self._db.executescript(_SCHEMA)
+        self._since_prune = 0
+        self.hits = {}
+        self.misses = {}
+        self.evicted = 0
+
+    def get_many(self, keys, kind):
+        """
+        Stored values for the keys that have one
+
+        Returns:
+            dict: key -> value
+        """
+        now = time.time()
+        found, stale = {}, []
+        with self._lock:
+            for start in range(0, len(keys), LOOKUP_CHUNK):
+                chunk = keys[start:start + LOOKUP_CHUNK]
+                rows = self._db.execute(
+                    f"SELECT key, is_json, value, accessed FROM results WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                for key, is_json, value, accessed in rows:
+                    found[key] = json.loads(value) if is_json else value
+                    if now - accessed > TOUCH_SECONDS:
+                        stale.append(key)
+            if stale:
+                self._db.executemany("UPDATE results SET accessed = ? WHERE key = ?", [(now, k) for k in stale])
+            self.hits[kind] = self.hits.get(kind, 0) + len(found)
+            self.misses[kind] = self.misses.get(kind, 0) + len(keys) - len(found)
+        return found
+
+    def get(self, key, kind):
+        """Stored value, or None"""
+        return self.get_many([key], kind).get(key)
+
+    def put_many(self, items, kind):
+        """Store (key, value) pairs in one transaction"""
+        if not items:
+            return
+        now = time.time()
+        rows = []
+        for key, value in items:
+            is_json = not isinstance(value, (bytes, bytearray))
+            data = json.dumps(value, ensure_ascii=False).encode("utf-8") if is_json else bytes(value)
+            rows.append((key, kind, int(is_json), data, len(data), now, now))
+        rows.sort()  # inserted in key order, each B-tree page is visited once
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self._db.execute("COMMIT")
+            self._since_prune += len(rows)
+            due = self._since_prune >= PRUNE_EVERY
+        if due:
+            self.prune()
+
+    def put(self, key, value, kind):
+        self.put_many([(key, value)], kind)
+
+    def prune(self):
+        """
+        Apply the retention policy
+
+        Returns:
+            int: Entries removed
+        """
+        with self._lock:
+            self._since_prune = 0
+            self._db.execute("BEGIN IMMEDIATE")
+            removed = 0
+            if self.max_age > 0:
+                removed += self._db.execute("DELETE FROM results WHERE accessed < ?",
+                                            (time.time() - self.max_age,)).rowcount
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+            if total > self.max_bytes:
+                excess = total - int(self.max_bytes * 0.9)
+                victims, freed = [], 0
+                oldest = self._db.execute("SELECT key, size FROM results ORDER BY accessed")
+                for key, size in oldest:
+                    victims.append((key,))
+                    freed += size
+                    if freed >= excess:
+                        break
+                oldest.close()
+                self._db.executemany("DELETE FROM results WHERE key = ?", victims)
+                removed += len(victims)
+            self._db.execute("COMMIT")
+            self.evicted += removed
+        return removed
+
+    def stats(self):
+        with self._lock:
+            by_kind = self._db.execute(
+                "SELECT kind, COUNT(*), COALESCE(SUM(size), 0) FROM results GROUP BY kind"
+            ).fetchall()
+        kinds = sorted({k for k, _, _ in by_kind} | set(self.hits) | set(self.misses))
+        counts = {k: (n, size) for k, n, size in by_kind}
+        return {
+            "path": self.path,
+            "max_mb": round(self.max_bytes / 1024 / 1024, 1),
+            "evicted": self.evicted,
+            "kinds": {
+                k: {
+                    "entries": counts.get(k, (0, 0))[0],
+                    "mb": round(counts.get(k, (0, 0))[1] / 1024 / 1024, 2),
+                    "hits": self.hits.get(k, 0),
+                    "misses": self.misses.get(k, 0),
+                } for k in kinds
+            },
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def open_store(path=RESULT_STORE_PATH):
+    """ResultStore at path, or None when no path is configured"""
+    return ResultStore(path) if path else None
+
+
+def snapshot_keys(snapshot, user_inputs, variant="full"):
+    """score_keys for user input dicts scored with a ModelVersion"""
+    from preprocessing import features_matrix
+    features = features_matrix(user_inputs, snapshot.feature_names)
+    return score_keys(model_identity(snapshot.model, snapshot.version), snapshot.feature_names, features, variant)
+
+
+def score_with_store(store, snapshot, user_inputs, score, variant="full", on_reused=None):
+    """
+    Results for user inputs, scoring only those not already stored
+
+    Args:
+        store (ResultStore): Store, or None to always score
+        snapshot (ModelVersion): Serving model, for the keys
+        user_inputs (list): User input dicts
+        score (callable): user_inputs -> results tagged with 'model_version'
+        variant (str): Scoring path (see score_keys)
+        on_reused (callable): (user_inputs, results) for the rows answered without
+            scoring them (stored, or repeated in the batch), e.g. for shadow scoring
+
+    Returns:
+        list: Results in input order; stored ones carry the serving version label
+    """
+    if store is None or not user_inputs:
+        return score(user_inputs)
+    keys = snapshot_keys(snapshot, user_inputs, variant)
+    stored = store.get_many(list(dict.fromkeys(keys)), "score")
+
+    # Repeated inputs within the batch are scored once
+    pending = {}
+    for i, key in enumerate(keys):
+        if key not in stored:
+            pending.setdefault(key, i)
+    fresh = {}
+    if pending:
+        fresh = dict(zip(pending, score([user_inputs[i] for i in pending.values()])))
+        # A result from a model swapped in meanwhile isn't filed under this key
+        store.put_many([(k, r) for k, r in fresh.items() if r.get("model_version") == snapshot.version], "score")
+    results = [dict(fresh[key]) if key in fresh else dict(stored[key], model_version=snapshot.version) for key in keys]
+    if on_reused is not None:
+        reused = [i for i, key in enumerate(keys) if pending.get(key) != i]
+        if reused:
+            on_reused([user_inputs[i] for i in reused], [dict(results[i]) for i in reused])
+    return results
+
+
+def stored(store, kind, key, compute):
+    """The value stored under key, else compute() (then stored)"""
+    if store is None:
+        return compute()
+    value = store.get(key, kind)
+    if value is None:
+        value = compute()
+        store.put(key, value, kind)
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or prune a result store")
+    parser.add_argument("path", nargs="?", default=RESULT_STORE_PATH)
+    parser.add_argument("--prune", action="store_true", help="Apply the retention policy now")
+    args = parser.parse_args()
+    if not args.path:
+        parser.error("no store path (argument or RESULT_STORE_PATH)")
+    store = ResultStore(args.path)
+    if args.prune:
+        print(f"Removed {store.prune()} entries")
+    print(json.dumps(store.stats(), indent=2, ensure_ascii=False))
+    store.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,236 @@
+"""
+Shadow Scoring Module for Stillbirth Risk Assessment
+Scores live traffic with a candidate model off the critical path and keeps
+disagreement statistics against the serving model
+
+Serving code only enqueues (inputs, served results), result store hits
+included; a background thread scores queued requests in batches with the
+candidate and aggregates band transitions and score deltas. Batches are
+deferred until submissions pause for idle_ms (or max_delay_ms passes, or
+batch_size is reached), so shadow work runs in the gaps between requests
+instead of competing with them for the GIL. When the queue is full,
+requests are dropped from the shadow rather than slowing anyone down.
+Identical requests that joined one already in flight (single flight) are
+counted once. Each scored batch appends one compact JSON line to the log:
+
+    {"ts": ..., "primary": "1.0.0", "candidate": "1.1.0", "n": 40, "agree": 38,
+     "transitions": {"Low>Moderate": 2}, "sum_abs_delta": 31.0, "max_abs_delta": 7.0,
+     "delta_hist": [...]}
+
+Deltas are in risk percentage points. Summarize a log with:
+
+    python shadow.py shadow.jsonl
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+
+from model_artifact import has_manifest, load_artifact
+from preprocessing import load_joblib_artifacts, predict_risk_with_model
+
+# Upper bounds (percentage points) of the absolute score delta histogram
+DELTA_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def load_candidate(path):
+    """(model, feature_names, version) from an artifact directory or a joblib file"""
+    if has_manifest(path):
+        artifact = load_artifact(path)
+        return artifact, artifact.features, artifact.version
+    model, feature_names = load_joblib_artifacts(path)
+    return model, feature_names, f"joblib:{os.path.basename(path)}"
+
+
+def _delta_bucket(delta):
+    for i, bound in enumerate(DELTA_BUCKETS):
+        if delta <= bound:
+            return i
+    return len(DELTA_BUCKETS) - 1
+
+
+class _Stats:
+    """Running band agreement and score delta aggregates"""
+
+    def __init__(self):
+        self.n = 0
+        self.agree = 0
+        self.transitions = Counter()
+        self.sum_abs_delta = 0.0
+        self.max_abs_delta = 0.0
+        self.delta_hist = [0] * len(DELTA_BUCKETS)
+
+    def add(self, primary, candidate):
+        delta = abs(candidate["risk_score"] - primary["risk_score"]) * 100.0
+        self.n += 1
+        if candidate["risk_level"] == primary["risk_level"]:
+            self.agree += 1
+        else:
+            self.transitions[f"{primary['risk_level']}>{candidate['risk_level']}"] += 1
+        self.sum_abs_delta += delta
+        self.max_abs_delta = max(self.max_abs_delta, delta)
+        self.delta_hist[_delta_bucket(delta)] += 1
+
+    def merge(self, record):
+        self.n += record["n"]
+        self.agree += record["agree"]
+        self.transitions.update(record["transitions"])
+        self.sum_abs_delta += record["sum_abs_delta"]
+        self.max_abs_delta = max(self.max_abs_delta, record["max_abs_delta"])
+        self.delta_hist = [a + b for a, b in zip(self.delta_hist, record["delta_hist"])]
+
+    def record(self):
+        return {
+            "n": self.n,
+            "agree": self.agree,
+            "transitions": dict(self.transitions),
+            "sum_abs_delta": round(self.sum_abs_delta, 4),
+            "max_abs_delta": round(self.max_abs_delta, 4),
+            "delta_hist": list(self.delta_hist),
+        }
+
+    def summary(self):
+        return {
+            "requests": self.n,
+            "band_agreement": round(self.agree / self.n, 4) if self.n else None,
+            "band_changes": self.n - self.agree,
+            "transitions": dict(self.transitions.most_common()),
+            "mean_abs_delta_pct": round(self.sum_abs_delta / self.n, 3) if self.n else None,
+            "max_abs_delta_pct": round(self.max_abs_delta, 3),
+            "abs_delta_pct_histogram": {f"<={b}": c for b, c in zip(DELTA_BUCKETS, self.delta_hist)},
+        }
+
+
+class ShadowScorer:
+    """
+    Background scorer for a candidate model
+
+    Args:
+        candidate_path (str): Candidate artifact directory or joblib file
+        log_path (str): JSONL log of per-flush aggregates (None keeps stats in memory only)
+        batch_size (int): Maximum requests scored per candidate call
+        idle_ms (float): Quiet time after the last submission before a batch is scored
+        max_delay_ms (float): Longest a request waits for a quiet gap
+        max_queue (int): Submissions queued beyond this are dropped from the shadow
+    """
+
+    def __init__(self, candidate_path, log_path=None, batch_size=256, idle_ms=20.0, max_delay_ms=2000.0,
+                 max_queue=10000):
+        self.model, self.feature_names, self.version = load_candidate(candidate_path)
+        self.log_path = log_path
+        self.batch_size = batch_size
+        self.idle = idle_ms / 1000.0
+        self.max_delay = max_delay_ms / 1000.0
+        self.max_queue = max_queue
+        # A plain deque polled by the worker: submitting never wakes another
+        # thread, which would cost the serving thread a GIL handoff
+        self._pending = deque()
+        self._last_submit = 0.0
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.dropped = 0
+        self.errors = 0
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="shadow-scorer", daemon=True)
+        self._thread.start()
+
+    def submit(self, user_inputs, primary_results, primary_version, score_fn=predict_risk_with_model):
+        """Queue served requests for shadow scoring; never blocks"""
+        if len(self._pending) >= self.max_queue:
+            self.dropped += len(user_inputs)
+            return
+        now = time.monotonic()
+        self._pending.append((score_fn, primary_version, user_inputs, primary_results, now))
+        self._last_submit = now
+
+    def close(self, timeout=5.0):
+        """Score what is queued, then stop the worker"""
+        self._stop_event.set()
+        self._thread.join(timeout)
+
+    def summary(self):
+        """Aggregates since start, per serving version"""
+        with self._lock:
+            by_primary = {primary: stats.summary() for primary, stats in self._stats.items()}
+        return {
+            "candidate": self.version,
+            "queued": len(self._pending),
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "by_primary_version": by_primary,
+        }
+
+    def _run(self):
+        while not self._stop_event.wait(self.idle):
+            if self._due():
+                self._score(self._take())
+        while self._pending:
+            self._score(self._take())
+
+    def _due(self):
+        if not self._pending:
+            return False
+        now = time.monotonic()
+        return (now - self._last_submit >= self.idle
+                or now - self._pending[0][4] >= self.max_delay
+                or len(self._pending) >= self.batch_size)
+
+    def _take(self):
+        entries, count = [], 0
+        while self._pending and count < self.batch_size:
+            entry = self._pending.popleft()
+            entries.append(entry)
+            count += len(entry[2])
+        return entries
+
+    def _score(self, entries):
+        # One candidate call per (score function, serving version) group
+        groups = {}
+        for score_fn, primary_version, user_inputs, primary_results, _ in entries:
+            group = groups.setdefault((score_fn, primary_version), ([], []))
+            group[0].extend(user_inputs)
+            group[1].extend(primary_results)
+
+        for (score_fn, primary_version), (user_inputs, primary_results) in groups.items():
+            try:
+                candidate_results = score_fn(self.model, self.feature_names, user_inputs)
+            except Exception as e:
+                self.errors += len(user_inputs)
+                print(f"Shadow scoring failed: {e}", file=sys.stderr)
+                continue
+            batch = _Stats()
+            for primary, candidate in zip(primary_results, candidate_results):
+                batch.add(primary, candidate)
+            with self._lock:
+                self._stats.setdefault(primary_version, _Stats()).merge(batch.record())
+            if self.log_path:
+                record = dict(ts=time.strftime("%Y-%m-%dT%H:%M:%S"), primary=primary_version,
+                              candidate=self.version, **batch.record())
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+
+def summarize_log(path):
+    """Aggregate a shadow log per (serving, candidate) version pair"""
+    stats = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                stats.setdefault(f"{record['primary']} vs {record['candidate']}", _Stats()).merge(record)
+    return {pair: s.summary() for pair, s in stats.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a shadow scoring log")
+    parser.add_argument("log", help="JSONL log written by ShadowScorer")
+    args = parser.parse_args()
+    print(json.dumps(summarize_log(args.log), indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Single-flight Module for Stillbirth Risk Assessment
+Coalesces identical requests that are in flight at the same time: the first
+caller for a key computes the result, callers arriving meanwhile wait for
+it and share it instead of repeating the work
+
+Used for scoring and LLM explanations in the app (a double-clicked Evaluate,
+two sessions assessing the same case) and for /score, /explain and /report
+in the API. Keys are the result store's canonical keys (result_store.py),
+so requests that differ only in ways the model ignores coalesce too. Only
+concurrent calls are shared; repeats after a result is back are the result
+store's job.
+
+Time spent per call goes to the singleflight_seconds histogram, labelled
+by flight and role ("leader" computed, "follower" waited); the follower
+count is the duplicate work suppressed.
+"""
+
+import threading
+import time
+from concurrent.futures import Future
+
+from metrics import histogram
+
+FLIGHT_SECONDS = histogram(
+    "singleflight_seconds",
+    "Time per coalesced call: leaders computed the result, followers shared it",
+    ("flight", "role")
+)
+
+
+class _LeaderAborted(Exception):
+    """The leader stopped without a result (e.g. its Streamlit run was interrupted)"""
+
+
+class SingleFlight:
+    """
+    Per-key coalescing of concurrent calls, shared between threads
+
+    Args:
+        name (str): Label in stats and metrics
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self.calls = 0
+        self.executed = 0
+        self.shared = 0
+        self.failed = 0
+
+    def do(self, key, fn):
+        """
+        fn(), or the result of the identical call already in flight
+
+        Every caller gets the same object back, so callers that modify the
+        result should copy it. An exception raised by fn is raised in every
+        caller. If the leader is interrupted without an exception (Streamlit
+        stopping its rerun), each follower computes fn itself.
+
+        Args:
+            key: Hashable canonical request
+            fn (callable): Computes the result
+        """
+        start = time.perf_counter()
+        with self._lock:
+            self.calls += 1
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+                self.executed += 1
+            else:
+                self.shared += 1
+
+        if leader:
+            try:
+                result = fn()
+            except Exception as e:
+                future.set_exception(e)
+                with self._lock:
+                    self.failed += 1
+                raise
+            except BaseException:
+                future.set_exception(_LeaderAborted())
+                raise
+            else:
+                future.set_result(result)
+            finally:
+                with self._lock:
+                    del self._in_flight[key]
+                FLIGHT_SECONDS.observe(time.perf_counter() - start, self.name, "leader")
+            return result
+
+        try:
+            return future.result()
+        except _LeaderAborted:
+            return fn()
+        finally:
+            FLIGHT_SECONDS.observe(time.perf_counter() - start, self.name, "follower")
+
+    def stats(self):
+        """
+        Returns:
+            dict: calls, executed (leaders), shared (followers: duplicate
+            work suppressed), failed and in_flight
+        """
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executed": self.executed,
+                "shared": self.shared,
+                "failed": self.failed,
+                "in_flight": len(self._in_flight),
+            }
@@ -0,0 +1,298 @@
+"""
+Spool Worker for Stillbirth Risk Assessment
+Tails a JSONL spool of scoring requests and appends one result line per
+request to a companion output file
+
+    python spool.py spool/requests.jsonl                    # runs until stopped
+    python spool.py spool/requests.jsonl --once             # catch up and exit
+
+Each request line is a user_input dict (the form shape); an optional
+"request_id" is copied to its result. Results go to <spool>.results.jsonl:
+
+    {"offset": 1234, "request_id": "a1", "result": {"risk_percentage": 72, ...}}
+    {"offset": 1391, "errors": ["bmi: 80 is outside 16.0-45.0"]}
+
+"offset" is the byte offset of the request line in the spool. Complete
+lines are read in groups of up to --max-batch, validated and scored as one
+batch (validation.py), and appended with a single write. The output is
+fsynced once per group commit: every --commit-ms, or sooner when
+--commit-rows results are pending or the spool is idle. Only then is the
+checkpoint (<spool>.offset: input offset and output size) replaced
+atomically. After a crash the output is cut back to the checkpointed size
+and reading resumes at the checkpointed offset, so every request gets
+exactly one result line. A line still missing its newline is left for the
+next read.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+from model_manager import ModelManager
+from preprocessing import predict_risk_columns
+from validation import validate_inputs
+
+SPOOL_PATH = os.getenv("SPOOL_PATH", os.path.join("spool", "requests.jsonl"))
+
+DEFAULT_MAX_BATCH = 4096
+DEFAULT_COMMIT_MS = 50.0
+DEFAULT_COMMIT_ROWS = 16384
+DEFAULT_POLL_MS = 20.0
+
+# Bytes read from the spool at a time (a single longer line is still read whole)
+READ_BYTES = 4 << 20
+
+_ENCODER = json.JSONEncoder(ensure_ascii=False)
+
+
+class SpoolError(Exception):
+    """Spool, output and checkpoint disagree (e.g. the spool was truncated)"""
+
+
+def _fsync_dir(path):
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _parse(line):
+    try:
+        return json.loads(line)
+    except ValueError as e:
+        return e
+
+
+def read_checkpoint(path):
+    """(input offset, output bytes, requests) from a checkpoint file, zeros if absent"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return 0, 0, 0
+    except ValueError as e:
+        raise SpoolError(f"unreadable checkpoint {path}: {e}") from e
+    return state["offset"], state["output_bytes"], state.get("requests", 0)
+
+
+class SpoolWorker:
+    """
+    Scores a growing JSONL spool into a results file, resumable after a crash
+
+    Args:
+        spool_path (str): JSONL file of user_input dicts (appended by producers)
+        output_path (str): Results file (default <spool>.results.jsonl)
+        checkpoint_path (str): Offset file (default <spool>.offset)
+        manager (ModelManager): Serving model (default: a new one, hot-reloading)
+        max_batch (int): Request lines scored together
+        commit_ms (float): Longest time results stay unsynced
+        commit_rows (int): Pending results that force a commit
+    """
+
+    def __init__(self, spool_path, output_path=None, checkpoint_path=None, manager=None,
+                 max_batch=DEFAULT_MAX_BATCH, commit_ms=DEFAULT_COMMIT_MS, commit_rows=DEFAULT_COMMIT_ROWS):
+        base = os.path.splitext(spool_path)[0]
+        self.spool_path = spool_path
+        self.output_path = output_path or f"{base}.results.jsonl"
+        self.checkpoint_path = checkpoint_path or f"{base}.offset"
+        self.manager = manager or ModelManager()
+        self.max_batch = max_batch
+        self.commit_ms = commit_ms
+        self.commit_rows = commit_rows
+
+        self.offset, committed_bytes, self.requests = read_checkpoint(self.checkpoint_path)
+        self.committed_offset = self.offset
+        self.committed_requests = self.requests
+        self.commits = 0
+        self.invalid = 0
+        self._pending_rows = 0
+        self._last_commit = time.monotonic()
+        self._stop_event = threading.Event()
+
+        if not os.path.exists(self.spool_path):
+            open(self.spool_path, "ab").close()
+        if os.path.getsize(self.spool_path) < self.offset:
+            raise SpoolError(f"{self.spool_path} is shorter than the checkpointed offset {self.offset}")
+        self._in = open(self.spool_path, "rb")
+
+        # Results written after the last checkpoint were never acknowledged:
+        # cut them off, their requests are read again from self.offset
+        self._out = open(self.output_path, "ab")
+        size = os.fstat(self._out.fileno()).st_size
+        if size < committed_bytes:
+            raise SpoolError(f"{self.output_path} is shorter than the checkpointed size {committed_bytes}")
+        if size > committed_bytes:
+            self._out.truncate(committed_bytes)
+            os.fsync(self._out.fileno())
+        self.output_bytes = committed_bytes
+
+    def _read_lines(self):
+        """Up to max_batch complete lines from self.offset, with their offsets"""
+        self._in.seek(self.offset)
+        data = self._in.read(READ_BYTES)
+        while data and b"\n" not in data and len(data) % READ_BYTES == 0:
+            more = self._in.read(READ_BYTES)
+            if not more:
+                break
+            data += more
+        end = data.rfind(b"\n")
+        if end < 0:
+            return [], self.offset
+        lines, offsets = [], []
+        position = self.offset
+        for line in data[:end + 1].split(b"\n")[:-1]:
+            offsets.append(position)
+            lines.append(line)
+            position += len(line) + 1
+            if len(lines) == self.max_batch:
+                break
+        return list(zip(offsets, lines)), position
+
+    def _score(self, entries):
+        """Result line (bytes) for every non-blank request line"""
+        entries = [(offset, line) for offset, line in entries if line.strip()]
+        # Each line on its own: joined into one array, fragments of bad lines
+        # could parse as valid requests and shift results onto other lines
+        parsed = [_parse(line) for _, line in entries]
+
+        records, rows, results = [], [], []
+        for (offset, _), request in zip(entries, parsed):
+            if isinstance(request, ValueError):
+                results.append({"offset": offset, "errors": [f"invalid JSON: {request}"]})
+                continue
+            if not isinstance(request, dict):
+                results.append({"offset": offset, "errors": ["invalid JSON: not a JSON object"]})
+                continue
+            entry = {"offset": offset}
+            if "request_id" in request:
+                entry["request_id"] = request["request_id"]
+            results.append(entry)
+            rows.append(entry)
+            records.append(request)
+
+        report = validate_inputs(records)
+        if report.valid.any():
+            snapshot = self.manager.current()
+            scored = iter(predict_risk_columns(snapshot.model, snapshot.feature_names, report.columns[report.valid]))
+            for entry, ok in zip(rows, report.valid):
+                if ok:
+                    entry["result"] = dict(next(scored), model_version=snapshot.version)
+        for row, messages in report.errors.items():
+            rows[row]["errors"] = messages
+        self.invalid += sum("errors" in r for r in results)
+        return "".join(_ENCODER.encode(r) + "\n" for r in results).encode("utf-8")
+
+    def poll(self):
+        """
+        Score the next group of complete request lines, if any
+
+        Returns:
+            int: Request lines consumed
+        """
+        entries, end = self._read_lines()
+        if not entries:
+            return 0
+        out = self._score(entries)
+        self._out.write(out)
+        self._out.flush()
+        self.output_bytes += len(out)
+        self.offset = end
+        self.requests += out.count(b"\n")
+        self._pending_rows += len(entries)
+        return len(entries)
+
+    def commit(self):
+        """fsync the results written so far, then checkpoint past their requests"""
+        if self.offset == self.committed_offset:
+            return
+        os.fsync(self._out.fileno())
+        tmp = f"{self.checkpoint_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"spool": os.path.abspath(self.spool_path), "offset": self.offset,
+                       "output_bytes": self.output_bytes, "requests": self.requests}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.checkpoint_path)
+        _fsync_dir(self.checkpoint_path)
+        self.committed_offset = self.offset
+        self.committed_requests = self.requests
+        self.commits += 1
+        self._pending_rows = 0
+        self._last_commit = time.monotonic()
+
+    def run(self, poll_ms=DEFAULT_POLL_MS, once=False):
+        """
+        Poll and group-commit until stop() (or, with once, until caught up)
+
+        Returns:
+            dict: stats()
+        """
+        try:
+            while not self._stop_event.is_set():
+                consumed = self.poll()
+                due = (time.monotonic() - self._last_commit) * 1000.0 >= self.commit_ms
+                if self._pending_rows and (not consumed or due or self._pending_rows >= self.commit_rows):
+                    self.commit()
+                if not consumed:
+                    if once:
+                        break
+                    self._stop_event.wait(poll_ms / 1000.0)
+        finally:
+            self.commit()
+        return self.stats()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "invalid": self.invalid,
+            "offset": self.offset,
+            "committed_offset": self.committed_offset,
+            "commits": self.commits,
+            "lag_bytes": max(os.path.getsize(self.spool_path) - self.offset, 0),
+        }
+
+    def close(self):
+        self.commit()
+        self._in.close()
+        self._out.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a JSONL spool of requests as it grows")
+    parser.add_argument("spool", nargs="?", default=SPOOL_PATH, help="JSONL file of user_input dicts")
+    parser.add_argument("--out", help="Results file (default <spool>.results.jsonl)")
+    parser.add_argument("--checkpoint", help="Offset file (default <spool>.offset)")
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH)
+    parser.add_argument("--commit-ms", type=float, default=DEFAULT_COMMIT_MS,
+                        help="Longest time results stay unsynced (one fsync per commit)")
+    parser.add_argument("--commit-rows", type=int, default=DEFAULT_COMMIT_ROWS)
+    parser.add_argument("--poll-ms", type=float, default=DEFAULT_POLL_MS)
+    parser.add_argument("--once", action="store_true", help="Exit when caught up with the spool")
+    args = parser.parse_args()
+
+    if os.path.dirname(args.spool):
+        os.makedirs(os.path.dirname(args.spool), exist_ok=True)
+    worker = SpoolWorker(args.spool, args.out, args.checkpoint, ModelManager(poll_seconds=0) if args.once else ModelManager(),
+                         args.max_batch, args.commit_ms, args.commit_rows)
+    start = time.perf_counter()
+    try:
+        stats = worker.run(args.poll_ms, args.once)
+    except KeyboardInterrupt:
+        stats = worker.stats()
+    finally:
+        worker.close()
+    elapsed = time.perf_counter() - start
+    stats["elapsed_s"] = round(elapsed, 3)
+    print(json.dumps(stats, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
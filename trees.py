@@ -0,0 +1,182 @@
+"""
+Tree Ensemble Module for Stillbirth Risk Assessment
+Flattened, array-based form of the XGBoost ensemble, evaluated with numpy
+
+All trees are stored as one set of node arrays (children, split feature,
+threshold, default direction, leaf value) so they can be saved as plain
+.npy files, memory-mapped, and walked for many rows and trees at once.
+Leaves point to themselves, so every tree is walked for max_depth steps.
+Margins are accumulated tree by tree in float32, in booster order, the
+same way XGBoost's CPU predictor does.
+"""
+
+import json
+import weakref
+
+import numpy as np
+
+# Arrays that make up a flattened ensemble, as saved in model artifacts
+ARRAY_NAMES = ("children", "feature", "threshold", "default_left", "value", "roots")
+
+# Flattened trees for models that don't carry them (joblib XGBClassifier)
+_ensembles = weakref.WeakKeyDictionary()
+
+
+class TreeEnsemble:
+    """
+    Flattened binary:logistic tree ensemble
+
+    Args:
+        children (np.ndarray): (nodes, 2) int32 left/right child; leaves point to themselves
+        feature (np.ndarray): (nodes,) int32 split feature index (0 at leaves)
+        threshold (np.ndarray): (nodes,) float32 split value; x < threshold goes left
+        default_left (np.ndarray): (nodes,) bool direction for missing values
+        value (np.ndarray): (nodes,) float32 leaf value (0 at internal nodes)
+        roots (np.ndarray): (trees,) int32 root node of each tree
+        base_margin (float): Margin before any tree is added
+        max_depth (int): Deepest root-to-leaf path over all trees
+    """
+
+    def __init__(self, children, feature, threshold, default_left, value, roots, base_margin, max_depth):
+        self.children = children
+        self.feature = feature
+        self.threshold = threshold
+        self.default_left = default_left
+        self.value = value
+        self.roots = roots
+        self.base_margin = np.float32(base_margin)
+        self.max_depth = int(max_depth)
+        self._usage = None
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def n_nodes(self):
+        return len(self.value)
+
+    @classmethod
+    def from_booster(cls, booster):
+        """Flatten a binary:logistic xgboost.Booster"""
+        learner = json.loads(booster.save_raw("json"))["learner"]
+        objective = learner["objective"]["name"]
+        if objective != "binary:logistic":
+            raise ValueError(f"unsupported objective {objective!r}")
+        base_score = float(learner["learner_model_param"]["base_score"])
+        trees = learner["gradient_booster"]["model"]["trees"]
+
+        children, feature, threshold, default_left, value, roots, depths = [], [], [], [], [], [], []
+        offset = 0
+        for tree in trees:
+            if any(tree["split_type"]):
+                raise ValueError("categorical splits are not supported")
+            left = np.asarray(tree["left_children"], dtype=np.int64)
+            right = np.asarray(tree["right_children"], dtype=np.int64)
+            is_leaf = left == -1
+            own = np.arange(len(left))
+            children.append(np.stack([np.where(is_leaf, own, left), np.where(is_leaf, own, right)], axis=1) + offset)
+            feature.append(np.where(is_leaf, 0, tree["split_indices"]))
+            threshold.append(np.where(is_leaf, 0.0, tree["split_conditions"]))
+            default_left.append(np.asarray(tree["default_left"], dtype=bool) & ~is_leaf)
+            value.append(np.where(is_leaf, tree["split_conditions"], 0.0))
+            roots.append(offset)
+            depths.append(_tree_depth(left, right))
+            offset += len(left)
+
+        return cls(
+            children=np.concatenate(children).astype(np.int32),
+            feature=np.concatenate(feature).astype(np.int32),
+            threshold=np.concatenate(threshold).astype(np.float32),
+            default_left=np.concatenate(default_left),
+            value=np.concatenate(value).astype(np.float32),
+            roots=np.asarray(roots, dtype=np.int32),
+            base_margin=np.log(base_score / (1.0 - base_score)),
+            max_depth=max(depths),
+        )
+
+    def arrays(self):
+        """The node arrays by name, for saving"""
+        return {name: getattr(self, name) for name in ARRAY_NAMES}
+
+    def leaf_indices(self, X, trees=None):
+        """
+        Leaf node reached in each tree for each row
+
+        Args:
+            X (np.ndarray): (rows, features) float32 aligned feature matrix
+            trees (np.ndarray): Optional subset of tree indices to walk
+
+        Returns:
+            np.ndarray: (rows, len(trees)) int32 global node indices
+        """
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        roots = self.roots if trees is None else self.roots[trees]
+        node = np.broadcast_to(roots, (len(X), len(roots))).copy()
+        rows = np.arange(len(X))[:, None]
+        has_missing = np.isnan(X).any()
+        for _ in range(self.max_depth):
+            x = X[rows, self.feature[node]]
+            go_right = ~(x < self.threshold[node])
+            if has_missing:
+                go_right = np.where(np.isnan(x), ~self.default_left[node], go_right)
+            node = self.children[node, go_right.view(np.int8)]
+        return node
+
+    def margin(self, X):
+        """Raw margin per row: base margin plus every tree's leaf value"""
+        leaves = self.value[self.leaf_indices(X)]
+        return accumulate(self.base_margin, leaves)
+
+    def predict_alive_proba(self, X):
+        """Probability of the positive class (isalive=1) per row"""
+        return sigmoid(self.margin(X))
+
+    def feature_usage(self, n_features):
+        """
+        Which trees split on which features
+
+        Returns:
+            np.ndarray: (n_features, n_trees) bool, True where the tree has a
+            split on the feature
+        """
+        if self._usage is None or self._usage.shape[0] != n_features:
+            internal = self.children[:, 0] != np.arange(self.n_nodes)
+            tree_of = np.searchsorted(self.roots, np.arange(self.n_nodes), side="right") - 1
+            usage = np.zeros((n_features, self.n_trees), dtype=bool)
+            usage[self.feature[internal], tree_of[internal]] = True
+            self._usage = usage
+        return self._usage
+
+
+def tree_ensemble(model):
+    """The model's flattened trees (built once for models that don't carry them)"""
+    trees = getattr(model, "trees", None)
+    if isinstance(trees, TreeEnsemble):
+        return trees
+    if model not in _ensembles:
+        _ensembles[model] = TreeEnsemble.from_booster(model.get_booster())
+    return _ensembles[model]
+
+
+def accumulate(base_margin, leaf_values):
+    """base_margin (scalar or per row) + leaf values summed left to right in float32, per row"""
+    columns = np.empty((leaf_values.shape[0], leaf_values.shape[1] + 1), dtype=np.float32)
+    columns[:, 0] = base_margin
+    columns[:, 1:] = leaf_values
+    return np.cumsum(columns, axis=1, dtype=np.float32)[:, -1]
+
+
+def sigmoid(margin):
+    """XGBoost's float32 logistic; exp is rounded from float64 like libm's expf"""
+    margin = np.asarray(margin, dtype=np.float32)
+    e = np.exp(-margin.astype(np.float64)).astype(np.float32)
+    return np.float32(1.0) / (e + np.float32(1.0))
+
+
+def _tree_depth(left, right):
+    depth = np.zeros(len(left), dtype=np.int64)
+    for node in range(len(left)):
+        if left[node] != -1:
+            depth[left[node]] = depth[right[node]] = depth[node] + 1
+    return int(depth.max())
@@ -0,0 +1,221 @@
+"""
+Input Validation for Stillbirth Risk Assessment
+Checks user inputs against the form's bounds and choices (form_schema.py)
+for the paths that don't go through the Streamlit widgets: the API and
+batch scoring
+
+Inputs are validated a column at a time: every rule is a NumPy mask over
+the whole batch, and error messages are only built for the rows that fail.
+Valid rows go straight to features_matrix_from_columns, so a large file is
+validated and scored without a per-row Python loop.
+
+    number fields   JSON numbers within the form's [min, max]; booleans and
+                    numeric strings are rejected
+    choice fields   one of the accepted values (yes/no also in Arabic, any
+                    case and surrounding spaces)
+    absent / null   the form default, as in preprocessing
+    other fields    ignored
+
+    python validation.py inputs.jsonl --errors errors.jsonl
+"""
+
+import argparse
+import json
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from form_schema import NUMBER_INPUTS
+
+# Accepted values of the selectbox fields (as sent by API and batch clients)
+ACCEPTED_CHOICES = {
+    "diabetes": ("no", "yes", "لا", "نعم"),
+    "hypertension": ("no", "yes", "لا", "نعم"),
+    "twins": (0, 1),
+    "deliverytype": (1, 2, 3),
+}
+
+# valid: bool mask per row; errors: {row: [messages]} for invalid rows;
+# columns: the inputs with clean types (values of invalid rows unspecified)
+ValidationReport = namedtuple("ValidationReport", "valid errors columns")
+
+
+def _numbers(column):
+    """(float64 values, mask of cells that are present but not numbers)"""
+    if pd.api.types.is_bool_dtype(column):
+        return np.full(len(column), np.nan), column.notna().to_numpy()
+    if pd.api.types.is_numeric_dtype(column):
+        return column.to_numpy(dtype=np.float64), np.zeros(len(column), dtype=bool)
+    # Mixed column: the only case that looks at individual cells
+    is_number = column.map(_is_number)
+    values = pd.to_numeric(column.where(is_number), errors="coerce").to_numpy(dtype=np.float64)
+    return values, (column.notna() & ~is_number).to_numpy()
+
+
+def _shown(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)  # ints in a column with nulls come back as floats
+    return value
+
+
+def _add_errors(errors, rows, column, message):
+    for row in np.flatnonzero(rows):
+        errors.setdefault(int(row), []).append(message.format(value=_shown(column.iat[row])))
+
+
+def _is_number(value):
+    return isinstance(value, (int, float, np.number)) and not isinstance(value, (bool, np.bool_))
+
+
+def validate_columns(frame):
+    """
+    Validate a dataframe of user inputs (one row per input)
+
+    Returns:
+        ValidationReport
+    """
+    n = len(frame)
+    invalid = np.zeros(n, dtype=bool)
+    errors = {}
+    columns = {}
+
+    for field, (low, high, _, _) in NUMBER_INPUTS.items():
+        if field not in frame:
+            continue
+        column = frame[field]
+        values, not_number = _numbers(column)
+        with np.errstate(invalid="ignore"):
+            out_of_range = ~np.isnan(values) & ((values < low) | (values > high) | ~np.isfinite(values))
+        _add_errors(errors, not_number, column, f"{field}: {{value!r}} is not a number")
+        _add_errors(errors, out_of_range, column, f"{field}: {{value!r}} is outside {low}-{high}")
+        invalid |= not_number | out_of_range
+        columns[field] = values
+
+    for field, accepted in ACCEPTED_CHOICES.items():
+        if field not in frame:
+            continue
+        column = frame[field]
+        present = column.notna().to_numpy()
+        if isinstance(accepted[0], str):
+            ok = column.isin(accepted).to_numpy()
+            cleaned = column.to_numpy(dtype=object, copy=True)
+            retry = present & ~ok
+            if retry.any() and pd.api.types.is_object_dtype(column):
+                # Only near-misses are normalised; .str gives NaN for non-strings
+                normalised = column[retry].str.strip().str.lower()
+                cleaned[retry] = normalised.to_numpy()
+                ok[retry] = normalised.isin(accepted).to_numpy()
+            columns[field] = cleaned
+        else:
+            values, not_number = _numbers(column)
+            ok = ~not_number & np.isin(values, accepted)
+            columns[field] = values
+        bad = present & ~ok
+        _add_errors(errors, bad, column, f"{field}: {{value!r}} is not one of {', '.join(map(str, accepted))}")
+        invalid |= bad
+
+    return ValidationReport(~invalid, dict(sorted(errors.items())), pd.DataFrame(columns, index=frame.index))
+
+
+def validate_inputs(user_inputs):
+    """validate_columns for a list of user_input dicts"""
+    frame = pd.DataFrame.from_records(user_inputs) if user_inputs else pd.DataFrame()
+    return validate_columns(frame.reset_index(drop=True))
+
+
+def clean_records(report):
+    """The valid rows as user_input dicts (nulls dropped, choices normalised)"""
+    records = report.columns[report.valid].to_dict("records")
+    return [{k: v for k, v in r.items() if v is not None and v == v} for r in records]
+
+
+def validate_input(user_input):
+    """
+    The same rules for a single user_input dict, without pandas
+
+    A dataframe round trip costs milliseconds, so single API requests are
+    checked field by field instead.
+
+    Returns:
+        (list, dict): Error messages, and the input with nulls dropped and
+        choices normalised
+    """
+    errors = []
+    clean = {k: v for k, v in user_input.items() if k not in NUMBER_INPUTS and k not in ACCEPTED_CHOICES}
+    for field in [*NUMBER_INPUTS, *ACCEPTED_CHOICES]:
+        value = user_input.get(field)
+        if value is None or (isinstance(value, float) and value != value):
+            continue
+        if field in NUMBER_INPUTS:
+            low, high = NUMBER_INPUTS[field][:2]
+            if not _is_number(value):
+                errors.append(f"{field}: {_shown(value)!r} is not a number")
+                continue
+            if not low <= value <= high:
+                errors.append(f"{field}: {_shown(value)!r} is outside {low}-{high}")
+                continue
+        else:
+            accepted = ACCEPTED_CHOICES[field]
+            if isinstance(accepted[0], str):
+                value = value.strip().lower() if isinstance(value, str) else value
+                ok = isinstance(value, str) and value in accepted
+            else:
+                ok = _is_number(value) and value in accepted
+            if not ok:
+                errors.append(f"{field}: {_shown(user_input[field])!r} is not one of {', '.join(map(str, accepted))}")
+                continue
+        clean[field] = value
+    return errors, clean
+
+
+def read_inputs(path):
+    """JSONL file of user_input dicts as a dataframe (numbers keep their JSON types)"""
+    return pd.read_json(path, lines=True, dtype=False, convert_dates=False)
+
+
+def main():
+    from preprocessing import get_model_artifacts, predict_risk_columns
+
+    parser = argparse.ArgumentParser(description="Validate (and time scoring of) a JSONL input file")
+    parser.add_argument("inputs", help="JSONL file of user_input dicts")
+    parser.add_argument("--errors", help="Write {'row': n, 'errors': [...]} lines for invalid rows")
+    parser.add_argument("--no-score", action="store_true", help="Skip timing the scoring of the valid rows")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    frame = read_inputs(args.inputs)
+    read_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    report = validate_columns(frame)
+    validate_s = time.perf_counter() - start
+
+    summary = {
+        "rows": len(frame),
+        "valid": int(report.valid.sum()),
+        "invalid": len(report.errors),
+        "read_s": round(read_s, 3),
+        "validate_s": round(validate_s, 3),
+    }
+    if not args.no_score:
+        model, feature_names = get_model_artifacts()
+        start = time.perf_counter()
+        predict_risk_columns(model, feature_names, report.columns[report.valid])
+        summary["score_s"] = round(time.perf_counter() - start, 3)
+        summary["validate_vs_score"] = round(validate_s / max(summary["score_s"], 1e-9), 4)
+
+    if args.errors:
+        with open(args.errors, "w", encoding="utf-8") as f:
+            for row, messages in sorted(report.errors.items()):
+                f.write(json.dumps({"row": row, "errors": messages}, ensure_ascii=False) + "\n")
+    print(json.dumps(summary, indent=2))
+    return 0 if not report.errors else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
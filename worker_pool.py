@@ -0,0 +1,245 @@
+"""
+Worker Pool Module for Stillbirth Risk Assessment
+Multi-process batch scoring: the model is loaded once in the parent and
+forked workers share its pages copy-on-write
+
+    python worker_pool.py inputs.jsonl results.jsonl --workers 4
+    python worker_pool.py inputs.jsonl results.jsonl --explain --arabic
+    python worker_pool.py inputs.jsonl results.jsonl --store results.db
+
+Each input line is a user_input dict (the Streamlit form shape); each output
+line is the matching predict_risk result, or {"errors": [...]} for a line
+outside the form's ranges (validation.py). Valid rows are sent to the
+workers as column chunks, so no per-row dicts are built. With --explain,
+each result also gets the rule-based explanation, evaluated for the whole
+file at once (report.explanations_for_levels). With --store (or
+RESULT_STORE_PATH), rows already in the result store (result_store.py) are
+not scored again, and new ones are added. Requires the 'fork' start
+method (Linux/macOS).
+"""
+
+import argparse
+import gc
+import json
+import multiprocessing as mp
+import os
+import time
+
+import pandas as pd
+
+from preprocessing import (features_matrix_from_columns, get_model_artifacts, predict_risk_batch,
+                           predict_risk_columns)
+from report import EXPLANATION_RULES, explanations_for_levels
+from result_store import RESULT_STORE_PATH, model_identity, open_store, score_keys
+from validation import read_inputs, validate_columns
+
+DEFAULT_CHUNK_SIZE = 1024
+
+
+def _worker_main(task_queue, result_queue):
+    # The model was loaded by the parent before fork; only the thread setting
+    # is changed here so N workers don't oversubscribe the cores
+    model, feature_names = get_model_artifacts()
+    model.get_booster().set_param({"nthread": 1})
+    while True:
+        task = task_queue.get()
+        if task is None:
+            return
+        call, index, chunk = task
+        try:
+            if isinstance(chunk, pd.DataFrame):
+                scored = predict_risk_columns(model, feature_names, chunk)
+            else:
+                scored = predict_risk_batch(chunk)
+            result_queue.put((call, index, scored, None))
+        except Exception as e:
+            result_queue.put((call, index, None, repr(e)))
+
+
+def process_memory(pid):
+    """
+    Memory of one process from /proc/<pid>/smaps_rollup, in kB
+
+    Returns:
+        dict: rss, pss, shared and private (the process's own overhead),
+              or None where /proc is unavailable
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            fields = {}
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1])
+    except OSError:
+        return None
+    return {
+        "rss_kb": fields.get("Rss", 0),
+        "pss_kb": fields.get("Pss", 0),
+        "shared_kb": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+        "private_kb": fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0),
+    }
+
+
+class ScoringPool:
+    """
+    Pool of forked scoring workers fed from a shared queue of chunks
+
+    Args:
+        workers (int): Number of worker processes (default: CPU count)
+        chunk_size (int): Inputs per task; each chunk is one model call
+    """
+
+    def __init__(self, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        ctx = mp.get_context("fork")
+        self.chunk_size = chunk_size
+
+        # Load once in the parent (booster included; artifacts load it lazily),
+        # then freeze the GC so collections in the children don't touch (and
+        # copy) the inherited objects
+        get_model_artifacts()[0].get_booster()
+        gc.collect()
+        gc.freeze()
+
+        self._tasks = ctx.Queue()
+        self._results = ctx.Queue()
+        self._calls = 0
+        self._procs = [
+            ctx.Process(target=_worker_main, args=(self._tasks, self._results), daemon=True)
+            for _ in range(workers or os.cpu_count() or 1)
+        ]
+        for p in self._procs:
+            p.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def map(self, user_inputs):
+        """
+        Score all inputs across the workers; results keep input order
+
+        Args:
+            user_inputs: List of user_input dicts, or a dataframe of validated
+                user_input columns (validation.validate_columns)
+        """
+        # Results are tagged with the call, so none can leak into a later one
+        self._calls += 1
+        call = self._calls
+        chunks = [user_inputs[i:i + self.chunk_size] for i in range(0, len(user_inputs), self.chunk_size)]
+        for index, chunk in enumerate(chunks):
+            self._tasks.put((call, index, chunk))
+
+        # Every chunk's result is read before a failure is raised
+        results = [None] * len(chunks)
+        failed = None
+        received = 0
+        while received < len(chunks):
+            result_call, index, scored, error = self._results.get()
+            if result_call != call:
+                continue
+            received += 1
+            if error is not None and failed is None:
+                failed = f"worker failed on chunk {index}: {error}"
+            results[index] = scored
+        if failed is not None:
+            raise RuntimeError(failed)
+        return [r for chunk in results for r in chunk]
+
+    def memory_report(self):
+        """Parent and per-worker memory; private_kb is each worker's own overhead"""
+        return {
+            "parent": process_memory(os.getpid()),
+            "workers": [dict(pid=p.pid, **(process_memory(p.pid) or {})) for p in self._procs],
+        }
+
+    def close(self):
+        for _ in self._procs:
+            self._tasks.put(None)
+        for p in self._procs:
+            p.join()
+        gc.unfreeze()
+
+
+def map_with_store(pool, store, columns):
+    """
+    pool.map over validated columns, skipping rows whose score is stored
+
+    Returns:
+        (list, int): Results in row order, and rows found in the store
+    """
+    model, feature_names = get_model_artifacts()
+    identity = model_identity(model)
+    if identity is None:
+        print("Result store skipped: the model has no content hash (export it with model_artifact.py)")
+        return pool.map(columns), 0
+    keys = score_keys(identity, feature_names, features_matrix_from_columns(columns, feature_names))
+    found = store.get_many(list(dict.fromkeys(keys)), "score")
+    pending = {}
+    for i, key in enumerate(keys):
+        if key not in found:
+            pending.setdefault(key, i)
+    fresh = dict(zip(pending, pool.map(columns.iloc[list(pending.values())]))) if pending else {}
+    store.put_many(list(fresh.items()), "score")
+    hits = sum(key in found for key in keys)
+    # Stored results may carry the version label of the service that scored them
+    return [fresh[key] if key in fresh else {k: v for k, v in found[key].items() if k != "model_version"}
+            for key in keys], hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-process batch scoring")
+    parser.add_argument("inputs", help="JSONL file of user_input dicts")
+    parser.add_argument("output", help="JSONL file for the results")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--explain", action="store_true", help="Add the rule-based explanation to each result")
+    parser.add_argument("--arabic", action="store_true", help="Arabic explanations")
+    parser.add_argument("--store", default=RESULT_STORE_PATH, help="Result store to reuse and fill")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    frame = read_inputs(args.inputs)
+    report = validate_columns(frame)
+    validate_s = time.perf_counter() - start
+
+    store = open_store(args.store)
+    hits = 0
+    with ScoringPool(args.workers, args.chunk_size) as pool:
+        start = time.perf_counter()
+        if store is not None:
+            results, hits = map_with_store(pool, store, report.columns[report.valid])
+        else:
+            results = pool.map(report.columns[report.valid])
+        elapsed = time.perf_counter() - start
+        memory = pool.memory_report()
+
+    if args.explain:
+        # Validated columns, plus the raw ones the rules read that aren't form fields
+        columns = report.columns[report.valid]
+        extra = [f for f, *_ in EXPLANATION_RULES if f in frame and f not in columns]
+        columns = columns.join(frame.loc[report.valid, extra])
+        start = time.perf_counter()
+        explanations = explanations_for_levels(columns, [r["risk_level"] for r in results], args.arabic)
+        explain_s = time.perf_counter() - start
+        results = [dict(r, explanation=e) for r, e in zip(results, explanations)]
+
+    scored = iter(results)
+    with open(args.output, "w", encoding="utf-8") as f:
+        for i, ok in enumerate(report.valid):
+            f.write(json.dumps(next(scored) if ok else {"errors": report.errors[i]}, ensure_ascii=False) + "\n")
+
+    print(f"Read and validated {len(report.valid)} rows in {validate_s:.2f}s ({len(report.errors)} invalid)")
+    print(f"Scored {len(results)} rows in {elapsed:.2f}s ({len(results) / max(elapsed, 1e-9):,.0f} rows/s)")
+    if store is not None:
+        print(f"Result store: {hits} of {len(results)} rows found, {len(results) - hits} scored")
+        store.close()
+    if args.explain:
+        print(f"Explained {len(results)} rows in {explain_s:.2f}s")
+    print(json.dumps(memory, indent=2))
+
+
+if __name__ == "__main__":
+    main()